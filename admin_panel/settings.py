@@ -57,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryCountMiddleware',  # Заголовок X-DB-Queries (если включен DB_QUERY_COUNT_HEADER)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
@@ -182,3 +183,119 @@ BOT_USERNAME = os.environ.get('BOT_USERNAME', 'dahoai_bot')  # Замените
 
 # Referral system settings
 REFERRAL_BONUS_REQUESTS = int(os.environ.get('REFERRAL_BONUS_REQUESTS', 5))  # Количество бонусных запросов за реферала
+
+# Кэш последних сообщений чатов (используется при сборке истории для ИИ)
+# Записи кэша истории сверяются со сводкой чата (message_count, last_message_at), поэтому
+# 'local' корректен и при нескольких воркерах gunicorn; 'django' делит кэш между ними
+CHAT_HISTORY_CACHE_BACKEND = os.environ.get('CHAT_HISTORY_CACHE_BACKEND', 'local')  # 'local' - память процесса, 'django' - общий кэш Django
+CHAT_HISTORY_CACHE_ALIAS = os.environ.get('CHAT_HISTORY_CACHE_ALIAS', 'default')  # Алиас из CACHES для backend='django'
+CHAT_HISTORY_CACHE_MAX_CHATS = int(os.environ.get('CHAT_HISTORY_CACHE_MAX_CHATS', 1000))  # Сколько активных чатов держать в памяти
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get('CHAT_HISTORY_MAX_MESSAGES', 50))  # Сколько последних сообщений передавать ИИ
+CHAT_HISTORY_CACHE_TTL = int(os.environ.get('CHAT_HISTORY_CACHE_TTL', 900))  # Время жизни записи в секундах
+
+# Ограничения тарифов при обращении к ИИ
+TOKEN_LIMIT_POLICY = os.environ.get('TOKEN_LIMIT_POLICY', 'truncate')  # 'truncate' - обрезать старую историю, 'reject' - отклонить запрос
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', 10000))  # Сколько подсчетов токенов по сообщениям хранить в памяти
+
+# Кэш ответов ИИ для повторяющихся запросов
+COMPLETION_CACHE_ENABLED = os.environ.get('COMPLETION_CACHE_ENABLED', 'False') == 'True'
+COMPLETION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPLETION_CACHE_MAX_ENTRIES', 5000))
+COMPLETION_CACHE_TTL = int(os.environ.get('COMPLETION_CACHE_TTL', 3600))  # Время жизни ответа в секундах
+COMPLETION_CACHE_MAX_MESSAGES = int(os.environ.get('COMPLETION_CACHE_MAX_MESSAGES', 1))  # Кэшировать диалоги не длиннее N сообщений
+COMPLETION_CACHE_HIT_COSTS_REQUEST = os.environ.get('COMPLETION_CACHE_HIT_COSTS_REQUEST', 'True') == 'True'  # Переопределяется в Plan.features
+
+# Провайдеры ИИ (адаптеры моделей описаны в api/llm/registry.py)
+LLM_PROVIDERS = {
+    'openai': {
+        'BASE_URL': os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1'),
+        'API_KEY': OPENAI_API_KEY,
+        'TIMEOUT': int(os.environ.get('OPENAI_TIMEOUT', 60)),  # Таймаут чтения ответа в секундах
+        'MAX_CONCURRENCY': int(os.environ.get('OPENAI_MAX_CONCURRENCY', 10)),  # Одновременных запросов на модель
+        'POOL_SIZE': int(os.environ.get('OPENAI_POOL_SIZE', 10)),  # Постоянных HTTP-соединений на модель
+    },
+    'anthropic': {
+        'BASE_URL': os.environ.get('ANTHROPIC_BASE_URL', 'https://api.anthropic.com/v1'),
+        'API_KEY': os.environ.get('ANTHROPIC_API_KEY'),
+        'TIMEOUT': int(os.environ.get('ANTHROPIC_TIMEOUT', 60)),
+        'MAX_CONCURRENCY': int(os.environ.get('ANTHROPIC_MAX_CONCURRENCY', 10)),
+        'POOL_SIZE': int(os.environ.get('ANTHROPIC_POOL_SIZE', 10)),
+    },
+    'gemini': {
+        'BASE_URL': os.environ.get('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com/v1beta'),
+        'API_KEY': os.environ.get('GEMINI_API_KEY'),
+        'TIMEOUT': int(os.environ.get('GEMINI_TIMEOUT', 60)),
+        'MAX_CONCURRENCY': int(os.environ.get('GEMINI_MAX_CONCURRENCY', 10)),
+        'POOL_SIZE': int(os.environ.get('GEMINI_POOL_SIZE', 10)),
+    },
+}
+
+# Защита провайдеров от перегрузки (см. api/llm/resilience.py).
+# MAX_CONCURRENCY провайдера - верхняя граница адаптивного лимита одновременных запросов
+LLM_RESILIENCE = {
+    'MIN_CONCURRENCY': int(os.environ.get('LLM_MIN_CONCURRENCY', 1)),
+    'LATENCY_TARGET': float(os.environ.get('LLM_LATENCY_TARGET', 20)),  # Ответ дольше (сек) считается перегрузкой
+    'BACKOFF_RATIO': float(os.environ.get('LLM_BACKOFF_RATIO', 0.5)),  # Во сколько раз уменьшать лимит при перегрузке
+    'QUEUE_TIMEOUT': float(os.environ.get('LLM_QUEUE_TIMEOUT', 2)),  # Сколько ждать места в очереди перед 503
+    'FAILURE_THRESHOLD': int(os.environ.get('LLM_BREAKER_FAILURES', 5)),  # Ошибок подряд до размыкания цепи
+    'RESET_TIMEOUT': float(os.environ.get('LLM_BREAKER_RESET_TIMEOUT', 30)),  # Секунд до пробного запроса
+}
+
+# Общая очередь запросов к ИИ (см. api/llm/admission.py), действует в пределах одного процесса.
+# Места делятся между пользователями пропорционально 1 + Plan.priority их тарифа
+LLM_ADMISSION = {
+    'CONCURRENCY': int(os.environ.get('LLM_ADMISSION_CONCURRENCY', 32)),  # Одновременных запросов ко всем моделям
+    'PER_USER_LIMIT': int(os.environ.get('LLM_PER_USER_LIMIT', 2)),  # Запросов одного пользователя в работе и очереди
+    'QUEUE_TIMEOUT': float(os.environ.get('LLM_ADMISSION_QUEUE_TIMEOUT', 5)),  # Сколько ждать в очереди перед 503
+}
+
+# Курсорная пагинация чатов и сообщений (параметр limit не больше *_MAX)
+CHAT_LIST_PAGE_SIZE = int(os.environ.get('CHAT_LIST_PAGE_SIZE', 20))
+CHAT_LIST_PAGE_MAX = int(os.environ.get('CHAT_LIST_PAGE_MAX', 100))
+CHAT_MESSAGES_PAGE_SIZE = int(os.environ.get('CHAT_MESSAGES_PAGE_SIZE', 50))
+CHAT_MESSAGES_PAGE_MAX = int(os.environ.get('CHAT_MESSAGES_PAGE_MAX', 200))
+
+# Архив сообщений неактивных чатов (manage.py archive_chat_messages)
+CHAT_ARCHIVE_IDLE_DAYS = int(os.environ.get('CHAT_ARCHIVE_IDLE_DAYS', 90))  # Дней без сообщений до переноса в архив
+CHAT_ARCHIVE_CHUNK_SIZE = int(os.environ.get('CHAT_ARCHIVE_CHUNK_SIZE', 500))  # Сообщений в одной транзакции
+CHAT_ARCHIVE_COMPRESS_LEVEL = int(os.environ.get('CHAT_ARCHIVE_COMPRESS_LEVEL', 6))  # Уровень сжатия zlib (1-9)
+
+# Поиск по чатам (/api/chats/search/)
+CHAT_SEARCH_PAGE_SIZE = int(os.environ.get('CHAT_SEARCH_PAGE_SIZE', 20))
+CHAT_SEARCH_PAGE_MAX = int(os.environ.get('CHAT_SEARCH_PAGE_MAX', 50))
+CHAT_SEARCH_MAX_PAGES = int(os.environ.get('CHAT_SEARCH_MAX_PAGES', 25))  # Глубже по релевантности не листаем
+
+# Список рефералов (/api/referrals/)
+REFERRALS_PAGE_SIZE = int(os.environ.get('REFERRALS_PAGE_SIZE', 50))
+REFERRALS_PAGE_MAX = int(os.environ.get('REFERRALS_PAGE_MAX', 200))
+# Таблица лидеров по рефералам (см. bot_admin/leaderboard.py)
+LEADERBOARD_REFRESH = float(os.environ.get('LEADERBOARD_REFRESH', 60))  # Как часто перечитывать рейтинг из БД, сек
+LEADERBOARD_TOP_MAX = int(os.environ.get('LEADERBOARD_TOP_MAX', 100))  # Наибольший размер топа в ответе API
+# Глубина дерева рефералов в таблице замыкания (см. bot_admin/referral_tree.py)
+REFERRAL_CLOSURE_MAX_DEPTH = int(os.environ.get('REFERRAL_CLOSURE_MAX_DEPTH', 10))
+
+# Заголовки X-DB-Queries / X-DB-Time в ответах API (для benchmark_chat.py, в продакшене выключено)
+DB_QUERY_COUNT_HEADER = os.environ.get('DB_QUERY_COUNT_HEADER', 'False') == 'True'
+
+# Фоновое удаление пользователей и чатов (см. bot_admin/purge.py)
+PURGE_CHUNK_SIZE = int(os.environ.get('PURGE_CHUNK_SIZE', 1000))  # Строк в одной транзакции
+PURGE_WORKERS = int(os.environ.get('PURGE_WORKERS', 2))  # Фоновых потоков на процесс
+# Задача без отметки о ходе дольше PURGE_LEASE секунд считается прерванной (run_purge_jobs --retry)
+PURGE_LEASE = int(os.environ.get('PURGE_LEASE', 600))
+# False - задачи выполняет только manage.py run_purge_jobs (например, по cron)
+PURGE_IN_BACKGROUND = os.environ.get('PURGE_IN_BACKGROUND', 'True') == 'True'
+
+# Кэш пользователей для аутентификации по telegram_id (см. api/user_cache.py), 0 - выключен
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+
+# Сессии мини-приложения по Telegram WebApp initData (см. api/webapp_session.py)
+TELEGRAM_BOT_TOKEN = os.environ.get('BOT_TOKEN', '')  # Токен бота, которым Telegram подписывает initData
+WEBAPP_INIT_DATA_MAX_AGE = int(os.environ.get('WEBAPP_INIT_DATA_MAX_AGE', 86400))  # Сколько секунд initData принимаются
+WEBAPP_SESSION_TTL = int(os.environ.get('WEBAPP_SESSION_TTL', 3600))  # Время жизни токена сессии в секундах
+
+# Кэш ответов каталога тарифов (см. catalog_cache.py)
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 5))  # Как часто сверять версию с БД, сек
+CATALOG_CACHE_MAX_AGE = int(os.environ.get('CATALOG_CACHE_MAX_AGE', 60))  # max-age в Cache-Control для клиентов и CDN
+
+# Индекс промокодов в памяти (см. promo_engine.py): период обновления, сек
+PROMO_INDEX_REFRESH = float(os.environ.get('PROMO_INDEX_REFRESH', 30))
@@ -1,12 +1,17 @@
+from django.core import signing
 from rest_framework import authentication
 from rest_framework.exceptions import AuthenticationFailed
 from bot_admin.models import BotUser
 
+from . import user_cache, webapp_session
+
 
 class TelegramIDAuthentication(authentication.BaseAuthentication):
     """
     Аутентификация пользователей по Telegram ID.
     Ищет telegram_id в заголовке X-Telegram-ID, параметрах URL, или теле запроса.
+    Пользователь берется из кэша (см. api/user_cache.py), если у представления
+    не выставлен fresh_user = True.
     """
     
     def authenticate(self, request):
@@ -25,7 +30,8 @@ class TelegramIDAuthentication(authentication.BaseAuthentication):
             return None 
         
         try:
-            user = BotUser.objects.get(telegram_id=telegram_id)
+            view = request.parser_context.get('view') if request.parser_context else None
+            user = user_cache.get_user(telegram_id, fresh=getattr(view, 'fresh_user', False))
             
             if not user.is_active:
                 raise AuthenticationFailed('Пользователь неактивен')
@@ -41,4 +47,34 @@ class TelegramIDAuthentication(authentication.BaseAuthentication):
             raise AuthenticationFailed(f'Ошибка аутентификации: {str(e)}')
 
     def authenticate_header(self, request):
-        return 'TelegramID' 
\ No newline at end of file
+        return 'TelegramID'
+
+
+class SignedSessionAuthentication(authentication.BaseAuthentication):
+    """
+    Аутентификация по токену сессии мини-приложения (см. api/webapp_session.py).
+    Токен передается в заголовке "Authorization: Session <токен>" и проверяется
+    без обращения к БД; request.user - SessionUser.
+    """
+    keyword = 'Session'
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Некорректный заголовок Authorization')
+
+        try:
+            user = webapp_session.read_token(auth[1].decode())
+        except signing.SignatureExpired:
+            raise AuthenticationFailed('Сессия истекла, откройте мини-приложение заново')
+        except (signing.BadSignature, UnicodeError, KeyError):
+            raise AuthenticationFailed('Недействительный токен сессии')
+
+        if not user.is_active:
+            raise AuthenticationFailed('Пользователь неактивен')
+        return (user, auth[1].decode())
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,198 @@
+"""
+Кэш последних сообщений активных чатов.
+
+Хранит последние N сообщений каждого чата, чтобы при сборке истории для ИИ
+и при выдаче списка сообщений не перечитывать всю переписку из MySQL.
+Сообщения добавляются в кэш при записи, чаты вытесняются по LRU и TTL.
+
+Каждая запись помечена версией чата (message_count, last_message_at), на
+которой она построена. Запись, версия которой не совпадает с только что
+прочитанным чатом (сообщения записал другой процесс gunicorn или они удалены),
+не используется и строится заново из БД.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from bot_admin.models import ArchivedChatMessage, ChatMessage
+
+
+class LocalChatHistoryCache:
+    """Кэш истории чатов в памяти процесса (LRU + TTL)"""
+
+    def __init__(self, max_chats, max_messages, ttl):
+        self.max_chats = max_chats
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id):
+        """Возвращает запись {'messages': [...], 'complete': bool, 'version': ...} или None"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None or entry['expires_at'] < time.monotonic():
+                self._entries.pop(chat_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(chat_id)
+            self.hits += 1
+            return {'messages': list(entry['messages']), 'complete': entry['complete'], 'version': entry['version']}
+
+    def set(self, chat_id, messages, complete, version):
+        with self._lock:
+            messages = list(messages)
+            if len(messages) > self.max_messages:
+                messages = messages[-self.max_messages:]
+                complete = False
+            self._entries[chat_id] = {
+                'messages': messages,
+                'complete': complete,
+                'version': version,
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_chats:
+                self._entries.popitem(last=False)
+
+    def append(self, chat_id, message, version):
+        """Добавляет сообщение в конец истории, если чат уже в кэше; version - версия чата с ним"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                return
+            entry['messages'].append(message)
+            entry['version'] = version
+            if len(entry['messages']) > self.max_messages:
+                del entry['messages'][:-self.max_messages]
+                entry['complete'] = False
+            entry['expires_at'] = time.monotonic() + self.ttl
+            self._entries.move_to_end(chat_id)
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self._entries.pop(chat_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'local',
+                'chats': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class SharedChatHistoryCache:
+    """Кэш истории чатов в общем кэше Django (например, Redis или Memcached)"""
+
+    key_prefix = 'chat_history:'
+
+    def __init__(self, alias, max_messages, ttl):
+        self.cache = caches[alias]
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    def _key(self, chat_id):
+        return f'{self.key_prefix}{chat_id}'
+
+    def get(self, chat_id):
+        return self.cache.get(self._key(chat_id))
+
+    def set(self, chat_id, messages, complete, version):
+        messages = list(messages)
+        if len(messages) > self.max_messages:
+            messages = messages[-self.max_messages:]
+            complete = False
+        self.cache.set(self._key(chat_id), {'messages': messages, 'complete': complete, 'version': version}, self.ttl)
+
+    def append(self, chat_id, message, version):
+        # Сообщения одного чата пишутся последовательно (ход пользователя, затем ответ ИИ),
+        # поэтому чтение-изменение-запись здесь достаточно
+        entry = self.get(chat_id)
+        if entry is None:
+            return
+        self.set(chat_id, entry['messages'] + [message], entry['complete'], version)
+
+    def invalidate(self, chat_id):
+        self.cache.delete(self._key(chat_id))
+
+    def stats(self):
+        return {'backend': 'django'}
+
+
+def _build_cache():
+    max_messages = getattr(settings, 'CHAT_HISTORY_MAX_MESSAGES', 50)
+    ttl = getattr(settings, 'CHAT_HISTORY_CACHE_TTL', 900)
+    if getattr(settings, 'CHAT_HISTORY_CACHE_BACKEND', 'local') == 'django':
+        alias = getattr(settings, 'CHAT_HISTORY_CACHE_ALIAS', 'default')
+        return SharedChatHistoryCache(alias, max_messages, ttl)
+    max_chats = getattr(settings, 'CHAT_HISTORY_CACHE_MAX_CHATS', 1000)
+    return LocalChatHistoryCache(max_chats, max_messages, ttl)
+
+
+chat_history_cache = _build_cache()
+
+
+def serialize_message(message):
+    """Преобразует ChatMessage (или архивное сообщение) в словарь в формате ChatMessageSerializer"""
+    from .serializers import ArchivedChatMessageSerializer, ChatMessageSerializer
+    if isinstance(message, ArchivedChatMessage):
+        return dict(ArchivedChatMessageSerializer(message).data)
+    return dict(ChatMessageSerializer(message).data)
+
+
+def message_model(chat):
+    """Таблица, в которой сейчас лежат сообщения чата"""
+    return ArchivedChatMessage if chat.archived_at else ChatMessage
+
+
+def chat_version(chat):
+    """Версия истории чата по его сводке: меняется при каждом новом или удаленном сообщении"""
+    return chat.message_count, chat.last_message_at
+
+
+def prime_chat(chat):
+    """Помечает только что созданный чат как пустой, чтобы первый ход не читал БД"""
+    chat_history_cache.set(chat.id, [], complete=True, version=chat_version(chat))
+
+
+def record_message(message):
+    """Добавляет сохраненное сообщение в кэш истории его чата"""
+    if not ChatMessage.chat.is_cached(message):
+        # Без объекта чата неизвестна новая версия истории
+        chat_history_cache.invalidate(message.chat_id)
+        return
+    # ChatMessage.save уже обновил сводку загруженного чата
+    chat_history_cache.append(message.chat_id, serialize_message(message), chat_version(message.chat))
+
+
+def forget_chat(chat_id):
+    chat_history_cache.invalidate(chat_id)
+
+
+def get_recent_messages(chat):
+    """
+    Возвращает последние сообщения чата (не более CHAT_HISTORY_MAX_MESSAGES)
+    в хронологическом порядке и флаг, что это вся история чата.
+    chat должен быть прочитан из БД в текущем запросе: по его сводке
+    проверяется, что в кэше нет пропущенных сообщений.
+    """
+    version = chat_version(chat)
+    entry = chat_history_cache.get(chat.id)
+    if entry is not None and entry.get('version') == version:
+        return entry['messages'], entry['complete']
+
+    limit = chat_history_cache.max_messages
+    recent = list(
+        message_model(chat).objects.filter(chat=chat).order_by('-timestamp', '-id')[:limit + 1]
+    )
+    complete = len(recent) <= limit
+    messages = [serialize_message(msg) for msg in reversed(recent[:limit])]
+    chat_history_cache.set(chat.id, messages, complete, version)
+    return messages, complete
@@ -0,0 +1,135 @@
+"""
+Кэш ответов ИИ для повторяющихся запросов.
+
+Многие пользователи мини-приложения отправляют одинаковые первые сообщения
+("привет", шаблонные промпты) одной и той же модели. Ответ на такой запрос
+берется из кэша по хэшу модели и нормализованной истории сообщений.
+Кэш выключен по умолчанию (COMPLETION_CACHE_ENABLED).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def normalize_messages(messages):
+    """Убирает различия в пробелах, не влияющие на смысл запроса"""
+    return [
+        {'role': msg['role'], 'content': ' '.join(msg['content'].split())}
+        for msg in messages
+    ]
+
+
+def make_key(model, messages):
+    payload = json.dumps(
+        {'model': model, 'messages': normalize_messages(messages)},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    """Кэш ответов в памяти процесса с TTL и ограничением по количеству записей"""
+
+    def __init__(self, max_entries, ttl, max_messages):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def is_cacheable(self, messages):
+        """Кэшируем только короткие диалоги - у длинных шанс повтора близок к нулю"""
+        return 0 < len(messages) <= self.max_messages
+
+    def get(self, model, messages):
+        """Возвращает {'content': ..., 'tokens_used': ...} или None"""
+        if not self.is_cacheable(messages):
+            return None
+        key = make_key(model, messages)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    def set(self, model, messages, content, tokens_used):
+        if not content or not self.is_cacheable(messages):
+            return
+        key = make_key(model, messages)
+        with self._lock:
+            self._entries[key] = {
+                'value': {'content': content, 'tokens_used': tokens_used},
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+completion_cache = CompletionCache(
+    max_entries=getattr(settings, 'COMPLETION_CACHE_MAX_ENTRIES', 5000),
+    ttl=getattr(settings, 'COMPLETION_CACHE_TTL', 3600),
+    max_messages=getattr(settings, 'COMPLETION_CACHE_MAX_MESSAGES', 1),
+)
+
+
+def is_enabled():
+    return getattr(settings, 'COMPLETION_CACHE_ENABLED', False)
+
+
+def lookup(model, messages):
+    if not is_enabled():
+        return None
+    return completion_cache.get(model, messages)
+
+
+def store(model, messages, content, tokens_used):
+    if is_enabled():
+        completion_cache.set(model, messages, content, tokens_used)
+
+
+def hit_costs_request(plan):
+    """
+    Списывается ли запрос за ответ из кэша.
+    Настраивается для плана ключом 'completion_cache_hit_costs_request' в Plan.features.
+    """
+    default = getattr(settings, 'COMPLETION_CACHE_HIT_COSTS_REQUEST', True)
+    if plan and isinstance(plan.features, dict):
+        return bool(plan.features.get('completion_cache_hit_costs_request', default))
+    return default
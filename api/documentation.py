@@ -41,6 +41,10 @@ class ApiDocumentation:
                     <li>В параметре URL: <code>?telegram_id=123456789</code></li>
                     <li>В теле запроса JSON для POST-запросов: <code>{"telegram_id": 123456789, ...}</code></li>
                 </ul>
+                <p>Мини-приложение может один раз обменять <code>Telegram.WebApp.initData</code> на токен сессии
+                (<code>POST /api/auth/webapp/</code>) и передавать его в заголовке
+                <code>Authorization: Session &lt;токен&gt;</code>. Токен подписан сервером и проверяется без обращения к базе данных;
+                по истечении срока действия (<code>expires_in</code> секунд) API отвечает 401, и токен нужно получить заново.</p>
             </section>
             
             <section>
@@ -108,6 +112,34 @@ class ApiDocumentation:
                     </pre>
                 </div>
                 
+                <div class="endpoint">
+                    <h3>Сессия мини-приложения</h3>
+                    <p><strong>URL:</strong> <code>/api/auth/webapp/</code></p>
+                    <p><strong>Метод:</strong> POST</p>
+                    <p><strong>Описание:</strong> Проверяет подпись initData мини-приложения Telegram и выдает токен сессии.</p>
+                    <p><strong>Тело запроса:</strong></p>
+                    <pre>
+{
+    "init_data": "query_id=...&user=%7B%22id%22%3A123456789...%7D&auth_date=1700000000&hash=..."
+}
+                    </pre>
+                    <p><strong>Ответ:</strong></p>
+                    <pre>
+{
+    "success": true,
+    "token": "eyJ1aWQiOjF9:1rX...",
+    "expires_in": 3600,
+    "user": {
+        "user_id": 1,
+        "telegram_id": 123456789,
+        "requests_left": 5,
+        "plan": "Премиум"
+    }
+}
+                    </pre>
+                    <p>401 - неверная подпись или устаревшие initData, 404 - пользователь еще не запускал бота.</p>
+                </div>
+                
                 <div class="endpoint">
                     <h3>Проверка доступных запросов</h3>
                     <p><strong>URL:</strong> <code>/api/check-requests/</code></p>
@@ -203,7 +235,8 @@ class ApiDocumentation:
             "username": "example_user",
             "first_name": "John",
             "last_name": "Doe",
-            "requests_left": 4
+            "requests_left": 4,
+            "referral_code": "EXAM1234"
         },
         "active_plan": {
             "name": "Стандарт",
@@ -221,6 +254,8 @@ class ApiDocumentation:
     }
 }
                     </pre>
+                    <p>Ответ содержит заголовок <code>ETag</code>. Если передать его значение в <code>If-None-Match</code>
+                    и данные не изменились, API вернет <code>304 Not Modified</code> без тела.</p>
                 </div>
             </section>
             
@@ -259,8 +294,9 @@ class ApiDocumentation:
                     <h3>Получение списка чатов</h3>
                     <p><strong>URL:</strong> <code>/api/chats/</code></p>
                     <p><strong>Метод:</strong> GET</p>
-                    <p><strong>Описание:</strong> Возвращает список всех чатов пользователя.</p>
+                    <p><strong>Описание:</strong> Возвращает чаты пользователя постранично, от недавно обновленных к старым.</p>
                     <p><strong>Заголовки:</strong> <code>X-Telegram-ID: 123456789</code></p>
+                    <p><strong>Параметры:</strong> <code>limit</code> (по умолчанию 20), <code>before</code> - курсор для загрузки более старых чатов, <code>since</code> - курсор для получения чатов, обновленных после него.</p>
                     <p><strong>Ответ:</strong></p>
                     <pre>
 {
@@ -272,7 +308,11 @@ class ApiDocumentation:
                 "title": "Новый чат",
                 "ai_model": "gpt-4o-mini",
                 "created_at": "2023-07-15T15:30:00Z",
-                "updated_at": "2023-07-15T15:30:00Z"
+                "updated_at": "2023-07-15T15:30:00Z",
+                "last_message_at": "2023-07-15T15:30:00Z",
+                "last_message_preview": "Привет! Чем могу помочь?",
+                "message_count": 2,
+                "total_tokens": 150
             },
             {
                 "id": 41,
@@ -281,7 +321,10 @@ class ApiDocumentation:
                 "created_at": "2023-07-14T10:15:00Z",
                 "updated_at": "2023-07-14T11:20:00Z"
             }
-        ]
+        ],
+        "has_more": true,
+        "next_before": "MjAyMy0wNy0xNFQxMToyMDowMFp8NDE",
+        "next_since": "MjAyMy0wNy0xNVQxNTozMDowMFp8NDI"
     }
 }
                     </pre>
@@ -291,8 +334,9 @@ class ApiDocumentation:
                     <h3>Получение сообщений чата</h3>
                     <p><strong>URL:</strong> <code>/api/chats/{chat_id}/messages/</code></p>
                     <p><strong>Метод:</strong> GET</p>
-                    <p><strong>Описание:</strong> Возвращает список сообщений в чате.</p>
+                    <p><strong>Описание:</strong> Возвращает последние сообщения чата в хронологическом порядке.</p>
                     <p><strong>Заголовки:</strong> <code>X-Telegram-ID: 123456789</code></p>
+                    <p><strong>Параметры:</strong> <code>limit</code> (по умолчанию 50), <code>before</code> - курсор для загрузки более ранних сообщений, <code>since</code> - курсор для получения только новых сообщений.</p>
                     <p><strong>Ответ:</strong></p>
                     <pre>
 {
@@ -313,12 +357,47 @@ class ApiDocumentation:
                 "model_used": "gpt-4o-mini",
                 "tokens_used": 150
             }
-        ]
+        ],
+        "has_more": false,
+        "next_before": "MjAyMy0wNy0xNVQxNTozMTowMFp8MTAx",
+        "next_since": "MjAyMy0wNy0xNVQxNTozMTowNVp8MTAy"
     }
 }
                     </pre>
                 </div>
                 
+                <div class="endpoint">
+                    <h3>Поиск по чатам</h3>
+                    <p><strong>URL:</strong> <code>/api/chats/search/?q=погода</code></p>
+                    <p><strong>Метод:</strong> GET</p>
+                    <p><strong>Описание:</strong> Ищет слова запроса в сообщениях и названиях чатов пользователя. Сообщения отсортированы по релевантности, чаты с подходящим названием возвращаются на первой странице.</p>
+                    <p><strong>Заголовки:</strong> <code>X-Telegram-ID: 123456789</code></p>
+                    <p><strong>Параметры:</strong> <code>q</code> - слова длиной от 3 символов, <code>limit</code> (по умолчанию 20), <code>page</code> (с 1).</p>
+                    <p><strong>Ответ:</strong></p>
+                    <pre>
+{
+    "success": true,
+    "query": "погода",
+    "page": 1,
+    "has_more": false,
+    "messages": [
+        {
+            "chat_id": 41,
+            "chat_title": "О погоде",
+            "message": {
+                "id": 95,
+                "role": "user",
+                "content": "Какая завтра погода?",
+                "timestamp": "2023-07-14T10:15:00Z"
+            },
+            "score": 1.2345
+        }
+    ],
+    "chats": [...]
+}
+                    </pre>
+                </div>
+                
                 <div class="endpoint">
                     <h3>Отправка сообщения в чат</h3>
                     <p><strong>URL:</strong> <code>/api/chats/{chat_id}/messages/</code></p>
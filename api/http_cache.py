@@ -0,0 +1,46 @@
+"""
+Условные ответы API: строгий ETag по содержимому ответа и 304 на If-None-Match.
+
+Мини-приложение часто перезапрашивает одни и те же данные (профиль, тарифы);
+при совпадении ETag ответ уходит без тела.
+"""
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def strong_etag(data):
+    """Строгий ETag: хэш канонического JSON данных ответа"""
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return '"%s"' % hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+
+
+def etag_matches(request, etag):
+    """Совпадает ли ETag с заголовком If-None-Match (слабое сравнение, RFC 9110)"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    bare = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def conditional_response(request, data, etag=None, cache_control='private, no-cache'):
+    """Response с ETag и Cache-Control или пустой 304, если у клиента та же версия"""
+    etag = etag or strong_etag(data)
+    headers = {'ETag': etag}
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+    if etag_matches(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(data, headers=headers)
@@ -0,0 +1,12 @@
+"""
+Маршрутизация запросов к моделям ИИ разных провайдеров.
+"""
+from .admission import admit, get_admission_queue
+from .base import CompletionResult
+from .errors import ProviderError, ProviderUnavailable
+from .registry import MODEL_REGISTRY, get_provider, provider_stats
+
+
+def complete(model, messages):
+    """Отправляет историю сообщений выбранной модели и возвращает CompletionResult"""
+    return get_provider(model).complete(messages)
@@ -0,0 +1,173 @@
+"""
+Общая очередь допуска запросов к ИИ с взвешенным справедливым обслуживанием.
+
+Все запросы к провайдерам внутри процесса делят бюджет LLM_ADMISSION['CONCURRENCY'].
+Когда бюджет занят, ожидающие запросы получают место в порядке виртуального
+времени завершения (start-time fair queuing): каждый пользователь - отдельный
+поток с весом 1 + Plan.priority его активного тарифа, поэтому поток бесплатных
+запросов не вытесняет платных пользователей. Одновременно у одного пользователя
+может быть не больше PER_USER_LIMIT запросов (в работе и в очереди).
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .errors import ProviderUnavailable
+
+
+class TooManyRequests(ProviderUnavailable):
+    """Пользователь превысил лимит одновременных запросов"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, retry_after)
+        self.status_code = 429
+
+
+def plan_weight(plan):
+    """Вес пользователя в очереди по приоритету его тарифа (без тарифа - 1)"""
+    if plan is None:
+        return 1
+    return 1 + max(0, plan.priority or 0)
+
+
+class _Ticket:
+    __slots__ = ('user_key', 'granted', 'cancelled')
+
+    def __init__(self, user_key):
+        self.user_key = user_key
+        self.granted = False
+        self.cancelled = False
+
+
+class FairAdmissionQueue:
+    """Взвешенная справедливая очередь с общим бюджетом одновременных запросов"""
+
+    def __init__(self, capacity, per_user_limit=2, queue_timeout=5.0):
+        self.capacity = capacity
+        self.per_user_limit = per_user_limit
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.user_rejected = 0
+        self.total_wait = 0.0
+        self._virtual_time = 0.0
+        self._last_finish = {}  # user_key -> виртуальное время завершения последнего запроса
+        self._per_user = {}  # user_key -> запросов в работе и в очереди
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _dispatch(self):
+        """Раздает свободные места ожидающим в порядке виртуального времени"""
+        granted = False
+        while self._heap and self.in_flight < self.capacity:
+            tag, _, ticket = heapq.heappop(self._heap)
+            if ticket.cancelled:
+                continue
+            ticket.granted = True
+            self.in_flight += 1
+            self._virtual_time = max(self._virtual_time, tag)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _leave(self, user_key):
+        left = self._per_user[user_key] - 1
+        if left:
+            self._per_user[user_key] = left
+        else:
+            del self._per_user[user_key]
+            # Простаивающий поток не накапливает кредит на будущее
+            if self._last_finish.get(user_key, 0.0) <= self._virtual_time:
+                self._last_finish.pop(user_key, None)
+
+    def acquire(self, user_key, weight=1):
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        with self._cond:
+            if self._per_user.get(user_key, 0) >= self.per_user_limit:
+                self.user_rejected += 1
+                raise TooManyRequests(
+                    'Дождитесь ответа на предыдущие сообщения',
+                    retry_after=1,
+                )
+            self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+
+            start = max(self._virtual_time, self._last_finish.get(user_key, 0.0))
+            tag = start + 1.0 / weight
+            self._last_finish[user_key] = tag
+            ticket = _Ticket(user_key)
+            heapq.heappush(self._heap, (tag, next(self._seq), ticket))
+            self._dispatch()
+
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    ticket.cancelled = True
+                    self.rejected += 1
+                    self._leave(user_key)
+                    raise ProviderUnavailable(
+                        'Сервис перегружен, попробуйте позже',
+                        retry_after=max(1, math.ceil(self.queue_timeout)),
+                    )
+                self._cond.wait(remaining)
+
+            self.admitted += 1
+            self.total_wait += time.monotonic() - started
+
+    def release(self, user_key):
+        with self._cond:
+            self.in_flight -= 1
+            self._leave(user_key)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, user_key, weight=1):
+        self.acquire(user_key, weight)
+        try:
+            yield
+        finally:
+            self.release(user_key)
+
+    def stats(self):
+        with self._cond:
+            waiting = sum(1 for _, _, ticket in self._heap if not ticket.cancelled)
+            return {
+                'capacity': self.capacity,
+                'in_flight': self.in_flight,
+                'waiting': waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'user_rejected': self.user_rejected,
+                'avg_wait': round(self.total_wait / self.admitted, 3) if self.admitted else 0.0,
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_admission_queue():
+    """Очередь создается при первом обращении, после загрузки настроек Django"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                config = getattr(settings, 'LLM_ADMISSION', {})
+                _queue = FairAdmissionQueue(
+                    capacity=config.get('CONCURRENCY', 32),
+                    per_user_limit=config.get('PER_USER_LIMIT', 2),
+                    queue_timeout=config.get('QUEUE_TIMEOUT', 5.0),
+                )
+    return _queue
+
+
+def admit(user, plan):
+    """Контекстный менеджер: место в общей очереди для запроса пользователя к ИИ"""
+    return get_admission_queue().slot(user.pk, plan_weight(plan))
@@ -0,0 +1,159 @@
+"""
+Базовые классы адаптеров провайдеров ИИ.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .errors import ProviderError
+from .resilience import AdaptiveLimiter, CircuitBreaker, is_overload_error
+
+
+class CompletionResult:
+    """Ответ провайдера"""
+
+    def __init__(self, content, prompt_tokens=0, completion_tokens=0, cost=0.0):
+        self.content = content
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cost = cost
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+
+class BaseProvider:
+    """
+    Адаптер одной модели из Chat.AI_MODEL_CHOICES.
+
+    У каждого адаптера свой пул HTTP-соединений, таймауты, адаптивное ограничение
+    одновременных запросов с размыкателем цепи и стоимость токенов
+    (в долларах за 1000 токенов).
+    """
+    provider_name = 'base'
+
+    def __init__(self, model, upstream_model, base_url, api_key, timeout=60, connect_timeout=5,
+                 max_concurrency=10, pool_size=10, price_input_per_1k=0.0, price_output_per_1k=0.0,
+                 extra=None, resilience=None):
+        self.model = model
+        self.upstream_model = upstream_model
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = (connect_timeout, timeout)
+        self.max_concurrency = max_concurrency
+        self.price_input_per_1k = price_input_per_1k
+        self.price_output_per_1k = price_output_per_1k
+        self.extra = extra or {}
+
+        # Постоянный пул соединений: keep-alive между запросами, без повторов на уровне urllib3
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        resilience = resilience or {}
+        self.limiter = AdaptiveLimiter(
+            max_limit=max_concurrency,
+            min_limit=resilience.get('MIN_CONCURRENCY', 1),
+            latency_target=resilience.get('LATENCY_TARGET', 20.0),
+            backoff_ratio=resilience.get('BACKOFF_RATIO', 0.5),
+            queue_timeout=resilience.get('QUEUE_TIMEOUT', 2.0),
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=resilience.get('FAILURE_THRESHOLD', 5),
+            reset_timeout=resilience.get('RESET_TIMEOUT', 30.0),
+        )
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.total_cost = 0.0
+        self.total_latency = 0.0
+
+    def estimate_cost(self, prompt_tokens, completion_tokens):
+        return round(
+            prompt_tokens / 1000 * self.price_input_per_1k
+            + completion_tokens / 1000 * self.price_output_per_1k,
+            6,
+        )
+
+    def complete(self, messages):
+        """
+        Отправляет историю сообщений модели и возвращает CompletionResult.
+        Если провайдер перегружен или недоступен, сразу выбрасывает ProviderUnavailable.
+        """
+        self.breaker.before_call()
+        try:
+            self.limiter.acquire()
+        except ProviderError:
+            self.breaker.record_ignored()
+            raise
+        with self._lock:
+            self.in_flight += 1
+        started = time.monotonic()
+        overloaded = False
+        try:
+            result = self._complete(messages)
+            result.cost = self.estimate_cost(result.prompt_tokens, result.completion_tokens)
+            self.breaker.record_success()
+            with self._lock:
+                self.calls += 1
+                self.total_cost += result.cost
+            return result
+        except Exception as e:
+            overloaded = is_overload_error(e)
+            if overloaded:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_ignored()
+            with self._lock:
+                self.calls += 1
+                self.errors += 1
+            raise
+        finally:
+            latency = time.monotonic() - started
+            self.limiter.release(latency, overloaded)
+            with self._lock:
+                self.in_flight -= 1
+                self.total_latency += latency
+
+    def _complete(self, messages):
+        raise NotImplementedError
+
+    def _post(self, path, payload, headers=None, params=None):
+        """POST с разбором ошибок провайдера в ProviderError"""
+        try:
+            response = self.session.post(
+                f'{self.base_url}{path}', json=payload, headers=headers, params=params, timeout=self.timeout
+            )
+        except requests.Timeout:
+            raise ProviderError(f'Превышено время ожидания ответа от {self.provider_name}', status_code=504)
+        except requests.RequestException as e:
+            raise ProviderError(f'Ошибка соединения с {self.provider_name}: {e}', status_code=502)
+
+        if response.status_code >= 400:
+            retry_after = response.headers.get('Retry-After')
+            raise ProviderError(
+                f'{self.provider_name} вернул ошибку {response.status_code}: {response.text[:200]}',
+                status_code=response.status_code,
+                retry_after=float(retry_after) if retry_after and retry_after.replace('.', '', 1).isdigit() else None,
+            )
+        return response.json()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'provider': self.provider_name,
+                'upstream_model': self.upstream_model,
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'limiter': self.limiter.stats(),
+                'breaker': self.breaker.stats(),
+                'calls': self.calls,
+                'errors': self.errors,
+                'avg_latency': round(self.total_latency / self.calls, 3) if self.calls else 0.0,
+                'total_cost': round(self.total_cost, 6),
+            }
@@ -0,0 +1,19 @@
+"""
+Исключения при обращении к провайдерам ИИ.
+"""
+
+
+class ProviderError(Exception):
+    """Ошибка обращения к провайдеру ИИ"""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ProviderUnavailable(ProviderError):
+    """Провайдер временно недоступен или перегружен - повторите запрос позже"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, status_code=503, retry_after=retry_after)
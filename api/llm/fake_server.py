@@ -0,0 +1,247 @@
+"""
+Локальный тестовый сервер, имитирующий API провайдеров ИИ.
+
+Позволяет проверять чат без обращения к настоящим провайдерам:
+
+    python -m api.llm.fake_server --port 8765
+
+и в .env:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765/v1
+    GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta
+
+Поведение под нагрузкой настраивается параметрами: задержка до ответа
+(--latency, --jitter), скорость генерации (--tokens-per-second, --reply-words),
+доля ошибок 500 (--error-rate) и периодические всплески 429
+(--burst-every, --burst-duration), например:
+
+    python -m api.llm.fake_server --latency 0.3 --tokens-per-second 50 --error-rate 0.02 --burst-every 60 --burst-duration 5
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _count_tokens(text):
+    return len(text.split())
+
+
+def _last_user_text(messages):
+    for msg in reversed(messages):
+        if msg.get('role') == 'user':
+            content = msg.get('content', '')
+            if isinstance(content, list):
+                return ' '.join(part.get('text', '') for part in content)
+            return content
+    return ''
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """Отвечает эхом последнего сообщения пользователя в формате нужного провайдера"""
+    protocol_version = 'HTTP/1.1'  # keep-alive, как у настоящих API
+
+    gemini_path = re.compile(r'^/v1beta/models/(?P<model>[^:/]+):generateContent$')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_POST(self):
+        payload = self._read_json()
+        path = self.path.split('?', 1)[0]
+        server = self.server
+        server.count_request()
+
+        if server.in_burst():
+            server.count_error(429)
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}},
+                            headers={'Retry-After': str(max(1, int(server.burst_duration)))})
+            return
+        if server.error_rate and random.random() < server.error_rate:
+            server.count_error(500)
+            self._send_json(500, {'error': {'message': 'Internal server error', 'type': 'server_error'}})
+            return
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        if path == '/v1/chat/completions':
+            self._send_json(200, self.openai_chat(payload))
+        elif path == '/v1/messages':
+            self._send_json(200, self.anthropic_messages(payload))
+        elif path == '/v1/images/generations':
+            self._send_json(200, self.openai_images(payload))
+        elif self.gemini_path.match(path):
+            self._send_json(200, self.gemini_generate(payload))
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown path {path}'}})
+
+    def reply_text(self, prompt):
+        reply = f'Тестовый ответ: {prompt}'
+        if self.server.reply_words:
+            reply += ' ' + ' '.join(['токен'] * self.server.reply_words)
+        # Имитация генерации: ответ "печатается" со скоростью tokens_per_second
+        if self.server.tokens_per_second:
+            time.sleep(_count_tokens(reply) / self.server.tokens_per_second)
+        return reply
+
+    def openai_chat(self, payload):
+        messages = payload.get('messages', [])
+        prompt_tokens = sum(_count_tokens(str(msg.get('content', ''))) for msg in messages)
+        reply = self.reply_text(_last_user_text(messages))
+        completion_tokens = _count_tokens(reply)
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': reply},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+    def anthropic_messages(self, payload):
+        messages = payload.get('messages', [])
+        reply = self.reply_text(_last_user_text(messages))
+        return {
+            'id': f'msg_{uuid.uuid4().hex}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': payload.get('model'),
+            'content': [{'type': 'text', 'text': reply}],
+            'stop_reason': 'end_turn',
+            'usage': {
+                'input_tokens': sum(_count_tokens(str(msg.get('content', ''))) for msg in messages),
+                'output_tokens': _count_tokens(reply),
+            },
+        }
+
+    def gemini_generate(self, payload):
+        contents = payload.get('contents', [])
+        prompt = ''
+        for item in reversed(contents):
+            if item.get('role') == 'user':
+                prompt = ' '.join(part.get('text', '') for part in item.get('parts', []))
+                break
+        reply = self.reply_text(prompt)
+        return {
+            'candidates': [{
+                'content': {'role': 'model', 'parts': [{'text': reply}]},
+                'finishReason': 'STOP',
+            }],
+            'usageMetadata': {
+                'promptTokenCount': sum(
+                    _count_tokens(part.get('text', '')) for item in contents for part in item.get('parts', [])
+                ),
+                'candidatesTokenCount': _count_tokens(reply),
+            },
+        }
+
+    def openai_images(self, payload):
+        return {
+            'created': int(time.time()),
+            'data': [{'url': f'https://example.com/fake-images/{uuid.uuid4().hex}.png'}],
+        }
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler=FakeProviderHandler, verbose=False, latency=0.0, jitter=0.0,
+                 tokens_per_second=0.0, reply_words=0, error_rate=0.0, burst_every=0.0, burst_duration=0.0):
+        super().__init__(address, handler)
+        self.verbose = verbose
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.reply_words = reply_words
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_duration = burst_duration
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def in_burst(self):
+        """Первые burst_duration секунд каждого периода burst_every сервер отвечает 429"""
+        if not self.burst_every or not self.burst_duration:
+            return False
+        return (time.monotonic() - self.started_at) % self.burst_every < self.burst_duration
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_error(self, status):
+        with self._lock:
+            self.errors[status] = self.errors.get(status, 0) + 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Тестовый сервер API провайдеров ИИ')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--verbose', action='store_true', help='Логировать каждый запрос')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка перед ответом, сек')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Случайная добавка к задержке (0..jitter), сек')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0,
+                        help='Скорость генерации ответа, токенов/сек (0 - мгновенно)')
+    parser.add_argument('--reply-words', type=int, default=0, help='Дополнительная длина ответа в словах')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500 (0..1)')
+    parser.add_argument('--burst-every', type=float, default=0.0, help='Период всплесков 429, сек')
+    parser.add_argument('--burst-duration', type=float, default=0.0, help='Длительность всплеска 429, сек')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    server = FakeProviderServer(
+        (args.host, args.port),
+        verbose=args.verbose,
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        reply_words=args.reply_words,
+        error_rate=args.error_rate,
+        burst_every=args.burst_every,
+        burst_duration=args.burst_duration,
+    )
+    print(f'Тестовый сервер провайдеров запущен на http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'Обработано запросов: {server.requests}, ошибок: {server.errors}')
+
+
+if __name__ == '__main__':
+    main()
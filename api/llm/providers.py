@@ -0,0 +1,122 @@
+"""
+Адаптеры конкретных провайдеров ИИ.
+"""
+from .base import BaseProvider, CompletionResult
+from .errors import ProviderError
+
+
+class OpenAIChatProvider(BaseProvider):
+    """OpenAI Chat Completions (и совместимые API)"""
+    provider_name = 'openai'
+
+    def _complete(self, messages):
+        data = self._post(
+            '/chat/completions',
+            {'model': self.upstream_model, 'messages': messages},
+            headers={'Authorization': f'Bearer {self.api_key}'},
+        )
+        choices = data.get('choices') or []
+        content = choices[0]['message']['content'] if choices else ''
+        usage = data.get('usage') or {}
+        return CompletionResult(
+            content,
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+        )
+
+
+class AnthropicProvider(BaseProvider):
+    """Anthropic Messages API (Claude)"""
+    provider_name = 'anthropic'
+    api_version = '2023-06-01'
+
+    def _complete(self, messages):
+        system = '\n'.join(msg['content'] for msg in messages if msg['role'] == 'system')
+        payload = {
+            'model': self.upstream_model,
+            'max_tokens': self.extra.get('max_tokens', 1024),
+            'messages': [msg for msg in messages if msg['role'] != 'system'],
+        }
+        if system:
+            payload['system'] = system
+        data = self._post(
+            '/messages',
+            payload,
+            headers={'x-api-key': self.api_key, 'anthropic-version': self.api_version},
+        )
+        content = ''.join(block.get('text', '') for block in data.get('content', []) if block.get('type') == 'text')
+        usage = data.get('usage') or {}
+        return CompletionResult(
+            content,
+            prompt_tokens=usage.get('input_tokens', 0),
+            completion_tokens=usage.get('output_tokens', 0),
+        )
+
+
+class GeminiProvider(BaseProvider):
+    """Google Gemini generateContent"""
+    provider_name = 'gemini'
+
+    def _complete(self, messages):
+        contents = [
+            {'role': 'model' if msg['role'] == 'assistant' else 'user', 'parts': [{'text': msg['content']}]}
+            for msg in messages if msg['role'] != 'system'
+        ]
+        payload = {'contents': contents}
+        system = '\n'.join(msg['content'] for msg in messages if msg['role'] == 'system')
+        if system:
+            payload['systemInstruction'] = {'parts': [{'text': system}]}
+        data = self._post(
+            f'/models/{self.upstream_model}:generateContent',
+            payload,
+            headers={'x-goog-api-key': self.api_key},
+        )
+        candidates = data.get('candidates') or []
+        parts = candidates[0].get('content', {}).get('parts', []) if candidates else []
+        usage = data.get('usageMetadata') or {}
+        return CompletionResult(
+            ''.join(part.get('text', '') for part in parts),
+            prompt_tokens=usage.get('promptTokenCount', 0),
+            completion_tokens=usage.get('candidatesTokenCount', 0),
+        )
+
+
+class OpenAIImageProvider(BaseProvider):
+    """Генерация изображений OpenAI (DALL-E): в ответ возвращается ссылка на картинку"""
+    provider_name = 'openai-images'
+
+    def _complete(self, messages):
+        prompt = next((msg['content'] for msg in reversed(messages) if msg['role'] == 'user'), '')
+        data = self._post(
+            '/images/generations',
+            {
+                'model': self.upstream_model,
+                'prompt': prompt,
+                'n': 1,
+                'size': self.extra.get('size', '1024x1024'),
+            },
+            headers={'Authorization': f'Bearer {self.api_key}'},
+        )
+        images = data.get('data') or []
+        return CompletionResult(images[0].get('url', '') if images else '')
+
+    def estimate_cost(self, prompt_tokens, completion_tokens):
+        # Изображения тарифицируются поштучно
+        return self.extra.get('price_per_image', 0.0)
+
+
+class UnsupportedProvider(BaseProvider):
+    """Модель без публичного API: запрос сразу отклоняется, запрос пользователя не списывается"""
+    provider_name = 'unsupported'
+
+    def _complete(self, messages):
+        raise ProviderError(f'Модель {self.model} пока не поддерживается', status_code=501)
+
+
+PROVIDER_CLASSES = {
+    'openai': OpenAIChatProvider,
+    'anthropic': AnthropicProvider,
+    'gemini': GeminiProvider,
+    'openai-images': OpenAIImageProvider,
+    'unsupported': UnsupportedProvider,
+}
@@ -0,0 +1,92 @@
+"""
+Реестр моделей: каждому значению Chat.AI_MODEL_CHOICES соответствует адаптер провайдера.
+"""
+import threading
+
+from django.conf import settings
+
+from .errors import ProviderError
+from .providers import PROVIDER_CLASSES
+
+
+# Цены - в долларах за 1000 токенов (для изображений - за картинку)
+MODEL_REGISTRY = {
+    'gpt-4o-mini': {
+        'provider': 'openai', 'upstream_model': 'gpt-4o-mini',
+        'price_input_per_1k': 0.00015, 'price_output_per_1k': 0.0006,
+    },
+    'gpt-4': {
+        'provider': 'openai', 'upstream_model': 'gpt-4',
+        'price_input_per_1k': 0.03, 'price_output_per_1k': 0.06,
+    },
+    'gpt3-mini': {
+        'provider': 'openai', 'upstream_model': 'gpt-3.5-turbo',
+        'price_input_per_1k': 0.0005, 'price_output_per_1k': 0.0015,
+    },
+    'claude-3-5': {
+        'provider': 'anthropic', 'upstream_model': 'claude-3-5-sonnet-latest',
+        'price_input_per_1k': 0.003, 'price_output_per_1k': 0.015,
+    },
+    'claude-3-7': {
+        'provider': 'anthropic', 'upstream_model': 'claude-3-7-sonnet-latest',
+        'price_input_per_1k': 0.003, 'price_output_per_1k': 0.015,
+    },
+    'gemini-2-flash': {
+        'provider': 'gemini', 'upstream_model': 'gemini-2.0-flash',
+        'price_input_per_1k': 0.0001, 'price_output_per_1k': 0.0004,
+    },
+    'dall-e': {
+        'provider': 'openai-images', 'upstream_model': 'dall-e-3',
+        'extra': {'size': '1024x1024', 'price_per_image': 0.04},
+    },
+    'midjourney': {
+        'provider': 'unsupported', 'upstream_model': 'midjourney',
+    },
+}
+
+# Генерация изображений использует те же ключ и адрес, что и OpenAI Chat
+PROVIDER_SETTINGS_ALIASES = {
+    'openai-images': 'openai',
+}
+
+_providers = {}
+_lock = threading.Lock()
+
+
+def _build_provider(model):
+    spec = MODEL_REGISTRY.get(model)
+    if spec is None:
+        raise ProviderError(f'Модель {model} не поддерживается', status_code=400)
+
+    provider_key = spec['provider']
+    config_key = PROVIDER_SETTINGS_ALIASES.get(provider_key, provider_key)
+    config = getattr(settings, 'LLM_PROVIDERS', {}).get(config_key, {})
+    return PROVIDER_CLASSES[provider_key](
+        model=model,
+        upstream_model=spec['upstream_model'],
+        base_url=config.get('BASE_URL', ''),
+        api_key=config.get('API_KEY'),
+        timeout=config.get('TIMEOUT', 60),
+        connect_timeout=config.get('CONNECT_TIMEOUT', 5),
+        max_concurrency=spec.get('max_concurrency', config.get('MAX_CONCURRENCY', 10)),
+        pool_size=config.get('POOL_SIZE', 10),
+        price_input_per_1k=spec.get('price_input_per_1k', 0.0),
+        price_output_per_1k=spec.get('price_output_per_1k', 0.0),
+        extra=spec.get('extra'),
+        resilience={**getattr(settings, 'LLM_RESILIENCE', {}), **config.get('RESILIENCE', {})},
+    )
+
+
+def get_provider(model):
+    """Возвращает адаптер модели; адаптеры создаются один раз на процесс"""
+    provider = _providers.get(model)
+    if provider is None:
+        with _lock:
+            provider = _providers.get(model)
+            if provider is None:
+                provider = _providers[model] = _build_provider(model)
+    return provider
+
+
+def provider_stats():
+    return {model: provider.stats() for model, provider in list(_providers.items())}
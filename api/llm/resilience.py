@@ -0,0 +1,148 @@
+"""
+Защита провайдеров ИИ от перегрузки.
+
+AdaptiveLimiter - ограничение одновременных запросов к модели по схеме AIMD:
+лимит плавно растет, пока ответы быстрые и успешные, и уменьшается вдвое
+при ошибках перегрузки (429, 5xx, таймауты) или превышении целевой задержки.
+
+CircuitBreaker - после серии ошибок перестает обращаться к провайдеру
+на reset_timeout секунд, затем пропускает один пробный запрос.
+
+Если место в лимите не освободилось за queue_timeout или размыкатель открыт,
+запрос сразу отклоняется с ProviderUnavailable и подсказкой retry_after.
+"""
+import math
+import threading
+import time
+
+from .errors import ProviderError, ProviderUnavailable
+
+
+def is_overload_error(error):
+    """Ошибки, говорящие о перегрузке или недоступности провайдера, а не о неверном запросе"""
+    if not isinstance(error, ProviderError):
+        return True
+    if isinstance(error, ProviderUnavailable):
+        return False
+    code = error.status_code
+    return code is None or code == 429 or (code >= 500 and code != 501)
+
+
+class AdaptiveLimiter:
+    """Адаптивное ограничение параллельных запросов (AIMD)"""
+
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, latency_target=20.0,
+                 backoff_ratio=0.5, queue_timeout=2.0):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(initial_limit or max_limit)
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise ProviderUnavailable(
+                            'Слишком много одновременных запросов к модели, попробуйте позже',
+                            retry_after=self.retry_after(),
+                        )
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency, overloaded):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if overloaded or latency > self.latency_target:
+                # Не уменьшаем лимит повторно от ответов, отправленных до прошлого снижения
+                if now - self._last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self._last_decrease = now
+            else:
+                # +1 к лимиту примерно за каждые limit успешных запросов
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify()
+
+    def retry_after(self):
+        # Грубая оценка: очередь рассосется примерно за одну целевую задержку
+        return max(1, math.ceil(min(self.latency_target, self.queue_timeout * 2)))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'rejected': self.rejected,
+            }
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: closed -> open после серии ошибок -> half_open -> closed"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Пропускает вызов или сразу отклоняет его, пока провайдер считается недоступным"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if self.state == self.OPEN and elapsed >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            raise ProviderUnavailable(
+                'Провайдер временно недоступен, попробуйте позже',
+                retry_after=max(1, math.ceil(self.reset_timeout - elapsed)),
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def record_ignored(self):
+        """Вызов завершился ошибкой запроса, не говорящей о состоянии провайдера"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures}
@@ -0,0 +1,43 @@
+"""
+Подсчет SQL-запросов на один HTTP-запрос.
+
+При DB_QUERY_COUNT_HEADER = True в ответ добавляются заголовки X-DB-Queries
+(число запросов к БД) и X-DB-Time (их суммарное время в мс). Работает и без
+DEBUG: запросы считаются через connection.execute_wrapper. Используется
+benchmark_chat.py для оценки числа запросов на один ход чата.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.monotonic() - started
+
+
+class QueryCountMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'DB_QUERY_COUNT_HEADER', False)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        response['X-DB-Queries'] = str(counter.count)
+        response['X-DB-Time'] = f'{counter.duration * 1000:.1f}'
+        return response
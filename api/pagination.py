@@ -0,0 +1,69 @@
+"""
+Курсорная (keyset) пагинация по паре (время, id).
+
+Курсор - base64 от строки "<ISO-время>|<id>". Страница выбирается условием
+(время, id) < курсора или (время, id) > курсора с сортировкой по индексу
+(..., время, id), поэтому каждая страница - диапазонное чтение индекса
+без OFFSET.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или подделан"""
+
+
+def encode_cursor(value, pk):
+    """Курсор из значения времени (datetime или ISO-строка из сериализатора) и id"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = f'{value}|{pk}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (datetime, id) или выбрасывает InvalidCursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(value)
+        return moment, int(pk)
+    except (ValueError, UnicodeError, TypeError) as e:
+        raise InvalidCursor(f'Некорректный курсор: {cursor}') from e
+
+
+def parse_limit(value, default, maximum):
+    """Размер страницы из параметра запроса в пределах 1..maximum"""
+    try:
+        limit = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def keyset_page(queryset, field, limit, before=None, since=None):
+    """
+    Одна страница queryset по ключу (field, id).
+
+    Без курсора - самые новые записи; before - записи старше курсора
+    ("загрузить ранее"); since - записи новее курсора (только изменения).
+    Возвращает (записи от новых к старым или от старых к новым для since, есть_еще).
+    """
+    if since is not None:
+        moment, pk = decode_cursor(since)
+        queryset = queryset.filter(Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'id__gt': pk}))
+        queryset = queryset.order_by(field, 'id')
+    else:
+        if before is not None:
+            moment, pk = decode_cursor(before)
+            queryset = queryset.filter(Q(**{f'{field}__lt': moment}) | Q(**{field: moment, 'id__lt': pk}))
+        queryset = queryset.order_by(f'-{field}', '-id')
+
+    rows = list(queryset[:limit + 1])
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,31 @@
+"""
+Кэшированные ответы каталога тарифов для PlanViewSet (см. catalog_cache.py).
+"""
+from django.conf import settings
+
+from bot_admin.models import CatalogVersion
+from catalog_cache import PLANS, CatalogCache
+
+from . import http_cache
+
+plan_cache = CatalogCache(
+    PLANS,
+    load_version=lambda: CatalogVersion.current(PLANS),
+    check_interval=getattr(settings, 'CATALOG_VERSION_CHECK_INTERVAL', 5.0),
+)
+
+
+def cached_response(request, key, build):
+    """
+    Ответ каталога из кэша процесса. Если у клиента уже есть текущая версия
+    (If-None-Match), отвечает 304, не строя ответ.
+    """
+    cache_control = f'public, max-age={settings.CATALOG_CACHE_MAX_AGE}'
+    version = plan_cache.version()
+    if version is not None:
+        etag = plan_cache.etag(key, version)
+        if http_cache.etag_matches(request, etag):
+            return http_cache.conditional_response(request, None, etag=etag, cache_control=cache_control)
+
+    entry = plan_cache.get(key, build)
+    return http_cache.conditional_response(request, entry.data, etag=entry.etag, cache_control=cache_control)
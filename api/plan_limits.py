@@ -0,0 +1,69 @@
+"""
+Проверка ограничений тарифного плана перед обращением к ИИ.
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from bot_admin.models import UserPlan
+from .tokens import count_message_tokens, TOKENS_PER_REPLY
+
+
+class TokenLimitExceeded(Exception):
+    """Запрос не помещается в лимит токенов тарифа"""
+
+    def __init__(self, prompt_tokens, max_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        super().__init__(f'Запрос содержит {prompt_tokens} токенов при лимите {max_tokens}')
+
+
+def get_active_plan(user):
+    """Возвращает текущий активный тарифный план пользователя или None"""
+    user_plan = UserPlan.objects.filter(
+        Q(expired_at__isnull=True) | Q(expired_at__gt=timezone.now()),
+        user_id=user.pk,
+        is_active=True,
+    ).select_related('plan').order_by('-activated_at').first()
+    return user_plan.plan if user_plan else None
+
+
+def get_allowed_models(plan):
+    """Множество моделей, доступных по плану, или None, если ограничений нет"""
+    if not plan or not plan.allowed_models:
+        return None
+    return {model.strip() for model in plan.allowed_models.split(',') if model.strip()}
+
+
+def is_model_allowed(plan, model):
+    allowed = get_allowed_models(plan)
+    return allowed is None or model in allowed
+
+
+def fit_messages_to_plan(plan, model, messages):
+    """
+    Проверяет, что история помещается в plan.max_tokens_per_request.
+
+    При политике TOKEN_LIMIT_POLICY='truncate' отбрасывает самые старые сообщения,
+    при 'reject' - отклоняет запрос целиком. Последнее сообщение пользователя
+    никогда не отбрасывается: если оно одно не помещается, запрос отклоняется.
+
+    Returns:
+        tuple: (сообщения для ИИ, оценка количества токенов)
+    """
+    counts = [count_message_tokens(model, msg) for msg in messages]
+    total = sum(counts) + TOKENS_PER_REPLY
+    max_tokens = plan.max_tokens_per_request if plan else None
+    if not max_tokens or total <= max_tokens:
+        return messages, total
+
+    if getattr(settings, 'TOKEN_LIMIT_POLICY', 'truncate') != 'truncate':
+        raise TokenLimitExceeded(total, max_tokens)
+
+    start = 0
+    while total > max_tokens and start < len(messages) - 1:
+        total -= counts[start]
+        start += 1
+    if total > max_tokens:
+        raise TokenLimitExceeded(total, max_tokens)
+    return messages[start:], total
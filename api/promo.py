@@ -0,0 +1,37 @@
+"""
+Индекс промокодов для API на Django (см. promo_engine.py).
+Сбрасывается сигналами при изменении PromoCode и Plan (api/signals.py).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from bot_admin.models import Plan, PromoCode, PromoCodeUsage
+from promo_engine import EXPIRED_KEEP_DAYS, PromoIndex
+
+
+def load_index():
+    now = timezone.now()
+    active = Q(is_active=True) & (Q(valid_to__isnull=True) | Q(valid_to__gt=now))
+    # Недавно истекшие - чтобы проверка отвечала "срок действия истек", а не "не найден"
+    recent = Q(is_active=True) & (Q(valid_to__isnull=True) | Q(valid_to__gt=now - timedelta(days=EXPIRED_KEEP_DAYS)))
+    rows = PromoCode.objects.filter(recent).values(
+        'id', 'code', 'discount_type', 'discount_value', 'bonus_requests', 'valid_from', 'valid_to',
+        'max_usages', 'usages_count', 'allowed_plans',
+    )
+    prices = Plan.objects.values_list('id', 'price')
+    used = PromoCodeUsage.objects.filter(
+        promo_code__in=PromoCode.objects.filter(active)
+    ).values_list('promo_code_id', 'user_id')
+    return list(rows), list(prices), list(used)
+
+
+promo_index = PromoIndex(load_index, refresh_interval=getattr(settings, 'PROMO_INDEX_REFRESH', 30))
+
+
+def check(code, plan_id=None, user=None):
+    """Проверка промокода по индексу в памяти"""
+    return promo_index.check(code, plan_id, user.pk if user is not None else None, now=timezone.now())
+
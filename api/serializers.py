@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from bot_admin.models import BotUser, Plan, UserPlan, RequestUsage, UserStatistics, PromoCode, Payment, Chat, ChatMessage
+from bot_admin.models import BotUser, Plan, UserPlan, RequestUsage, UserStatistics, PromoCode, Payment, Chat, ChatMessage, ArchivedChatMessage
 
 
 class BotUserSerializer(serializers.ModelSerializer):
@@ -48,9 +48,9 @@ class UserStatisticsSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserStatistics
         fields = ['id', 'user', 'total_requests', 'total_tokens', 'last_active', 
-                  'total_payments', 'total_referrals', 'favorite_model', 'account_level']
+                  'total_payments', 'total_referrals', 'total_referral_revenue', 'favorite_model', 'account_level']
         read_only_fields = ['id', 'total_requests', 'total_tokens', 'last_active', 
-                           'total_payments', 'total_referrals']
+                           'total_payments', 'total_referrals', 'total_referral_revenue']
 
 
 class PromoCodeSerializer(serializers.ModelSerializer):
@@ -128,8 +128,14 @@ class ChatSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Chat
-        fields = ['id', 'user', 'title', 'ai_model', 'ai_model_display', 'created_at', 'updated_at']
-        read_only_fields = ['user', 'created_at', 'updated_at']
+        fields = [
+            'id', 'user', 'title', 'ai_model', 'ai_model_display', 'created_at', 'updated_at',
+            'last_message_at', 'last_message_preview', 'message_count', 'total_tokens'
+        ]
+        read_only_fields = [
+            'user', 'created_at', 'updated_at',
+            'last_message_at', 'last_message_preview', 'message_count', 'total_tokens'
+        ]
 
 class ChatMessageSerializer(serializers.ModelSerializer):
     """Сериализатор для сообщения в чате"""
@@ -142,4 +148,14 @@ class ChatMessageSerializer(serializers.ModelSerializer):
             'model_used': {'read_only': True}, # Заполняется сервером
             'tokens_used': {'read_only': True}, # Заполняется сервером
             'role': {'read_only': True} # Заполняется сервером
-        } 
\ No newline at end of file
+        }
+
+
+class ArchivedChatMessageSerializer(serializers.ModelSerializer):
+    """Сообщение из архива чата в том же формате, что и ChatMessageSerializer"""
+    content = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = ArchivedChatMessage
+        fields = ['id', 'role', 'content', 'model_used', 'tokens_used', 'timestamp']
+        read_only_fields = fields
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from bot_admin.models import BotUser, CatalogVersion, Plan, PromoCode
+from catalog_cache import PLANS
+
+from . import plan_catalog, promo, user_cache
+
+
+@receiver(post_save, sender=BotUser)
+@receiver(post_delete, sender=BotUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Сбрасывает пользователя в кэше аутентификации при любом изменении через ORM"""
+    user_cache.invalidate(instance.telegram_id)
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def bump_plan_catalog(sender, instance, **kwargs):
+    """Новая версия каталога тарифов: кэши ответов во всех процессах устаревают"""
+    CatalogVersion.bump(PLANS)
+    transaction.on_commit(plan_catalog.plan_cache.invalidate)
+    # В индексе промокодов хранятся цены тарифов
+    transaction.on_commit(promo.promo_index.invalidate)
+
+
+@receiver(post_save, sender=PromoCode)
+@receiver(post_delete, sender=PromoCode)
+def invalidate_promo_index(sender, instance, **kwargs):
+    """Изменения промокодов из админки видны сразу в этом процессе, в остальных - после обновления индекса"""
+    transaction.on_commit(promo.promo_index.invalidate)
@@ -0,0 +1,81 @@
+"""
+Локальный подсчет токенов до обращения к ИИ.
+
+Для моделей OpenAI используется tiktoken с кодировкой конкретной модели.
+Для остальных провайдеров открытого токенизатора нет, поэтому считаем
+ближайшей кодировкой OpenAI - этого достаточно для проверки лимитов.
+Если tiktoken не установлен, применяется оценка по количеству символов.
+"""
+import functools
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken необязателен
+    tiktoken = None
+
+
+# Кодировки для моделей из Chat.AI_MODEL_CHOICES
+MODEL_ENCODINGS = {
+    'gpt-4o-mini': 'o200k_base',
+    'gpt-4': 'cl100k_base',
+    'gpt3-mini': 'cl100k_base',
+    'claude-3-5': 'cl100k_base',
+    'claude-3-7': 'cl100k_base',
+    'gemini-2-flash': 'cl100k_base',
+    'dall-e': 'cl100k_base',
+    'midjourney': 'cl100k_base',
+}
+DEFAULT_ENCODING = 'cl100k_base'
+
+# Служебные токены формата чата: на каждое сообщение и на начало ответа ассистента
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Оценка без tiktoken: в среднем ~4 символа на токен для латиницы, для кириллицы меньше
+CHARS_PER_TOKEN = 3
+
+
+def get_encoding_name(model):
+    return MODEL_ENCODINGS.get(model, DEFAULT_ENCODING)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(encoding_name):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        # Нет доступа к файлам кодировки (например, без сети) - используем оценку
+        return None
+
+
+@functools.lru_cache(maxsize=getattr(settings, 'TOKEN_COUNT_CACHE_SIZE', 10000))
+def _count_text(encoding_name, text):
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_text_tokens(model, text):
+    """Количество токенов в тексте для указанной модели"""
+    if not text:
+        return 0
+    return _count_text(get_encoding_name(model), text)
+
+
+def count_message_tokens(model, message):
+    """Количество токенов одного сообщения {'role': ..., 'content': ...}"""
+    return (
+        TOKENS_PER_MESSAGE
+        + count_text_tokens(model, message['role'])
+        + count_text_tokens(model, message['content'])
+    )
+
+
+def count_prompt_tokens(model, messages):
+    """Оценка токенов всего запроса к ИИ"""
+    return sum(count_message_tokens(model, msg) for msg in messages) + TOKENS_PER_REPLY
@@ -18,6 +18,7 @@ urlpatterns = [
     # Аутентификация и регистрация
     path('auth/register/', views.UserRegistrationView.as_view(), name='user-register'),
     path('auth/login/', views.UserLoginView.as_view(), name='user-login'),
+    path('auth/webapp/', views.WebAppSessionView.as_view(), name='webapp-session'),
     
     # Проверка запросов
     path('check-requests/', views.CheckRequestsView.as_view(), name='check-requests'),
@@ -33,6 +34,8 @@ urlpatterns = [
     # Реферальная система
     path('referrals/', views.ReferralsView.as_view(), name='referrals'),
     path('referrals/stats/', views.ReferralStatsView.as_view(), name='referral-stats'),
+    path('referrals/leaderboard/', views.ReferralLeaderboardView.as_view(), name='referral-leaderboard'),
+    path('referrals/downline/', views.ReferralDownlineView.as_view(), name='referral-downline'),
     # Прямой доступ по telegram_id (без JWT)
     path('telegram/requests/', views.DirectTelegramRequestsView.as_view(), name='telegram-requests'),
     path('telegram/use-request/', views.UseRequestByTelegramIDView.as_view(), name='telegram-use-request'),
@@ -41,9 +44,13 @@ urlpatterns = [
 
     # Новые URL для чатов
     path('chats/', views.ChatListView.as_view(), name='chat-list'),
+    path('chats/search/', views.ChatSearchView.as_view(), name='chat-search'),
     path('chats/<int:chat_id>/', views.ChatDetailView.as_view(), name='chat-detail'),
     path('chats/<int:chat_id>/messages/', views.ChatMessageListView.as_view(), name='chat-message-list'),
     path('chats/<int:chat_id>/messages/create/', views.ChatMessageCreateView.as_view(), name='chat-message-create'),
     # URL для создания нового чата и отправки первого сообщения одновременно
     path('messages/create', views.ChatMessageCreateView.as_view(), name='chat-message-create-new'),
+
+    # Метрики для администраторов
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ] 
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Кэш пользователей бота по telegram_id внутри процесса.
+
+TelegramIDAuthentication ищет пользователя при каждом запросе к API; кэш
+на USER_CACHE_TTL секунд убирает этот запрос к БД для частых обращений
+мини-приложения (список чатов, история). Запись сбрасывается сигналами
+post_save/post_delete BotUser (см. api/signals.py). Изменения, сделанные
+в обход ORM (бот, payments_service), видны не позже чем через TTL, поэтому
+представления, работающие с балансом, читают пользователя из БД (fresh_user).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from bot_admin.models import BotUser
+
+
+class TelegramUserCache:
+    """LRU-кэш значений полей BotUser с ограниченным временем жизни"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._field_names = [field.attname for field in BotUser._meta.concrete_fields]
+
+    def get(self, telegram_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[telegram_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            values = entry[1]
+        # Каждый запрос получает свой экземпляр: изменения в представлении не попадут в кэш
+        return BotUser.from_db('default', self._field_names, values)
+
+    def set(self, user):
+        values = tuple(getattr(user, name) for name in self._field_names)
+        with self._lock:
+            self._entries[user.telegram_id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.telegram_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id):
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+user_cache = TelegramUserCache(
+    max_entries=getattr(settings, 'USER_CACHE_MAX_ENTRIES', 10000),
+    ttl=getattr(settings, 'USER_CACHE_TTL', 30),
+)
+
+
+def get_user(telegram_id, fresh=False):
+    """BotUser по telegram_id (из кэша, если fresh=False); выбрасывает BotUser.DoesNotExist"""
+    try:
+        telegram_id = int(telegram_id)
+    except (TypeError, ValueError):
+        raise BotUser.DoesNotExist(f'Некорректный telegram_id: {telegram_id}')
+
+    if not fresh and user_cache.ttl > 0:
+        user = user_cache.get(telegram_id)
+        if user is not None:
+            return user
+    user = BotUser.objects.get(telegram_id=telegram_id)
+    user_cache.set(user)
+    return user
+
+
+def invalidate(telegram_id):
+    user_cache.invalidate(telegram_id)
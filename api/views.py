@@ -1,15 +1,20 @@
 from django.conf import settings
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F, FilteredRelation, OuterRef, Q, Subquery
 from django.utils import timezone
 from rest_framework import viewsets, status, generics
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
-import openai  # Предполагается, что вы будете использовать библиотеку OpenAI
 
-from bot_admin.models import BotUser, Plan, UserPlan, RequestUsage, UserStatistics, PromoCode, Payment, ReferralHistory, Chat, ChatMessage
-from .authentication import TelegramIDAuthentication
+import ranking
+from bot_admin import archive, leaderboard, purge, referral_tree, search
+from bot_admin.models import (
+    BotUser, Plan, UserPlan, RequestUsage, UserStatistics, Payment, ReferralCode, ReferralHistory,
+    Chat, ChatMessage
+)
+from .authentication import SignedSessionAuthentication, TelegramIDAuthentication
 from .permissions import IsTelegramUser, IsOwnerOrReadOnly, CustomIsAuthenticated
 from .serializers import (
     BotUserSerializer, PlanSerializer, UserPlanSerializer, RequestUsageSerializer,
@@ -17,8 +22,40 @@ from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, PromoValidationSerializer,
     UseRequestSerializer, ChatSerializer, ChatMessageSerializer, UserContactSerializer
 )
+from . import (
+    chat_cache, completion_cache, http_cache, llm, pagination, plan_catalog, plan_limits, promo, user_cache,
+    webapp_session
+)
 
-openai.api_key = settings.OPENAI_API_KEY
+
+class TelegramUserMixin:
+    """
+    Пользователь запроса берется из аутентификации (один раз за запрос).
+    Если telegram_id в параметрах отличается от аутентифицированного, пользователь
+    ищется отдельно. fresh_user = True - читать пользователя из БД, минуя кэш.
+    Для сессии мини-приложения (SessionUser) запрос к БД не нужен вовсе.
+    """
+    fresh_user = False
+
+    def get_user(self, request):
+        telegram_id = request.query_params.get('telegram_id') or request.data.get('telegram_id')
+        user = request.user
+        if isinstance(user, webapp_session.SessionUser):
+            # Токен сессии подписан сервером - доверяем ему, а не telegram_id из запроса
+            if self.fresh_user:
+                try:
+                    return user_cache.get_user(user.telegram_id, fresh=True)
+                except BotUser.DoesNotExist:
+                    return None
+            return user.as_bot_user()
+        if not isinstance(user, BotUser):
+            user = None
+        if telegram_id and (user is None or str(user.telegram_id) != str(telegram_id)):
+            try:
+                return user_cache.get_user(telegram_id, fresh=self.fresh_user)
+            except BotUser.DoesNotExist:
+                return None
+        return user
 
 
 class BotUserViewSet(viewsets.ModelViewSet):
@@ -30,11 +67,24 @@ class BotUserViewSet(viewsets.ModelViewSet):
 
 
 class PlanViewSet(viewsets.ReadOnlyModelViewSet):
-    """API для тарифных планов (только чтение)"""
+    """API для тарифных планов (только чтение), ответы кэшируются до смены версии каталога"""
     queryset = Plan.objects.filter(is_active=True)
     serializer_class = PlanSerializer
     permission_classes = [AllowAny]
 
+    def list(self, request, *args, **kwargs):
+        # Ключ - полный путь: параметры пагинации дают разные ответы
+        return plan_catalog.cached_response(
+            request, request.get_full_path(),
+            lambda: super(PlanViewSet, self).list(request, *args, **kwargs).data,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return plan_catalog.cached_response(
+            request, request.path,
+            lambda: super(PlanViewSet, self).retrieve(request, *args, **kwargs).data,
+        )
+
 
 class UserPlanViewSet(viewsets.ModelViewSet):
     """API для планов пользователей"""
@@ -73,19 +123,27 @@ class ReferralStatsView(APIView):
 
         try:
             # Находим пользователя (реферера) по telegram_id
-            referrer_user = BotUser.objects.get(telegram_id=telegram_id)
+            referrer_user = user_cache.get_user(telegram_id)
 
-            # Считаем количество записей в ReferralHistory,
-            # где поле 'referrer' совпадает с найденным пользователем.
-            # Каждая такая запись соответствует одному зарегистрированному рефералу.
-            referral_count = ReferralHistory.objects.filter(referrer=referrer_user).count()
+            # Количество рефералов - готовый счетчик, который обновляется при записи
+            # каждого реферала (bot_admin/referrals.py), а не COUNT по истории
+            code = (
+                ReferralCode.objects.filter(user_id=referrer_user.pk, is_active=True)
+                .order_by('id').values('code', 'total_uses', 'last_used_at').first()
+            )
+            referral_count = (
+                UserStatistics.objects.filter(user_id=referrer_user.pk)
+                .values_list('total_referrals', flat=True).first()
+            ) or 0
 
             # Формируем успешный ответ
             response_data = {
                 'success': True,
                 'telegram_id': referrer_user.telegram_id,
-                'referral_code': referrer_user.referral_code, # Возвращаем код для информации
-                'referral_count': referral_count # Количество перешедших и зарегистрировавшихся
+                'referral_code': code['code'] if code else None, # Возвращаем код для информации
+                'referral_count': referral_count, # Количество перешедших и зарегистрировавшихся
+                'code_uses': code['total_uses'] if code else 0,
+                'last_used_at': code['last_used_at'] if code else None,
             }
             return Response(response_data, status=status.HTTP_200_OK)
 
@@ -211,18 +269,20 @@ class UserRegistrationView(APIView):
             referral_code = data.get('referral_code')
             if referral_code:
                 try:
-                    referrer = BotUser.objects.get(referral_code=referral_code)
-                    ReferralHistory.objects.create(
-                        referrer=referrer,
-                        referred_user=user,
-                        referral_code=referral_code,
-                        bonus_requests_added=int(settings.REFERRAL_BONUS_REQUESTS)
-                    )
-
-                    # Добавляем бонусные запросы реферреру
-                    referrer.requests_left += int(settings.REFERRAL_BONUS_REQUESTS)
-                    referrer.save()
-                except BotUser.DoesNotExist:
+                    code = ReferralCode.objects.select_related('user').get(code=referral_code, is_active=True)
+                    bonus = settings.REFERRAL_BONUS_REQUESTS
+                    with transaction.atomic():
+                        # Счетчики реферала и кода обновляет сигнал post_save (bot_admin/signals.py)
+                        ReferralHistory.objects.create(
+                            referrer_id=code.user_id,
+                            referred=user,
+                            referral_code=code,
+                            bonus_requests_added=bonus
+                        )
+                        # Добавляем бонусные запросы реферреру
+                        BotUser.objects.filter(pk=code.user_id).update(requests_left=F('requests_left') + bonus)
+                    user_cache.invalidate(code.user.telegram_id)
+                except ReferralCode.DoesNotExist:
                     pass
 
             return Response({
@@ -240,6 +300,46 @@ class UserRegistrationView(APIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+class WebAppSessionView(APIView):
+    """
+    Обмен initData мини-приложения Telegram на подписанный токен сессии.
+
+    POST /api/auth/webapp/ {"init_data": "<Telegram.WebApp.initData>"}
+    Токен передается дальше в заголовке "Authorization: Session <токен>".
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        try:
+            telegram_user = webapp_session.verify_init_data(request.data.get('init_data'))
+        except webapp_session.InvalidInitData as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            user = user_cache.get_user(telegram_user['id'], fresh=True)
+        except BotUser.DoesNotExist:
+            return Response({
+                'success': False,
+                'message': 'Пользователь не найден, сначала запустите бота'
+            }, status=status.HTTP_404_NOT_FOUND)
+        if not user.is_active:
+            return Response({'success': False, 'message': 'Пользователь неактивен'}, status=status.HTTP_403_FORBIDDEN)
+
+        plan = plan_limits.get_active_plan(user)
+        return Response({
+            'success': True,
+            'token': webapp_session.issue_token(user, plan),
+            'expires_in': settings.WEBAPP_SESSION_TTL,
+            'user': {
+                'user_id': user.user_id,
+                'telegram_id': user.telegram_id,
+                'requests_left': user.requests_left,
+                'plan': plan.name if plan else None
+            }
+        })
+
+
 class UserLoginView(APIView):
     """Получение информации о пользователе по telegram_id"""
     permission_classes = [AllowAny]
@@ -272,24 +372,19 @@ class UserLoginView(APIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CheckRequestsView(APIView):
+class CheckRequestsView(TelegramUserMixin, APIView):
     """Проверка доступных запросов"""
-    authentication_classes = [TelegramIDAuthentication]
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
+    fresh_user = True  # Баланс запросов читаем из БД, а не из кэша
 
     def get(self, request):
-        # Проверяем, если telegram_id передан в параметрах запроса
-        telegram_id = request.query_params.get('telegram_id')
-        if telegram_id:
-            try:
-                user = BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return Response({
-                    'success': False,
-                    'message': 'Пользователь не найден'
-                }, status=status.HTTP_404_NOT_FOUND)
-        else:
-            user = request.user
+        user = self.get_user(request)
+        if not user:
+            return Response({
+                'success': False,
+                'message': 'Пользователь не найден'
+            }, status=status.HTTP_404_NOT_FOUND)
 
         return Response({
             'success': True,
@@ -298,24 +393,19 @@ class CheckRequestsView(APIView):
         })
 
 
-class UseRequestView(APIView):
+class UseRequestView(TelegramUserMixin, APIView):
     """Использование запроса пользователем"""
-    authentication_classes = [TelegramIDAuthentication]
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
+    fresh_user = True  # Баланс запросов читаем из БД, а не из кэша
 
     def post(self, request):
-        # Проверяем, если telegram_id передан в параметрах запроса
-        telegram_id = request.data.get('telegram_id')
-        if telegram_id:
-            try:
-                user = BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return Response({
-                    'success': False,
-                    'message': 'Пользователь не найден'
-                }, status=status.HTTP_404_NOT_FOUND)
-        else:
-            user = request.user
+        user = self.get_user(request)
+        if not user:
+            return Response({
+                'success': False,
+                'message': 'Пользователь не найден'
+            }, status=status.HTTP_404_NOT_FOUND)
 
         # Проверяем наличие запросов
         if user.requests_left <= 0:
@@ -375,7 +465,7 @@ class ValidatePromoView(APIView):
         telegram_id = request.data.get('telegram_id')
         if telegram_id:
             try:
-                user = BotUser.objects.get(telegram_id=telegram_id)
+                user = user_cache.get_user(telegram_id)
             except BotUser.DoesNotExist:
                 return Response({
                     'success': False,
@@ -389,80 +479,27 @@ class ValidatePromoView(APIView):
             code = serializer.validated_data['code']
             plan_id = serializer.validated_data.get('plan_id')
 
-            try:
-                # Проверяем существование и активность промокода
-                promo = PromoCode.objects.get(
-                    code=code,
-                    is_active=True,
-                    valid_from__lte=timezone.now()
-                )
-
-                # Проверяем срок действия
-                if promo.valid_to and promo.valid_to < timezone.now():
-                    return Response({
-                        'success': False,
-                        'message': 'Срок действия промокода истек'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-                # Проверяем количество использований
-                if promo.max_usages > 0 and promo.usages_count >= promo.max_usages:
-                    return Response({
-                        'success': False,
-                        'message': 'Промокод уже использован максимальное количество раз'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-                # Если указан план, проверяем применимость промокода к этому плану
-                if plan_id and promo.allowed_plans:
-                    allowed_plans = promo.allowed_plans.split(',')
-                    if str(plan_id) not in allowed_plans:
-                        return Response({
-                            'success': False,
-                            'message': 'Промокод не применим к выбранному плану'
-                        }, status=status.HTTP_400_BAD_REQUEST)
-
-                # Если все проверки пройдены, возвращаем данные о промокоде
-                response_data = {
-                    'success': True,
-                    'promo': {
-                        'id': promo.id,
-                        'code': promo.code,
-                        'discount_type': promo.discount_type,
-                        'discount_value': float(promo.discount_value),
-                        'bonus_requests': promo.bonus_requests
-                    }
-                }
-
-                # Если указан план, рассчитываем скидку
-                if plan_id:
-                    try:
-                        plan = Plan.objects.get(id=plan_id)
-                        price = float(plan.price)
-
-                        if promo.discount_type == 'percent':
-                            discount_amount = price * (float(promo.discount_value) / 100)
-                        elif promo.discount_type == 'fixed':
-                            discount_amount = float(promo.discount_value)
-                            if discount_amount > price:
-                                discount_amount = price
-                        else:
-                            discount_amount = 0
-
-                        price_after_discount = max(0, price - discount_amount)
-
-                        response_data.update({
-                            'discount_amount': discount_amount,
-                            'price_after_discount': price_after_discount
-                        })
-                    except Plan.DoesNotExist:
-                        pass
-
-                return Response(response_data)
-
-            except PromoCode.DoesNotExist:
+            # Проверка по индексу промокодов в памяти, без запросов к БД
+            result = promo.check(code, plan_id, user if isinstance(user, BotUser) else None)
+            if not result.ok:
                 return Response({
                     'success': False,
-                    'message': 'Промокод не найден или недействителен'
-                }, status=status.HTTP_404_NOT_FOUND)
+                    'message': result.error
+                }, status=status.HTTP_404_NOT_FOUND if result.promo is None else status.HTTP_400_BAD_REQUEST)
+
+            response_data = {
+                'success': True,
+                'promo': result.promo.as_dict()
+            }
+
+            # Если указан план, рассчитываем скидку
+            if result.price is not None:
+                response_data.update({
+                    'discount_amount': result.discount_amount,
+                    'price_after_discount': result.price_after_discount
+                })
+
+            return Response(response_data)
 
         return Response({
             'success': False,
@@ -471,8 +508,31 @@ class ValidatePromoView(APIView):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+def profile_queryset():
+    """
+    Пользователь вместе со статистикой, активной подпиской, ее тарифом и
+    реферальным кодом - одним запросом к БД.
+    """
+    active_plan_id = UserPlan.objects.filter(
+        user=OuterRef('pk'),
+        is_active=True,
+        expired_at__gt=timezone.now()
+    ).order_by('-activated_at').values('pk')[:1]
+    referral_code = ReferralCode.objects.filter(
+        user=OuterRef('pk'), is_active=True
+    ).order_by('id').values('code')[:1]
+
+    return BotUser.objects.annotate(
+        active_plan=FilteredRelation('userplan', condition=Q(userplan__pk=Subquery(active_plan_id))),
+        active_referral_code=Subquery(referral_code),
+    ).select_related('userstatistics', 'active_plan', 'active_plan__plan')
+
+
 class CurrentUserView(APIView):
-    """Получение данных о текущем пользователе"""
+    """
+    Получение данных о текущем пользователе.
+    Ответ содержит ETag; при совпадении If-None-Match возвращается 304 без тела.
+    """
     permission_classes = [AllowAny]  # Убираем проверку аутентификации полностью
 
     def get(self, request):
@@ -485,29 +545,27 @@ class CurrentUserView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            user = BotUser.objects.get(telegram_id=telegram_id)
-        except BotUser.DoesNotExist:
+            user = profile_queryset().get(telegram_id=telegram_id)
+        except (BotUser.DoesNotExist, ValueError):
             return Response({
                 'success': False,
                 'message': 'Пользователь не найден'
             }, status=status.HTTP_404_NOT_FOUND)
 
         user_data = BotUserSerializer(user).data
+        user_data['referral_code'] = user.active_referral_code
 
-        # Получаем активный план пользователя
-        active_plan = UserPlan.objects.filter(
-            user=user,
-            is_active=True,
-            expired_at__gt=timezone.now()
-        ).order_by('-activated_at').first()
-
+        active_plan = getattr(user, 'active_plan', None)
         active_plan_data = UserPlanSerializer(active_plan).data if active_plan else None
 
-        # Получаем статистику пользователя
-        stats, created = UserStatistics.objects.get_or_create(user=user)
+        # Статистика создается при первом запросе к ИИ; до этого отдаем значения по умолчанию
+        try:
+            stats = user.userstatistics
+        except UserStatistics.DoesNotExist:
+            stats = UserStatistics(user=user)
         stats_data = UserStatisticsSerializer(stats).data
 
-        return Response({
+        return http_cache.conditional_response(request, {
             'success': True,
             'user': user_data,
             'active_plan': active_plan_data,
@@ -515,24 +573,18 @@ class CurrentUserView(APIView):
         })
 
 
-class UserRequestHistoryView(APIView):
+class UserRequestHistoryView(TelegramUserMixin, APIView):
     """Получение истории запросов пользователя"""
-    authentication_classes = [TelegramIDAuthentication]
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
 
     def get(self, request):
-        # Проверяем, если telegram_id передан в параметрах запроса
-        telegram_id = request.query_params.get('telegram_id')
-        if telegram_id:
-            try:
-                user = BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return Response({
-                    'success': False,
-                    'message': 'Пользователь не найден'
-                }, status=status.HTTP_404_NOT_FOUND)
-        else:
-            user = request.user
+        user = self.get_user(request)
+        if not user:
+            return Response({
+                'success': False,
+                'message': 'Пользователь не найден'
+            }, status=status.HTTP_404_NOT_FOUND)
 
         # Получаем параметры пагинации
         page = int(request.query_params.get('page', 1))
@@ -560,51 +612,144 @@ class UserRequestHistoryView(APIView):
         })
 
 
-class ReferralsView(APIView):
+class ReferralsView(TelegramUserMixin, APIView):
     """Получение информации о рефералах пользователя"""
-    authentication_classes = [TelegramIDAuthentication]
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
 
     def get(self, request):
-        # Проверяем, если telegram_id передан в параметрах запроса
-        telegram_id = request.query_params.get('telegram_id')
-        if telegram_id:
-            try:
-                user = BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return Response({
-                    'success': False,
-                    'message': 'Пользователь не найден'
-                }, status=status.HTTP_404_NOT_FOUND)
-        else:
-            user = request.user
+        user = self.get_user(request)
+        if not user:
+            return Response({
+                'success': False,
+                'message': 'Пользователь не найден'
+            }, status=status.HTTP_404_NOT_FOUND)
 
-        # Получаем список рефералов
-        referrals = ReferralHistory.objects.filter(referrer=user).order_by('-created_at')
+        # Курсорная пагинация: ?before=<курсор> - следующая страница более ранних рефералов
+        limit = pagination.parse_limit(
+            request.query_params.get('limit'), settings.REFERRALS_PAGE_SIZE, settings.REFERRALS_PAGE_MAX
+        )
+        try:
+            referrals, has_more = pagination.keyset_page(
+                ReferralHistory.objects.filter(referrer_id=user.pk).select_related('referred'),
+                'created_at', limit, before=request.query_params.get('before')
+            )
+        except pagination.InvalidCursor as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Получаем статистику по оплатам от рефералов
-        total_payments = Payment.objects.filter(
-            user__in=referrals.values_list('referred_user', flat=True)
-        ).aggregate(total=Sum('amount'))
+        # Количество рефералов и доход от них поддерживаются счетчиками (bot_admin/referrals.py)
+        stats = UserStatistics.objects.filter(user_id=user.pk).values(
+            'total_referrals', 'total_referral_revenue'
+        ).first() or {}
 
         # Формируем список рефералов с минимальной информацией
         referral_list = []
         for ref in referrals:
+            referred = ref.referred
             referral_list.append({
-                'user_id': ref.referred_user.user_id,
-                'username': ref.referred_user.username,
-                'first_name': ref.referred_user.first_name,
-                'last_name': ref.referred_user.last_name,
+                'user_id': referred.user_id if referred else None,
+                'username': referred.username if referred else None,
+                'first_name': referred.first_name if referred else None,
+                'last_name': referred.last_name if referred else None,
                 'created_at': ref.created_at.isoformat(),
                 'bonus_requests_added': ref.bonus_requests_added,
                 'conversion_status': ref.conversion_status
             })
 
+        last = referrals[-1] if referrals else None
         return Response({
             'success': True,
             'referrals': referral_list,
-            'total_count': referrals.count(),
-            'total_earnings': float(total_payments['total'] or 0)
+            'has_more': has_more,
+            'next_before': pagination.encode_cursor(last.created_at, last.id) if has_more else None,
+            'total_count': stats.get('total_referrals', 0),
+            'total_earnings': float(stats.get('total_referral_revenue') or 0)
+        })
+
+
+class ReferralLeaderboardView(TelegramUserMixin, APIView):
+    """
+    Таблица лидеров по рефералам и место текущего пользователя.
+    Рейтинг берется из памяти процесса (bot_admin/leaderboard.py).
+
+    GET /api/referrals/leaderboard/?period=week&limit=10
+    period: day, week или all (по умолчанию week)
+    """
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
+    permission_classes = [CustomIsAuthenticated, IsTelegramUser]
+
+    def get(self, request):
+        user = self.get_user(request)
+        if not user:
+            return Response({
+                'success': False,
+                'message': 'Пользователь не найден'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        period = request.query_params.get('period', ranking.WEEK)
+        if period not in ranking.PERIODS:
+            return Response({
+                'success': False,
+                'message': f"Параметр period должен быть одним из: {', '.join(ranking.PERIODS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        limit = pagination.parse_limit(request.query_params.get('limit'), 10, settings.LEADERBOARD_TOP_MAX)
+
+        period_start, top = leaderboard.leaderboard.top(period, limit)
+        my_rank, my_referrals = leaderboard.leaderboard.position(period, user.pk)
+
+        # Имена участников топа - одним запросом
+        names = {
+            row['user_id']: row for row in BotUser.objects.filter(
+                pk__in=[user_id for _, user_id, _ in top]
+            ).values('user_id', 'username', 'first_name')
+        }
+        return Response({
+            'success': True,
+            'period': period,
+            'period_start': period_start.isoformat(),
+            'top': [{
+                'rank': rank,
+                'user_id': user_id,
+                'username': names.get(user_id, {}).get('username'),
+                'first_name': names.get(user_id, {}).get('first_name'),
+                'referrals': referrals,
+            } for rank, user_id, referrals in top],
+            'me': {'rank': my_rank, 'referrals': my_referrals},
+        })
+
+
+class ReferralDownlineView(TelegramUserMixin, APIView):
+    """
+    Размер и доход нижних уровней рефералов пользователя по глубине.
+    Считается по таблице замыкания (bot_admin/referral_tree.py) без рекурсии.
+
+    GET /api/referrals/downline/?max_depth=3
+    """
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
+    permission_classes = [CustomIsAuthenticated, IsTelegramUser]
+
+    def get(self, request):
+        user = self.get_user(request)
+        if not user:
+            return Response({
+                'success': False,
+                'message': 'Пользователь не найден'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        max_depth = pagination.parse_limit(
+            request.query_params.get('max_depth'), 3, settings.REFERRAL_CLOSURE_MAX_DEPTH
+        )
+        levels = referral_tree.downline(user.pk, max_depth)
+        return Response({
+            'success': True,
+            'max_depth': max_depth,
+            'levels': [{
+                'depth': level['depth'],
+                'users': level['users'],
+                'revenue': float(level['revenue']),
+            } for level in levels],
+            'total_users': sum(level['users'] for level in levels),
+            'total_revenue': float(sum(level['revenue'] for level in levels)),
         })
 
 
@@ -797,29 +942,41 @@ class UserInfoByTelegramIDView(APIView):
 
 # Представления для чатов
 
-class ChatListView(APIView):
+class ChatListView(TelegramUserMixin, APIView):
     """Список чатов пользователя и создание нового чата"""
-    authentication_classes = [TelegramIDAuthentication]
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
 
-    def get_user(self, request):
-        """Вспомогательный метод для получения пользователя"""
-        telegram_id = request.query_params.get('telegram_id') or request.data.get('telegram_id')
-        if telegram_id:
-            try:
-                return BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return None
-        return request.user
-
     def get(self, request):
         user = self.get_user(request)
         if not user:
             return Response({'success': False, 'message': 'Пользователь не найден'}, status=status.HTTP_404_NOT_FOUND)
 
-        chats = Chat.objects.filter(user=user)
+        # Курсорная пагинация: ?before=<курсор> - более старые чаты, ?since=<курсор> - обновленные после курсора
+        limit = pagination.parse_limit(
+            request.query_params.get('limit'), settings.CHAT_LIST_PAGE_SIZE, settings.CHAT_LIST_PAGE_MAX
+        )
+        since = request.query_params.get('since')
+        try:
+            chats, has_more = pagination.keyset_page(
+                Chat.objects.filter(user=user, deleted_at__isnull=True), 'updated_at', limit,
+                before=request.query_params.get('before'), since=since
+            )
+        except pagination.InvalidCursor as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Страница since отсортирована от старых изменений к новым, остальные - от новых к старым
+        oldest = newest = None
+        if chats:
+            oldest, newest = (chats[0], chats[-1]) if since else (chats[-1], chats[0])
         serializer = ChatSerializer(chats, many=True)
-        return Response({'success': True, 'chats': serializer.data})
+        return Response({
+            'success': True,
+            'chats': serializer.data,
+            'has_more': has_more,
+            'next_before': pagination.encode_cursor(oldest.updated_at, oldest.id) if oldest else None,
+            'next_since': pagination.encode_cursor(newest.updated_at, newest.id) if newest else since,
+        })
 
     def post(self, request):
         user = self.get_user(request)
@@ -834,21 +991,59 @@ class ChatListView(APIView):
         return Response({'success': False, 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ChatDetailView(APIView):
-    """Удаление и получение чата"""
-    authentication_classes = [TelegramIDAuthentication]
+class ChatSearchView(TelegramUserMixin, APIView):
+    """Поиск по названиям и сообщениям чатов пользователя"""
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
 
-    def get_user(self, request):
-        """Вспомогательный метод для получения пользователя"""
-        telegram_id = request.query_params.get(
-            'telegram_id') or request.data.get('telegram_id')
-        if telegram_id:
-            try:
-                return BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return None
-        return request.user
+    def get(self, request):
+        user = self.get_user(request)
+        if not user:
+            return Response({'success': False, 'message': 'Пользователь не найден'}, status=status.HTTP_404_NOT_FOUND)
+
+        query = (request.query_params.get('q') or '').strip()
+        if not search.search_words(query):
+            return Response({
+                'success': False,
+                'message': f'Введите хотя бы одно слово длиной от {search.MIN_WORD_LENGTH} символов'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = pagination.parse_limit(
+            request.query_params.get('limit'), settings.CHAT_SEARCH_PAGE_SIZE, settings.CHAT_SEARCH_PAGE_MAX
+        )
+        page = pagination.parse_limit(request.query_params.get('page'), 1, settings.CHAT_SEARCH_MAX_PAGES)
+        offset = (page - 1) * limit
+
+        # Сообщения отсортированы по релевантности, поэтому страницы нумерованные, а не курсорные
+        hits = list(
+            search.rank_messages(ChatMessage.objects.filter(chat__user=user, chat__deleted_at__isnull=True), query)
+            .select_related('chat')[offset:offset + limit + 1]
+        )
+        has_more = len(hits) > limit
+        results = [{
+            'chat_id': msg.chat_id,
+            'chat_title': msg.chat.title,
+            'message': chat_cache.serialize_message(msg),
+            'score': round(msg.relevance, 4),
+        } for msg in hits[:limit]]
+
+        response = {
+            'success': True,
+            'query': query,
+            'page': page,
+            'has_more': has_more,
+            'messages': results,
+        }
+        if page == 1:
+            chats = search.rank_chats(Chat.objects.filter(user=user, deleted_at__isnull=True), query)[:settings.CHAT_SEARCH_PAGE_SIZE]
+            response['chats'] = ChatSerializer(chats, many=True).data
+        return Response(response)
+
+
+class ChatDetailView(TelegramUserMixin, APIView):
+    """Удаление и получение чата"""
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
+    permission_classes = [CustomIsAuthenticated, IsTelegramUser]
 
     def get(self, request, chat_id):
         """Получение данных о чате"""
@@ -857,7 +1052,7 @@ class ChatDetailView(APIView):
             return Response({'success': False, 'message': 'Пользователь не найден'}, status=status.HTTP_404_NOT_FOUND)
 
         # Убедимся, что чат принадлежит пользователю
-        chat = get_object_or_404(Chat, id=chat_id, user=user)
+        chat = get_object_or_404(Chat, id=chat_id, user=user, deleted_at__isnull=True)
         serializer = ChatSerializer(chat)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -868,54 +1063,77 @@ class ChatDetailView(APIView):
             return Response({'success': False, 'message': 'Пользователь не найден'}, status=status.HTTP_404_NOT_FOUND)
 
         # Убедимся, что чат принадлежит пользователю
-        chat = get_object_or_404(Chat, id=chat_id, user=user)
-        chat.delete()
-        return Response({'success': True, 'message': 'Чат удален'}, status=status.HTTP_204_NO_CONTENT)
+        chat = get_object_or_404(Chat, id=chat_id, user=user, deleted_at__isnull=True)
+        # Чат сразу пропадает из списка, а сообщения удаляются в фоне пачками
+        job = purge.schedule_chat_purge(chat)
+        chat_cache.forget_chat(chat_id)
+        return Response({
+            'success': True,
+            'message': 'Чат удален',
+            'purge_job_id': job.id
+        }, status=status.HTTP_202_ACCEPTED)
 
 
 
-class ChatMessageListView(APIView):
+class ChatMessageListView(TelegramUserMixin, APIView):
     """Получение сообщений чата"""
-    authentication_classes = [TelegramIDAuthentication]
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
 
-    def get_user(self, request):
-        """Вспомогательный метод для получения пользователя"""
-        telegram_id = request.query_params.get('telegram_id') or request.data.get('telegram_id')
-        if telegram_id:
-            try:
-                return BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return None
-        return request.user
-
     def get(self, request, chat_id):
         user = self.get_user(request)
         if not user:
             return Response({'success': False, 'message': 'Пользователь не найден'}, status=status.HTTP_404_NOT_FOUND)
 
         # Убедимся, что чат принадлежит пользователю
-        chat = get_object_or_404(Chat, id=chat_id, user=user)
+        chat = get_object_or_404(Chat, id=chat_id, user=user, deleted_at__isnull=True)
+
+        # Курсорная пагинация: ?before=<курсор> - более ранние сообщения, ?since=<курсор> - только новые
+        limit = pagination.parse_limit(
+            request.query_params.get('limit'), settings.CHAT_MESSAGES_PAGE_SIZE, settings.CHAT_MESSAGES_PAGE_MAX
+        )
+        before = request.query_params.get('before')
+        since = request.query_params.get('since')
+
+        if not before and not since:
+            # Последняя страница обычно целиком лежит в кэше истории чата
+            cached_messages, complete = chat_cache.get_recent_messages(chat)
+            if complete or len(cached_messages) >= limit:
+                messages = cached_messages[-limit:]
+                return self.page_response(messages, not complete or len(cached_messages) > limit)
+
+        try:
+            # Сообщения неактивного чата читаются из архива с распаковкой
+            rows, has_more = pagination.keyset_page(
+                chat_cache.message_model(chat).objects.filter(chat=chat), 'timestamp', limit,
+                before=before, since=since
+            )
+        except pagination.InvalidCursor as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not since:
+            rows.reverse()  # Сообщения всегда отдаются в хронологическом порядке
+        return self.page_response([chat_cache.serialize_message(row) for row in rows], has_more, since)
 
-        messages = ChatMessage.objects.filter(chat=chat)
-        serializer = ChatMessageSerializer(messages, many=True)
-        return Response({'success': True, 'messages': serializer.data})
+    def page_response(self, messages, has_more, since=None):
+        """
+        has_more - есть ли еще более ранние сообщения (для since - более новые);
+        next_before и next_since - курсоры для следующих запросов.
+        """
+        first, last = (messages[0], messages[-1]) if messages else (None, None)
+        return Response({
+            'success': True,
+            'messages': messages,
+            'has_more': has_more,
+            'next_before': pagination.encode_cursor(first['timestamp'], first['id']) if first else None,
+            'next_since': pagination.encode_cursor(last['timestamp'], last['id']) if last else since,
+        })
 
 
-class ChatMessageCreateView(APIView):
+class ChatMessageCreateView(TelegramUserMixin, APIView):
     """Создание сообщения в чате, взаимодействие с ИИ и списание запроса"""
-    authentication_classes = [TelegramIDAuthentication]
+    authentication_classes = [SignedSessionAuthentication, TelegramIDAuthentication]
     permission_classes = [CustomIsAuthenticated, IsTelegramUser]
-
-    def get_user(self, request):
-        """Вспомогательный метод для получения пользователя"""
-        telegram_id = request.query_params.get('telegram_id') or request.data.get('telegram_id')
-        if telegram_id:
-            try:
-                return BotUser.objects.get(telegram_id=telegram_id)
-            except BotUser.DoesNotExist:
-                return None
-        return request.user
+    fresh_user = True  # Списывает запросы - баланс читаем из БД
 
     def post(self, request, chat_id=None):
         user = self.get_user(request)
@@ -930,26 +1148,33 @@ class ChatMessageCreateView(APIView):
         # Получаем модель ИИ из запроса или используем значение по умолчанию
         ai_model_to_use = request.data.get('ai_model', 'gpt-4o-mini')
 
+        # 1. Проверить, что модель доступна на тарифе пользователя
+        plan = plan_limits.get_active_plan(user)
+        if not plan_limits.is_model_allowed(plan, ai_model_to_use):
+            return Response({
+                'success': False,
+                'message': 'Выбранная модель недоступна на вашем тарифе'
+            }, status=status.HTTP_403_FORBIDDEN)
+
         # Создаем новый чат, если chat_id равен 0, null или не существует
         if not chat_id or chat_id == 0:
-            # Создаем новый чат
-            # Название чата = первые 30 символов сообщения пользователя
-            title = user_message_content[:30] + ('...' if len(user_message_content) > 30 else '')
-            chat = Chat.objects.create(
-                user=user,
-                title=title,
-                ai_model=ai_model_to_use
-            )
+            chat = None
+            history = []
         else:
             # Находим существующий чат
             try:
-                chat = Chat.objects.get(id=chat_id, user=user)
+                chat = Chat.objects.get(id=chat_id, user=user, deleted_at__isnull=True)
                 # Обновляем модель, если она была изменена
+                # Новое сообщение в архивном чате: возвращаем историю в рабочую таблицу
+                if chat.archived_at:
+                    archive.restore_chat(chat)
                 if chat.ai_model != ai_model_to_use:
                     chat.ai_model = ai_model_to_use
-                    chat.save()
+                    chat.save(update_fields=['ai_model', 'updated_at'])  # Не затираем сводку по сообщениям
             except Chat.DoesNotExist:
                 return Response({'success': False, 'message': 'Чат не найден'}, status=status.HTTP_404_NOT_FOUND)
+            # Последние CHAT_HISTORY_MAX_MESSAGES сообщений из кэша
+            history, _ = chat_cache.get_recent_messages(chat)
 
         # 2. Проверить наличие запросов
         if user.requests_left <= 0:
@@ -959,53 +1184,77 @@ class ChatMessageCreateView(APIView):
                 'requests_left': 0
             }, status=status.HTTP_403_FORBIDDEN)
 
+        # 3. Подготовка запроса к ИИ: история + новое сообщение в пределах лимита токенов тарифа
+        candidate_messages = [
+            {"role": msg['role'], "content": msg['content']}
+            for msg in history
+        ]
+        candidate_messages.append({"role": "user", "content": user_message_content})
+        try:
+            messages_for_ai, prompt_tokens = plan_limits.fit_messages_to_plan(
+                plan, ai_model_to_use, candidate_messages
+            )
+        except plan_limits.TokenLimitExceeded as e:
+            return Response({
+                'success': False,
+                'message': 'Сообщение превышает лимит токенов вашего тарифа',
+                'prompt_tokens': e.prompt_tokens,
+                'max_tokens': e.max_tokens
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        chat_created = chat is None
+        if chat_created:
+            # Название чата = первые 30 символов сообщения пользователя
+            title = user_message_content[:30] + ('...' if len(user_message_content) > 30 else '')
+            chat = Chat.objects.create(
+                user=user,
+                title=title,
+                ai_model=ai_model_to_use
+            )
+            chat_cache.prime_chat(chat)
+
         # 4. Сохранить сообщение пользователя
         user_message = ChatMessage.objects.create(
             chat=chat,
             role='user',
             content=user_message_content
         )
-
-        # 5. Подготовка запроса к ИИ (передаем историю)
-        messages_for_ai = [
-            {"role": msg.role, "content": msg.content}
-            for msg in ChatMessage.objects.filter(chat=chat).order_by('timestamp')
-        ]
+        chat_cache.record_message(user_message)
 
         ai_response_content = "Произошла ошибка при обращении к ИИ." # Значение по умолчанию
-        tokens_used = 0 # Значение по умолчанию
+        tokens_used = prompt_tokens # Локальная оценка, уточняется по ответу провайдера
+
+        # Повторяющийся запрос отдаем из кэша ответов, не обращаясь к провайдеру
+        cached_completion = completion_cache.lookup(chat.ai_model, messages_for_ai)
 
         # --- БЛОК ВЗАИМОДЕЙСТВИЯ С ИИ ---
         try:
             # Используем выбранную модель
-            if chat.ai_model.startswith('gpt'):
-                # Для моделей OpenAI
-                print(f"Используем модель: {chat.ai_model}")
-                response = openai.chat.completions.create(
-                    model=chat.ai_model,
-                    messages=messages_for_ai,
-                    # max_tokens=4000 # Можно добавить ограничения для некоторых моделей
-                )
-                # Убедитесь, что структура ответа соответствует новой версии API OpenAI
-                if response.choices and len(response.choices) > 0:
-                    ai_response_content = response.choices[0].message.content
-                if response.usage:
-                    tokens_used = response.usage.total_tokens
-            elif chat.ai_model.startswith('claude'):
-                # Для моделей Claude
-                # Здесь будет код для API Claude
-                ai_response_content = "Ответ от Claude (интеграция в разработке)"
-            elif chat.ai_model.startswith('gemini'):
-                # Для моделей Gemini
-                # Здесь будет код для API Gemini
-                ai_response_content = "Ответ от Gemini (интеграция в разработке)"
-            elif chat.ai_model in ['dall-e', 'midjourney']:
-                # Для генерации изображений
-                # Здесь будет код для генерации изображений
-                ai_response_content = "Ссылка на сгенерированное изображение (интеграция в разработке)"
+            if cached_completion:
+                ai_response_content = cached_completion['content']
+                tokens_used = 0 # Токены у провайдера не расходовались
             else:
-                # Если модель не поддерживается
-                ai_response_content = "Выбранная модель не поддерживается в данный момент"
+                # Общая очередь с приоритетом по тарифу, затем адаптер модели чата (см. api/llm/registry.py)
+                with llm.admit(user, plan):
+                    result = llm.complete(chat.ai_model, messages_for_ai)
+                ai_response_content = result.content
+                if result.total_tokens:
+                    tokens_used = result.total_tokens
+                completion_cache.store(chat.ai_model, messages_for_ai, ai_response_content, tokens_used)
+        except llm.ProviderUnavailable as e:
+            # Очередь или провайдер перегружены: запрос не дошел до модели,
+            # поэтому убираем сообщение пользователя, чтобы повтор не задвоил историю
+            user_message.delete()
+            chat_cache.forget_chat(chat.id)
+            if chat_created:
+                chat.delete()
+            response = Response({
+                'success': False,
+                'message': str(e),
+                'retry_after': e.retry_after
+            }, status=e.status_code)
+            response['Retry-After'] = str(e.retry_after)
+            return response
         except Exception as e:
             # Обработка ошибок ИИ
             error_message = f"Ошибка при обращении к ИИ: {str(e)}"
@@ -1016,6 +1265,7 @@ class ChatMessageCreateView(APIView):
                 model_used=chat.ai_model,
                 tokens_used=0
             )
+            chat_cache.record_message(assistant_message)
             # Возвращаем ошибку пользователю, не 500, а например 400 или 503
             return Response({
                 'success': False, 
@@ -1024,9 +1274,10 @@ class ChatMessageCreateView(APIView):
             }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         # --- КОНЕЦ БЛОКА ИИ ---
 
-        # 3. Списать 1 запрос
-        user.requests_left -= 1
-        user.save()
+        # 3. Списать 1 запрос (за ответ из кэша - в зависимости от тарифа)
+        if not cached_completion or completion_cache.hit_costs_request(plan):
+            user.requests_left -= 1
+            user.save()
 
         # 7. Сохранить ответ ИИ
         assistant_message = ChatMessage.objects.create(
@@ -1036,13 +1287,15 @@ class ChatMessageCreateView(APIView):
             model_used=chat.ai_model,
             tokens_used=tokens_used
         )
+        chat_cache.record_message(assistant_message)
 
         # 9. Вернуть ответ ИИ пользователю с данными чата
         return Response({
             'success': True, 
             'message': ChatMessageSerializer(assistant_message).data,
             'chat': ChatSerializer(chat).data,
-            'requests_left': user.requests_left
+            'requests_left': user.requests_left,
+            'cached': bool(cached_completion)
         })
 
 
@@ -1088,4 +1341,21 @@ class ReferralLinkView(APIView):
             return Response({
                 'success': False,
                 'message': 'Пользователь не найден'
-            }, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+            }, status=status.HTTP_404_NOT_FOUND)
+
+class MetricsView(APIView):
+    """Метрики внутренних кэшей API (только для администраторов)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'success': True,
+            'chat_history_cache': chat_cache.chat_history_cache.stats(),
+            'completion_cache': completion_cache.completion_cache.stats(),
+            'providers': llm.provider_stats(),
+            'admission': llm.get_admission_queue().stats(),
+            'user_cache': user_cache.user_cache.stats(),
+            'plan_catalog': plan_catalog.plan_cache.stats(),
+            'promo_index': promo.promo_index.stats(),
+            'leaderboard': leaderboard.leaderboard.stats(),
+        })
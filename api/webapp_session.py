@@ -0,0 +1,111 @@
+"""
+Сессии мини-приложения на основе Telegram WebApp initData.
+
+Мини-приложение один раз отправляет initData на /api/auth/webapp/; подпись
+проверяется по токену бота (https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app),
+и в ответ выдается подписанный SECRET_KEY токен с user_id, telegram_id,
+is_active и уровнем тарифа. Дальше SignedSessionAuthentication проверяет
+токен без обращения к БД.
+"""
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.core import signing
+
+from bot_admin.models import BotUser
+
+SESSION_SALT = 'api.webapp-session'
+
+
+class InvalidInitData(ValueError):
+    """initData не прошли проверку подписи или устарели"""
+
+
+def verify_init_data(init_data, bot_token=None, max_age=None):
+    """Проверяет подпись initData и возвращает данные пользователя Telegram (dict)"""
+    bot_token = bot_token or settings.TELEGRAM_BOT_TOKEN
+    max_age = settings.WEBAPP_INIT_DATA_MAX_AGE if max_age is None else max_age
+    if not bot_token:
+        raise InvalidInitData('Не задан TELEGRAM_BOT_TOKEN')
+
+    fields = dict(parse_qsl(init_data or '', keep_blank_values=True))
+    received_hash = fields.pop('hash', None)
+    if not received_hash:
+        raise InvalidInitData('В initData нет подписи')
+
+    data_check_string = '\n'.join(f'{key}={value}' for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        raise InvalidInitData('Неверная подпись initData')
+
+    try:
+        auth_date = int(fields.get('auth_date', 0))
+    except ValueError:
+        raise InvalidInitData('Некорректный auth_date')
+    if max_age and time.time() - auth_date > max_age:
+        raise InvalidInitData('initData устарели, откройте мини-приложение заново')
+
+    try:
+        user = json.loads(fields.get('user', ''))
+    except ValueError:
+        raise InvalidInitData('В initData нет данных пользователя')
+    if not isinstance(user, dict) or 'id' not in user:
+        raise InvalidInitData('В initData нет данных пользователя')
+    return user
+
+
+def issue_token(user, plan=None):
+    """Подписанный токен сессии для BotUser и его активного тарифа"""
+    payload = {
+        'uid': user.pk,
+        'tid': user.telegram_id,
+        'act': user.is_active,
+        'plan': plan.pk if plan else None,
+        'tier': plan.priority if plan else 0,
+    }
+    return signing.dumps(payload, salt=SESSION_SALT, compress=True)
+
+
+def read_token(token, max_age=None):
+    """Проверяет подпись и срок жизни токена, возвращает SessionUser"""
+    max_age = settings.WEBAPP_SESSION_TTL if max_age is None else max_age
+    payload = signing.loads(token, salt=SESSION_SALT, max_age=max_age)
+    return SessionUser(
+        user_id=payload['uid'],
+        telegram_id=payload['tid'],
+        is_active=payload['act'],
+        plan_id=payload.get('plan'),
+        plan_tier=payload.get('tier', 0),
+    )
+
+
+class SessionUser:
+    """Пользователь из токена сессии: данные без обращения к БД"""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, telegram_id, is_active, plan_id=None, plan_tier=0):
+        self.user_id = user_id
+        self.pk = user_id
+        self.telegram_id = telegram_id
+        self.is_active = is_active
+        self.plan_id = plan_id
+        self.plan_tier = plan_tier
+
+    def as_bot_user(self):
+        """
+        BotUser с заполненными user_id, telegram_id и is_active; остальные поля
+        отложены и загрузятся из БД только при обращении к ним.
+        """
+        return BotUser.from_db(
+            'default', ['user_id', 'telegram_id', 'is_active'],
+            [self.user_id, self.telegram_id, self.is_active],
+        )
+
+    def __str__(self):
+        return f'SessionUser({self.telegram_id})'
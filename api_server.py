@@ -1,16 +1,27 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from payments_service import PaymentService
+from payments_service import CONNECT_ERRORS, PaymentService
 from werkzeug.security import check_password_hash
+import base64
 import os
 import uuid
 import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 import jwt
 from dotenv import load_dotenv
-import pymysql
 import bcrypt
 
+import catalog_cache
+import config
+import db_pool
+import payment_queue
+import promo_engine
+import referral_stats
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -24,17 +35,62 @@ app.config['JWT_EXPIRATION_TIME'] = int(os.getenv('JWT_EXPIRATION_TIME', 3600))
 # Инициализация сервиса платежей
 payment_service = PaymentService()
 
-# Подключение к БД
+# Подключение к БД: соединения берутся из общего пула (db_pool.py),
+# conn.close() возвращает соединение в пул
 def get_db_connection():
-    return pymysql.connect(
-        host=os.getenv('DB_HOST', 'localhost'),
-        port=int(os.getenv('DB_PORT', 3306)),
-        user=os.getenv('DB_USER', 'root'),
-        password=os.getenv('DB_PASSWORD', ''),
-        db=os.getenv('DB_NAME', 'ai_bot'),
-        charset=os.getenv('DB_CHARSET', 'utf8mb4'),
-        cursorclass=pymysql.cursors.DictCursor
-    )
+    return db_pool.get_connection()
+
+
+class VerifiedTokenCache:
+    """
+    Кэш проверенных JWT: sha256 токена -> полезная нагрузка до истечения exp.
+    Повторные запросы с тем же токеном не проверяют подпись заново.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, token, payload):
+        expires_at = payload.get('exp')
+        if not expires_at:
+            # Бессрочные токены не кэшируем, чтобы не хранить их вечно
+            return
+        with self._lock:
+            self._entries[self._key(token)] = (expires_at, payload)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+token_cache = VerifiedTokenCache(config.TOKEN_CACHE_SIZE)
+
+
+def decode_token(token):
+    """Полезная нагрузка JWT: из кэша или после проверки подписи и срока"""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+        token_cache.set(token, payload)
+    return payload
+
 
 # Middleware для проверки JWT токена
 def token_required(f):
@@ -43,36 +99,55 @@ def token_required(f):
         token = None
         
         # Получаем токен из заголовка
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization'].split(" ")[1]
+        parts = request.headers.get('Authorization', '').split(" ")
+        if len(parts) == 2:
+            token = parts[1]
         
         if not token:
             return jsonify({'message': 'Токен отсутствует!'}), 401
             
         try:
-            # Декодируем токен
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = data
-            
-            # Проверка существования пользователя
-            conn = get_db_connection()
+            data = decode_token(token)
+        except jwt.InvalidTokenError as e:
+            return jsonify({'message': f'Недействительный токен: {str(e)}'}), 401
+
+        # Токены выдаются с user_id (login, register, generate_token)
+        user_id = data.get('user_id', data.get('id'))
+        if user_id is None:
+            return jsonify({'message': 'Недействительный токен: нет user_id'}), 401
+
+        # Проверка существования пользователя; строка передается в обработчик,
+        # чтобы он не читал ее повторно
+        conn = get_db_connection()
+        try:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = %s", (current_user['id'],))
+            cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
             current_user = cursor.fetchone()
             cursor.close()
+        finally:
             conn.close()
             
-            if not current_user:
-                return jsonify({'message': 'Пользователь не найден!'}), 401
-                
-        except Exception as e:
-            return jsonify({'message': f'Недействительный токен: {str(e)}'}), 401
+        if not current_user:
+            return jsonify({'message': 'Пользователь не найден!'}), 401
             
-        # Передаем ID пользователя в функцию
         return f(current_user, *args, **kwargs)
     
     return decorated
 
+# Курсор постраничной выдачи: base64 от "<ISO-время>|<id>"
+def encode_cursor(moment, row_id):
+    raw = f'{moment.isoformat()}|{row_id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Возвращает (datetime, id) или выбрасывает ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        moment, row_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return datetime.datetime.fromisoformat(moment), row_id
+    except (ValueError, UnicodeError, TypeError) as e:
+        raise ValueError(cursor) from e
+
 # Хелпер для генерации JWT токена
 def generate_token(user_id):
     payload = {
@@ -164,6 +239,10 @@ def register():
             )
         )
         
+        # Счетчик рефералов пригласившего
+        if data.get('referrer_id'):
+            cursor.execute(referral_stats.REFERRAL_RECORDED_SQL, (data.get('referrer_id'),))
+        
         # Назначение базового плана для нового пользователя
         cursor.execute("SELECT id FROM plans WHERE name = 'Базовый' LIMIT 1")
         plan = cursor.fetchone()
@@ -209,42 +288,51 @@ def get_user_info(current_user):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Получаем данные пользователя
+    # Строка пользователя уже загружена в token_required; статистика и активный
+    # план дочитываются одним запросом
     cursor.execute('''
-        SELECT u.*, 
-               COALESCE(us.total_requests, 0) as total_requests,
-               COALESCE(us.total_tokens, 0) as total_tokens,
-               COALESCE(us.total_payments, 0) as total_payments,
-               COALESCE(us.total_referrals, 0) as total_referrals,
-               us.account_level,
-               us.last_active
+        SELECT us.total_requests, us.total_tokens, us.total_payments, us.total_referrals,
+               us.account_level, us.last_active,
+               up.id AS plan_row_id, up.user_id AS plan_user_id, up.plan_id, up.start_date, up.end_date,
+               p.name AS plan_name, p.requests_allowed, p.price, p.description
         FROM users u
-        LEFT JOIN user_statistics us ON u.id = us.user_id
+        LEFT JOIN user_statistics us ON us.user_id = u.id
+        LEFT JOIN user_plans up ON up.id = (
+            SELECT up2.id FROM user_plans up2
+            WHERE up2.user_id = u.id AND up2.end_date >= NOW()
+            ORDER BY up2.start_date DESC
+            LIMIT 1
+        )
+        LEFT JOIN plans p ON p.id = up.plan_id
         WHERE u.id = %s
     ''', (current_user['id'],))
     
-    user = cursor.fetchone()
-    
-    # Получаем активный план пользователя
-    cursor.execute('''
-        SELECT up.*, p.name as plan_name, p.requests_allowed, p.price, p.description
-        FROM user_plans up
-        JOIN plans p ON up.plan_id = p.id
-        WHERE up.user_id = %s AND up.end_date >= NOW()
-        ORDER BY up.start_date DESC
-        LIMIT 1
-    ''', (current_user['id'],))
-    
-    active_plan = cursor.fetchone()
-    
-    # Получаем реферальный код пользователя
-    cursor.execute('SELECT referral_code FROM users WHERE id = %s', (current_user['id'],))
-    referral = cursor.fetchone()
+    row = cursor.fetchone() or {}
     
     cursor.close()
     conn.close()
     
-    return jsonify({
+    user = dict(current_user)
+    user.update({key: row.get(key) for key in (
+        'total_requests', 'total_tokens', 'total_payments', 'total_referrals', 'account_level', 'last_active'
+    )})
+    
+    active_plan = None
+    if row.get('plan_row_id') is not None:
+        active_plan = {
+            'id': row['plan_row_id'],
+            'user_id': row['plan_user_id'],
+            'plan_id': row['plan_id'],
+            'start_date': row['start_date'],
+            'end_date': row['end_date'],
+            'plan_name': row['plan_name'],
+            'requests_allowed': row['requests_allowed'],
+            'price': row['price'],
+            'description': row['description'],
+        }
+    
+    # Строгий ETag по телу ответа: при If-None-Match с тем же значением - 304 без тела
+    response = jsonify({
         'success': True,
         'user': {
             'user_id': user['id'],
@@ -253,45 +341,30 @@ def get_user_info(current_user):
             'telegram_id': user['telegram_id'],
             'requests_left': user.get('requests_left', 0),
             'created_at': user['created_at'].isoformat() if user.get('created_at') else None,
-            'total_requests': user.get('total_requests', 0),
-            'total_tokens': user.get('total_tokens', 0),
+            'total_requests': user.get('total_requests') or 0,
+            'total_tokens': user.get('total_tokens') or 0,
             'total_payments': float(user.get('total_payments', 0)) if user.get('total_payments') else 0,
-            'total_referrals': user.get('total_referrals', 0),
-            'account_level': user.get('account_level', 'standard'),
+            'total_referrals': user.get('total_referrals') or 0,
+            'account_level': user.get('account_level') or 'standard',
             'last_active': user.get('last_active').isoformat() if user.get('last_active') else None,
-            'referral_code': referral['referral_code'] if referral else None
+            'referral_code': current_user.get('referral_code')
         },
         'active_plan': active_plan
     })
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 # Новый маршрут для получения количества оставшихся запросов
 @app.route('/api/user/requests_left', methods=['GET'])
 @token_required
 def get_requests_left(current_user):
     """Получение количества оставшихся запросов пользователя"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Получаем количество оставшихся запросов
-    cursor.execute('''
-        SELECT requests_left FROM users WHERE id = %s
-    ''', (current_user['id'],))
-    
-    user = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    
-    if not user:
-        return jsonify({
-            'success': False,
-            'message': 'Пользователь не найден'
-        }), 404
-    
+    # Строка пользователя уже прочитана в token_required в рамках этого запроса
     return jsonify({
         'success': True,
         'user_id': current_user['id'],
-        'requests_left': user.get('requests_left', 0)
+        'requests_left': current_user.get('requests_left', 0)
     })
 
 # Управление запросами
@@ -302,7 +375,7 @@ def check_requests(current_user):
     """
     Проверка доступных запросов пользователя
     """
-    requests_left = payment_service.get_user_requests_left(current_user['id'])
+    requests_left = current_user.get('requests_left') or 0
     
     return jsonify({
         'success': True,
@@ -329,30 +402,41 @@ def use_request(current_user):
     if not data:
         return jsonify({'message': 'Отсутствуют данные запроса!', 'success': False}), 400
     
-    # Проверяем наличие запросов
-    requests_left = payment_service.get_user_requests_left(current_user['id'])
-    
-    if requests_left <= 0:
-        return jsonify({
-            'success': False,
-            'message': 'У вас закончились запросы. Пожалуйста, пополните баланс.',
-            'requests_left': 0
-        }), 403
-    
-    # Уменьшаем счетчик запросов
-    new_count = payment_service.decrement_user_requests(current_user['id'])
-    
-    # Добавляем запись об использовании
-    payment_service.add_usage_record(
-        user_id=current_user['id'],
-        request_type=data.get('request_type', 'text'),
-        ai_model=data.get('ai_model', 'unknown'),
-        tokens_used=data.get('tokens_used', 0),
-        was_successful=True,
-        request_text=data.get('request_text'),
-        response_length=data.get('response_length', 0),
-        response_time=data.get('response_time')
-    )
+    # Все три операции - на одном соединении из пула payments_service
+    try:
+        conn = payment_service.borrow()
+    except CONNECT_ERRORS as e:
+        print(f"Нет соединения с БД для списания запроса: {e}")
+        response = jsonify({'message': 'Сервис временно недоступен, повторите позже', 'success': False})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    with conn:
+        # Проверяем наличие запросов
+        requests_left = payment_service.get_user_requests_left(current_user['id'], conn=conn)
+
+        if requests_left <= 0:
+            return jsonify({
+                'success': False,
+                'message': 'У вас закончились запросы. Пожалуйста, пополните баланс.',
+                'requests_left': 0
+            }), 403
+
+        # Уменьшаем счетчик запросов
+        new_count = payment_service.decrement_user_requests(current_user['id'], conn=conn)
+
+        # Добавляем запись об использовании
+        payment_service.add_usage_record(
+            user_id=current_user['id'],
+            request_type=data.get('request_type', 'text'),
+            ai_model=data.get('ai_model', 'unknown'),
+            tokens_used=data.get('tokens_used', 0),
+            was_successful=True,
+            request_text=data.get('request_text'),
+            response_length=data.get('response_length', 0),
+            response_time=data.get('response_time'),
+            conn=conn
+        )
     
     return jsonify({
         'success': True,
@@ -362,68 +446,120 @@ def use_request(current_user):
 
 # Тарифные планы
 
+def load_plans_version():
+    """Версия каталога тарифов из catalog_versions (ее увеличивает админка на Django)"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM catalog_versions WHERE name = %s", (catalog_cache.PLANS,))
+        row = cursor.fetchone()
+        cursor.close()
+    except Exception:
+        # Без таблицы версий работаем без кэша
+        return None
+    finally:
+        conn.close()
+    return row['version'] if row else 0
+
+
+plans_cache = catalog_cache.CatalogCache(
+    catalog_cache.PLANS,
+    load_version=load_plans_version,
+    check_interval=config.CATALOG_VERSION_CHECK_INTERVAL,
+)
+
+
+def serialize_plan(plan):
+    # Преобразуем Decimal в float для JSON сериализации
+    plan['price'] = float(plan['price'])
+    if plan.get('discount_percent'):
+        plan['discount_percent'] = float(plan['discount_percent'])
+    # Преобразуем datetime объекты в строки
+    plan['created_at'] = plan['created_at'].isoformat() if plan['created_at'] else None
+    return plan
+
+
+def catalog_response(key, build, not_found_message=None):
+    """
+    Ответ каталога тарифов из кэша процесса с ETag версии каталога и Cache-Control.
+    build() возвращает данные ответа или None, если объекта нет (404).
+    """
+    cache_control = f'public, max-age={config.CATALOG_CACHE_MAX_AGE}'
+    version = plans_cache.version()
+    if version is not None:
+        etag = plans_cache.etag(key, version)
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            response = app.response_class(status=304)
+            response.set_etag(etag.strip('"'))
+            response.headers['Cache-Control'] = cache_control
+            return response
+
+    entry = plans_cache.get(key, build)
+    if entry.data is None:
+        return jsonify({'message': not_found_message, 'success': False}), 404
+
+    response = jsonify(entry.data)
+    response.headers['Cache-Control'] = cache_control
+    if entry.etag:
+        response.set_etag(entry.etag.strip('"'))
+    else:
+        response.add_etag()
+    return response.make_conditional(request)
+
+
 @app.route('/api/plans', methods=['GET'])
 def get_plans():
     """
     Получение списка доступных тарифных планов
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute('''
-        SELECT *
-        FROM plans
-        WHERE is_active = TRUE
-        ORDER BY priority, price
-    ''')
-    
-    plans = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    # Преобразуем Decimal в float для JSON сериализации
-    for plan in plans:
-        plan['price'] = float(plan['price'])
-        if plan.get('discount_percent'):
-            plan['discount_percent'] = float(plan['discount_percent'])
-        # Преобразуем datetime объекты в строки
-        plan['created_at'] = plan['created_at'].isoformat() if plan['created_at'] else None
-    
-    return jsonify({
-        'success': True,
-        'plans': plans
-    })
+    def build():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT *
+            FROM plans
+            WHERE is_active = TRUE
+            ORDER BY priority, price
+        ''')
+        
+        plans = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        return {
+            'success': True,
+            'plans': [serialize_plan(plan) for plan in plans]
+        }
+
+    return catalog_response('plans', build)
 
 @app.route('/api/plans/<int:plan_id>', methods=['GET'])
 def get_plan(plan_id):
     """
     Получение информации о конкретном тарифном плане
     """
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    cursor.execute('SELECT * FROM plans WHERE id = %s', (plan_id,))
-    
-    plan = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    
-    if not plan:
-        return jsonify({'message': 'Тарифный план не найден!', 'success': False}), 404
-    
-    # Преобразуем Decimal в float для JSON сериализации
-    plan['price'] = float(plan['price'])
-    if plan.get('discount_percent'):
-        plan['discount_percent'] = float(plan['discount_percent'])
-    # Преобразуем datetime объекты в строки
-    plan['created_at'] = plan['created_at'].isoformat() if plan['created_at'] else None
-    
-    return jsonify({
-        'success': True,
-        'plan': plan
-    })
+    def build():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM plans WHERE id = %s', (plan_id,))
+        
+        plan = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        if not plan:
+            return None
+        
+        return {
+            'success': True,
+            'plan': serialize_plan(plan)
+        }
+
+    return catalog_response(f'plans/{plan_id}', build, 'Тарифный план не найден!')
 
 # Покупка тарифного плана
 
@@ -483,6 +619,9 @@ def process_payment(current_user):
             (current_user['id'], data.get('plan_id'), start_date, end_date)
         )
         
+        # Доход пригласившего пользователя
+        cursor.execute(referral_stats.REFERRAL_REVENUE_BY_REFERRER_SQL, (data.get('amount'), current_user['id']))
+        
         conn.commit()
         cursor.close()
         conn.close()
@@ -500,8 +639,108 @@ def process_payment(current_user):
         conn.close()
         return jsonify({'message': f'Ошибка при обработке оплаты: {str(e)}'}), 500
 
+# Вебхуки платежных систем: событие сохраняется в очередь (payment_queue.py),
+# покупку проводят воркеры, ответ платежной системе не ждет MySQL
+
+_webhook_queue = None
+_webhook_workers = None
+_webhook_lock = threading.Lock()
+
+
+def apply_payment_event(event):
+    """
+    Проводит событие вебхука из очереди; вызывается воркерами.
+    Оплата без суммы или с суммой, отличной от цены плана после скидки, не
+    зачисляется: событие сразу уходит в dead для разбора вручную.
+    """
+    if str(event.get('status', '')).lower() not in referral_stats.PAID_STATUSES:
+        return True, {'skipped': event.get('status')}
+    if event.get('amount') is None:
+        return False, {'error': 'Не указана сумма платежа', 'permanent': True}
+    payment_details = {
+        'payment_system': event['payment_system'],
+        'payment_id': event['payment_id'],
+        'status': event['status'],
+        'amount': event['amount'],
+    }
+    # Повтор того же платежа не зачисляется дважды (ключ идемпотентности в payments_service)
+    return payment_service.process_plan_purchase(
+        event['user_id'], event['plan_id'],
+        payment_details=payment_details,
+        promo_code=event.get('promo_code'),
+        source='webhook',
+        verify_amount=True,
+    )
+
+
+def get_webhook_queue():
+    global _webhook_queue
+    if _webhook_queue is None:
+        with _webhook_lock:
+            if _webhook_queue is None:
+                _webhook_queue = payment_queue.WebhookQueue(config.WEBHOOK_QUEUE_PATH, lease=config.WEBHOOK_LEASE)
+    return _webhook_queue
+
+
+def start_webhook_workers():
+    """Запускает воркеры очереди вебхуков (повторный вызов ничего не делает)"""
+    global _webhook_workers
+    if _webhook_workers is None:
+        queue = get_webhook_queue()
+        with _webhook_lock:
+            if _webhook_workers is None:
+                _webhook_workers = payment_queue.WorkerPool(
+                    queue, apply_payment_event,
+                    workers=config.WEBHOOK_WORKERS,
+                    max_attempts=config.WEBHOOK_MAX_ATTEMPTS,
+                    retry_base=config.WEBHOOK_RETRY_BASE,
+                )
+                _webhook_workers.start()
+    return _webhook_workers
+
+
+
+@app.route('/api/payments/webhook/<payment_system>', methods=['POST'])
+def payment_webhook(payment_system):
+    """
+    Уведомление платежной системы об оплате.
+
+    Тело - JSON с payment_id, user_id, plan_id, status, amount (и необязательным
+    promo_code), подпись - HMAC-SHA256 тела с WEBHOOK_SECRET в заголовке
+    X-Webhook-Signature. Ответ 202 означает, что событие сохранено и будет проведено.
+    """
+    body = request.get_data()
+    if not payment_queue.verify_signature(body, request.headers.get('X-Webhook-Signature'), config.WEBHOOK_SECRET):
+        return jsonify({'message': 'Неверная подпись вебхука!'}), 401
+
+    event = request.get_json(silent=True)
+    if not isinstance(event, dict):
+        return jsonify({'message': 'Тело вебхука должно быть JSON-объектом!'}), 400
+    missing = [field for field in ('payment_id', 'user_id', 'plan_id', 'status', 'amount') if event.get(field) in (None, '')]
+    if missing:
+        return jsonify({'message': f"Не указаны поля: {', '.join(missing)}"}), 400
+    event['payment_system'] = payment_system
+
+    # Обычно воркеры запущены при старте сервера (см. __main__ и run_webhook_workers.py)
+    start_webhook_workers()
+    queue = get_webhook_queue()
+    # Очередь переполнена - платежная система повторит уведомление позже
+    if queue.backlog() >= config.WEBHOOK_QUEUE_MAX:
+        response = jsonify({'message': 'Очередь платежей переполнена, повторите позже'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    event_key = f"{payment_system}:{event['payment_id']}:{str(event['status']).lower()}"
+    created = queue.enqueue(event_key, event)
+    return jsonify({'accepted': True, 'duplicate': not created}), 202
+
 # Промокоды
 
+promo_index = promo_engine.PromoIndex(
+    promo_engine.sql_loader(get_db_connection, lambda conn: conn.cursor()),
+    refresh_interval=config.PROMO_INDEX_REFRESH,
+)
+
 @app.route('/api/promo/validate', methods=['POST'])
 @token_required
 def validate_promo(current_user):
@@ -520,95 +759,28 @@ def validate_promo(current_user):
     promo_code = data.get('promo_code')
     plan_id = data.get('plan_id')
     
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
-    # Проверяем существование и активность промокода
-    cursor.execute('''
-        SELECT * FROM promo_codes 
-        WHERE code = %s 
-        AND is_active = TRUE 
-        AND (valid_to IS NULL OR valid_to > NOW())
-        AND (max_usages = 0 OR usages_count < max_usages)
-    ''', (promo_code,))
-    
-    promo = cursor.fetchone()
+    # Проверка по индексу промокодов в памяти, без запросов к БД
+    result = promo_index.check(promo_code, plan_id, current_user['id'])
     
-    if not promo:
-        cursor.close()
-        conn.close()
+    # Истекший или исчерпанный промокод этот API, как и раньше, считает ненайденным
+    if result.promo is None or result.error in (promo_engine.EXPIRED, promo_engine.EXHAUSTED):
         return jsonify({
             'success': False,
-            'message': 'Промокод не найден или недействителен'
+            'message': promo_engine.NOT_FOUND
         }), 404
     
-    # Если указан план, проверяем применимость промокода к этому плану
-    if plan_id and promo.get('allowed_plans'):
-        allowed_plans = promo['allowed_plans'].split(',')
-        if str(plan_id) not in allowed_plans:
-            cursor.close()
-            conn.close()
-            return jsonify({
-                'success': False,
-                'message': 'Промокод не может быть применен к выбранному тарифному плану'
-            }), 400
-    
-    # Проверяем, использовал ли пользователь этот промокод ранее
-    cursor.execute('''
-        SELECT COUNT(*) as count FROM promo_code_usages 
-        WHERE promo_code_id = %s AND user_id = %s
-    ''', (promo['id'], current_user['id']))
-    
-    usage_count = cursor.fetchone()['count']
-    
-    if usage_count > 0:
-        cursor.close()
-        conn.close()
+    if not result.ok:
         return jsonify({
             'success': False,
-            'message': 'Вы уже использовали этот промокод'
+            'message': result.error
         }), 400
     
-    # Если указан план, рассчитываем скидку
-    discount_amount = 0
-    price_after_discount = None
-    
-    if plan_id:
-        cursor.execute('SELECT price FROM plans WHERE id = %s', (plan_id,))
-        plan = cursor.fetchone()
-        
-        if plan:
-            price = float(plan['price'])
-            
-            if promo['discount_type'] == 'percent':
-                discount_amount = price * (float(promo['discount_value']) / 100)
-            elif promo['discount_type'] == 'fixed':
-                discount_amount = float(promo['discount_value'])
-                if discount_amount > price:
-                    discount_amount = price
-            
-            price_after_discount = price - discount_amount
-            if price_after_discount < 0:
-                price_after_discount = 0
-    
-    cursor.close()
-    conn.close()
-    
-    # Преобразуем Decimal в float для JSON сериализации
-    promo_data = {
-        'id': promo['id'],
-        'code': promo['code'],
-        'discount_type': promo['discount_type'],
-        'discount_value': float(promo['discount_value']),
-        'bonus_requests': promo['bonus_requests']
-    }
-    
     return jsonify({
         'success': True,
-        'promo': promo_data,
-        'discount_amount': discount_amount if plan_id else None,
-        'price_after_discount': price_after_discount if plan_id else None,
-        'bonus_requests': promo['bonus_requests']
+        'promo': result.promo.as_dict(),
+        'discount_amount': result.discount_amount if plan_id else None,
+        'price_after_discount': result.price_after_discount if plan_id else None,
+        'bonus_requests': result.promo.bonus_requests
     })
 
 # Реферальная система
@@ -616,49 +788,82 @@ def validate_promo(current_user):
 @app.route('/api/referrals', methods=['GET'])
 @token_required
 def get_referrals(current_user):
-    """Получение списка приглашенных пользователей"""
+    """
+    Получение списка приглашенных пользователей постранично
+    
+    GET-параметры:
+    - limit: размер страницы (по умолчанию 50, не больше 200)
+    - before: курсор next_before из предыдущего ответа
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 200))
+    except ValueError:
+        limit = 50
+    before = request.args.get('before')
+    
+    conditions = "referrer_id = %s"
+    params = [current_user['id']]
+    if before:
+        try:
+            moment, last_id = decode_cursor(before)
+        except ValueError:
+            return jsonify({'message': 'Некорректный курсор', 'success': False}), 400
+        # Курсорная пагинация по (created_at, id) вместо OFFSET
+        conditions += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params.extend([moment, moment, last_id])
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute(
-        """
+        f"""
         SELECT id, username, created_at
         FROM users 
-        WHERE referrer_id = %s
-        ORDER BY created_at DESC
+        WHERE {conditions}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
         """,
-        (current_user['id'],)
+        (*params, limit + 1)
     )
     
     referrals = cursor.fetchall()
     
-    # Подсчет оплат от приглашенных пользователей
+    # Количество и доход поддерживаются счетчиками при регистрации и оплате
     cursor.execute(
-        """
-        SELECT SUM(p.amount) as total_amount
-        FROM payments p
-        JOIN users u ON p.user_id = u.id
-        WHERE u.referrer_id = %s
-        """,
+        "SELECT total_referrals, total_referral_revenue FROM user_statistics WHERE user_id = %s",
         (current_user['id'],)
     )
     
-    total = cursor.fetchone()
+    stats = cursor.fetchone() or {}
     
     cursor.close()
     conn.close()
     
+    has_more = len(referrals) > limit
+    referrals = referrals[:limit]
+    next_before = None
+    if has_more:
+        last = referrals[-1]
+        next_before = encode_cursor(last['created_at'], last['id'])
+    
     # Преобразование datetime в строки для JSON
     for ref in referrals:
         ref['created_at'] = ref['created_at'].isoformat() if ref['created_at'] else None
     
     return jsonify({
         'referrals': referrals,
-        'total_count': len(referrals),
-        'total_earnings': total['total_amount'] if total['total_amount'] else 0
+        'has_more': has_more,
+        'next_before': next_before,
+        'total_count': stats.get('total_referrals') or 0,
+        'total_earnings': float(stats.get('total_referral_revenue') or 0)
     })
 
 # Запуск сервера
 if __name__ == '__main__':
     port = int(os.getenv('API_PORT', 5000))
+    # События, оставшиеся в очереди после перезапуска, проводятся сразу, а не с первым
+    # вебхуком. Родительский процесс перезагрузчика запросы не обслуживает -
+    # воркеры запускаются только в дочернем
+    if config.WEBHOOK_WORKERS_AUTOSTART and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_webhook_workers()
     app.run(debug=True, host='0.0.0.0', port=port) 
\ No newline at end of file
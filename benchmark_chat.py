@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест чата: отправляет сообщения через POST /api/chats/<id>/messages/create/
+с заданной параллельностью и печатает пропускную способность, время до первого байта,
+p50/p95/p99 задержки, число запросов к БД на один ход и загрузку очередей к ИИ.
+
+Чтобы не тратить реальные токены, поднимите тестовый сервер провайдеров
+и направьте на него API (см. api/llm/fake_server.py):
+
+    python -m api.llm.fake_server --port 8765 --latency 0.5 --tokens-per-second 60
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 DB_QUERY_COUNT_HEADER=True python manage.py runserver
+
+    python benchmark_chat.py --users 1000-1019 --concurrency 20 --requests 500 --admin-token <token>
+
+Пользователи с указанными telegram_id должны существовать и иметь запас запросов.
+Потокового варианта эндпоинта в API нет, поэтому время до первого байта
+измеряется до получения заголовков ответа.
+"""
+import argparse
+import math
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+
+
+def parse_users(value):
+    """'1000-1019' или '1,2,3' -> список telegram_id"""
+    users = []
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            users.extend(range(int(start), int(end) + 1))
+        elif part:
+            users.append(int(part))
+    return users
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Stats:
+    """Результаты всех потоков"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.ttfb = []
+        self.db_queries = []
+        self.db_time = []
+        self.statuses = Counter()
+        self.cached = 0
+        self.metrics = []
+
+    def add(self, status, latency, ttfb, queries=None, db_time=None, cached=False):
+        with self.lock:
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append(latency)
+                self.ttfb.append(ttfb)
+                self.cached += int(cached)
+            if queries is not None:
+                self.db_queries.append(queries)
+            if db_time is not None:
+                self.db_time.append(db_time)
+
+
+class Worker(threading.Thread):
+    """Один пользователь: ведет свой чат, каждые new_chat_every сообщений начинает новый"""
+
+    def __init__(self, args, telegram_id, stats, tickets, deadline):
+        super().__init__(daemon=True)
+        self.args = args
+        self.telegram_id = telegram_id
+        self.stats = stats
+        self.tickets = tickets
+        self.deadline = deadline
+        self.session = requests.Session()
+        self.chat_id = 0
+        self.sent_in_chat = 0
+
+    def next_ticket(self):
+        if self.deadline and time.monotonic() >= self.deadline:
+            return False
+        if self.tickets is None:
+            return True
+        with self.tickets['lock']:
+            if self.tickets['left'] <= 0:
+                return False
+            self.tickets['left'] -= 1
+            return True
+
+    def run(self):
+        while self.next_ticket():
+            if self.args.new_chat_every and self.sent_in_chat >= self.args.new_chat_every:
+                self.chat_id = 0
+                self.sent_in_chat = 0
+            self.send()
+
+    def send(self):
+        url = f"{self.args.base_url}/api/chats/{self.chat_id}/messages/create/"
+        body = {'content': f'{self.args.message} #{self.sent_in_chat}', 'ai_model': self.args.model}
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                url, json=body, headers={'X-Telegram-ID': str(self.telegram_id)},
+                timeout=self.args.timeout, stream=True,
+            )
+            ttfb = time.monotonic() - started
+            content = response.content
+            latency = time.monotonic() - started
+        except requests.RequestException:
+            self.stats.add('connection_error', 0.0, 0.0)
+            return
+
+        queries = response.headers.get('X-DB-Queries')
+        db_time = response.headers.get('X-DB-Time')
+        cached = False
+        if response.status_code == 200 and content:
+            data = response.json()
+            self.chat_id = data.get('chat', {}).get('id', self.chat_id)
+            self.sent_in_chat += 1
+            cached = data.get('cached', False)
+        self.stats.add(
+            response.status_code, latency, ttfb,
+            int(queries) if queries else None,
+            float(db_time) if db_time else None,
+            cached,
+        )
+
+
+class MetricsSampler(threading.Thread):
+    """Периодически снимает /api/metrics/ (очередь допуска, лимиты провайдеров)"""
+
+    def __init__(self, args, stats, stop_event):
+        super().__init__(daemon=True)
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+
+    def run(self):
+        session = requests.Session()
+        headers = {'Authorization': f'Token {self.args.admin_token}'}
+        while not self.stop_event.wait(self.args.metrics_interval):
+            try:
+                response = session.get(f"{self.args.base_url}/api/metrics/", headers=headers, timeout=5)
+                if response.status_code == 200:
+                    self.stats.metrics.append(response.json())
+            except requests.RequestException:
+                pass
+
+
+def report(args, stats, elapsed):
+    total = sum(stats.statuses.values())
+    ok = stats.statuses.get(200, 0)
+    print()
+    print(f"Запросов: {total}, успешных: {ok}, за {elapsed:.1f} с, параллельность {args.concurrency}")
+    print(f"Пропускная способность: {ok / elapsed:.2f} ответов/с ({total / elapsed:.2f} запросов/с)")
+    print("Статусы: " + ', '.join(f"{code}: {count}" for code, count in sorted(stats.statuses.items(), key=str)))
+    if stats.cached:
+        print(f"Ответов из кэша: {stats.cached}")
+
+    if stats.latencies:
+        print(
+            "Задержка, мс: "
+            f"p50 {percentile(stats.latencies, 50) * 1000:.0f}, "
+            f"p95 {percentile(stats.latencies, 95) * 1000:.0f}, "
+            f"p99 {percentile(stats.latencies, 99) * 1000:.0f}, "
+            f"max {max(stats.latencies) * 1000:.0f}"
+        )
+        print(
+            "До первого байта, мс: "
+            f"p50 {percentile(stats.ttfb, 50) * 1000:.0f}, "
+            f"p95 {percentile(stats.ttfb, 95) * 1000:.0f}"
+        )
+
+    if stats.db_queries:
+        print(
+            f"Запросов к БД на ход: среднее {statistics.mean(stats.db_queries):.1f}, "
+            f"p95 {percentile(stats.db_queries, 95)}, max {max(stats.db_queries)}"
+        )
+        if stats.db_time:
+            print(f"Время в БД на ход, мс: среднее {statistics.mean(stats.db_time):.1f}")
+    else:
+        print("Число запросов к БД неизвестно: включите DB_QUERY_COUNT_HEADER=True на сервере")
+
+    if stats.metrics:
+        admission = [sample.get('admission', {}) for sample in stats.metrics]
+        print(
+            "Очередь к ИИ: в работе max "
+            f"{max(item.get('in_flight', 0) for item in admission)} из {admission[-1].get('capacity', '?')}, "
+            f"ожидающих max {max(item.get('waiting', 0) for item in admission)}, "
+            f"отказов {admission[-1].get('rejected', 0)}"
+        )
+        for model, provider in stats.metrics[-1].get('providers', {}).items():
+            limiter = provider.get('limiter', {})
+            print(
+                f"  {model}: лимит {limiter.get('limit')}, вызовов {provider.get('calls')}, "
+                f"ошибок {provider.get('errors')}, средняя задержка {provider.get('avg_latency')} с, "
+                f"размыкатель {provider.get('breaker', {}).get('state')}"
+            )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест чата API')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', default='1', help="telegram_id пользователей: '1000-1019' или '1,2,3'")
+    parser.add_argument('--concurrency', type=int, default=10, help='Одновременных пользователей')
+    parser.add_argument('--requests', type=int, default=100, help='Всего сообщений (0 - ограничить --duration)')
+    parser.add_argument('--duration', type=float, default=0.0, help='Длительность теста, сек')
+    parser.add_argument('--model', default='gpt-4o-mini')
+    parser.add_argument('--message', default='Привет! Расскажи что-нибудь интересное')
+    parser.add_argument('--new-chat-every', type=int, default=10, help='Сообщений в одном чате')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--admin-token', help='DRF-токен администратора для снятия /api/metrics/')
+    parser.add_argument('--metrics-interval', type=float, default=1.0)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.base_url = args.base_url.rstrip('/')
+    users = parse_users(args.users)
+    if not users:
+        print("Не указаны пользователи (--users)")
+        sys.exit(1)
+    if not args.requests and not args.duration:
+        print("Укажите --requests или --duration")
+        sys.exit(1)
+
+    stats = Stats()
+    tickets = {'left': args.requests, 'lock': threading.Lock()} if args.requests else None
+    started = time.monotonic()
+    deadline = started + args.duration if args.duration else None
+    workers = [
+        Worker(args, users[index % len(users)], stats, tickets, deadline)
+        for index in range(args.concurrency)
+    ]
+
+    stop_event = threading.Event()
+    sampler = MetricsSampler(args, stats, stop_event) if args.admin_token else None
+    if sampler:
+        sampler.start()
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("Прервано, печатаю промежуточные результаты")
+    stop_event.set()
+
+    report(args, stats, time.monotonic() - started)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,15 @@ from django.http import HttpResponseRedirect
 from django.urls import reverse, path
 from django.contrib import messages
 from django.db.models import Count, Sum, Q
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 
+import ranking
+
+from . import leaderboard, purge, search
 from .models import (
     BotUser, ReferralCode, Plan, UserPlan, Payment, RequestUsage, UserStatistics,
-    ReferralHistory, PromoCode, Chat, ChatMessage
+    ReferralHistory, ReferralLeaderboardEntry, PromoCode, Chat, ChatMessage, ArchivedChatMessage, PurgeJob
 )
 
 
@@ -146,45 +150,14 @@ class BotUserAdmin(RussianColumnNameAdmin):
     
     @admin.action(description='Удалить пользователя вместе со всеми данными')
     def delete_user_with_data(self, request, queryset):
-        """Метод для удаления пользователя вместе со всеми его данными"""
-        from django.db import transaction
-        total_deleted = 0
-        
-        try:
-            with transaction.atomic():
-                for user in queryset:
-                    # Сначала удаляем все связанные сообщения чатов
-                    ChatMessage.objects.filter(chat__user=user).delete()
-                    
-                    # Затем удаляем сами чаты
-                    Chat.objects.filter(user=user).delete()
-                    
-                    # Удаляем остальные связанные объекты
-                    UserPlan.objects.filter(user=user).delete()
-                    Payment.objects.filter(user=user).delete()
-                    RequestUsage.objects.filter(user=user).delete()
-                    UserStatistics.objects.filter(user=user).delete()
-                    ReferralHistory.objects.filter(referrer=user).delete()
-                    ReferralHistory.objects.filter(referred=user).delete()
-                    
-                    # Удаляем реферальные ссылки
-                    ReferralCode.objects.filter(user=user).delete()
-                    
-                    # Наконец удаляем самого пользователя
-                    user.delete()
-                    total_deleted += 1
-                
-                self.message_user(
-                    request,
-                    f'Успешно удалено пользователей: {total_deleted}',
-                    messages.SUCCESS
-                )
-        except Exception as e:
-            self.message_user(
-                request,
-                f'Ошибка при удалении пользователей: {str(e)}',
-                messages.ERROR
-            )
+        """Отключает пользователей сразу, а их данные удаляет в фоне пачками (см. purge.py)"""
+        jobs = [purge.schedule_user_purge(user) for user in queryset]
+        self.message_user(
+            request,
+            f'Поставлено в очередь на удаление пользователей: {len(jobs)}. '
+            f'Ход выполнения - в разделе «Задачи удаления».',
+            messages.SUCCESS
+        )
 
 @admin.register(Plan)
 class PlanAdmin(RussianColumnNameAdmin):
@@ -272,7 +245,7 @@ class RequestUsageAdmin(RussianColumnNameAdmin):
 
 @admin.register(UserStatistics)
 class UserStatisticsAdmin(RussianColumnNameAdmin):
-    list_display = ('user', 'total_requests', 'total_tokens', 'last_active', 'total_payments', 'total_referrals', 'account_level')
+    list_display = ('user', 'total_requests', 'total_tokens', 'last_active', 'total_payments', 'total_referrals', 'total_referral_revenue', 'account_level')
     search_fields = ('user__username', 'user__telegram_id')
     list_filter = ('account_level', 'last_active')
     readonly_fields = ('total_requests', 'total_tokens', 'last_active')
@@ -287,6 +260,7 @@ class UserStatisticsAdmin(RussianColumnNameAdmin):
             'last_active': 'Последняя активность',
             'total_payments': 'Всего платежей',
             'total_referrals': 'Всего рефералов',
+            'total_referral_revenue': 'Доход от рефералов',
             'account_level': 'Уровень аккаунта'
         }
 
@@ -363,14 +337,42 @@ class ChatMessageInline(admin.TabularInline):
         return False # Запретить добавление сообщений из чата
 
 
+class ArchivedChatMessageInline(admin.TabularInline):
+    """Сообщения чата, перенесенные в архив; текст распаковывается при показе"""
+    model = ArchivedChatMessage
+    fields = ('role', 'content', 'model_used', 'tokens_used', 'timestamp')
+    readonly_fields = ('role', 'content', 'model_used', 'tokens_used', 'timestamp')
+    extra = 0
+    can_delete = False
+    ordering = ('timestamp',)
+    verbose_name_plural = 'Сообщения чата (архив)'
+
+    @admin.display(description='Содержание')
+    def content(self, obj):
+        return obj.content
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Chat)
 class ChatAdmin(RussianColumnNameAdmin):
-    list_display = ('id', 'user', 'title', 'created_at', 'updated_at')
-    search_fields = ('title', 'user__username', 'user__telegram_id')
+    list_display = ('id', 'user', 'title', 'message_count', 'total_tokens', 'last_message_at', 'created_at', 'updated_at')
+    search_fields = ('user__username', 'user__telegram_id')  # Название ищется по FULLTEXT-индексу
     list_filter = ('created_at', 'updated_at')
-    readonly_fields = ('user', 'created_at', 'updated_at')
+    readonly_fields = (
+        'user', 'created_at', 'updated_at',
+        'last_message_at', 'last_message_preview', 'message_count', 'total_tokens', 'archived_at'
+    )
     ordering = ('-updated_at',)
-    inlines = [ChatMessageInline] # Отображаем сообщения внутри чата
+    inlines = [ChatMessageInline, ArchivedChatMessageInline] # Отображаем сообщения внутри чата
+
+    def get_search_results(self, request, queryset, search_term):
+        """Название чата ищется по FULLTEXT-индексу вместо LIKE '%...%'"""
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= queryset.filter(search.chat_title_match_q(search_term))
+        return results, may_have_duplicates
     
     def get_column_names(self):
         """Русские названия столбцов для отображения"""
@@ -378,6 +380,9 @@ class ChatAdmin(RussianColumnNameAdmin):
             'id': 'ID Чата',
             'user': 'Пользователь',
             'title': 'Название чата',
+            'message_count': 'Сообщений',
+            'total_tokens': 'Токенов',
+            'last_message_at': 'Последнее сообщение',
             'created_at': 'Создан',
             'updated_at': 'Обновлен'
         }
@@ -389,10 +394,19 @@ class ChatAdmin(RussianColumnNameAdmin):
 @admin.register(ChatMessage)
 class ChatMessageAdmin(RussianColumnNameAdmin):
     list_display = ('id', 'chat_link', 'role', 'short_content', 'model_used', 'tokens_used', 'timestamp')
-    search_fields = ('content', 'chat__user__username', 'chat__user__telegram_id', 'chat__title')
+    search_fields = ('chat__user__username', 'chat__user__telegram_id')  # Текст и название чата - по FULLTEXT-индексу
     list_filter = ('role', 'model_used', 'timestamp')
     readonly_fields = ('chat', 'role', 'content', 'model_used', 'tokens_used', 'timestamp')
     ordering = ('-timestamp',)
+
+    def get_search_results(self, request, queryset, search_term):
+        """Текст сообщения и название чата ищутся по FULLTEXT-индексам вместо LIKE '%...%'"""
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= queryset.filter(
+                search.message_match_q(search_term) | search.chat_title_match_q(search_term, prefix='chat__')
+            )
+        return results, may_have_duplicates
     
     def get_column_names(self):
         """Русские названия столбцов для отображения"""
@@ -420,3 +434,68 @@ class ChatMessageAdmin(RussianColumnNameAdmin):
     
     def has_add_permission(self, request):
         return False # Запретить создание сообщений из админки
+
+
+@admin.register(ReferralLeaderboardEntry)
+class ReferralLeaderboardEntryAdmin(RussianColumnNameAdmin):
+    list_display = ('user', 'period', 'period_start', 'referrals', 'rank_display', 'updated_at')
+    list_filter = ('period', 'period_start')
+    search_fields = ('user__username', 'user__telegram_id')
+    readonly_fields = ('user', 'period', 'period_start', 'referrals', 'updated_at')
+    list_select_related = ('user',)
+    ordering = ('-period_start', '-referrals')
+    actions = ['reload_leaderboard']
+
+    def get_column_names(self):
+        """Русские названия столбцов для отображения"""
+        return {
+            'user': 'Пользователь',
+            'period': 'Период',
+            'period_start': 'Начало периода',
+            'referrals': 'Рефералов',
+            'updated_at': 'Обновлено'
+        }
+
+    @admin.display(description='Место')
+    def rank_display(self, obj):
+        """Место в рейтинге текущего периода (из памяти процесса)"""
+        if obj.period_start != ranking.period_start(obj.period, timezone.localdate()):
+            return '—'
+        rank, _ = leaderboard.leaderboard.position(obj.period, obj.user_id)
+        return rank or '—'
+
+    @admin.action(description='Перечитать рейтинг из БД')
+    def reload_leaderboard(self, request, queryset):
+        leaderboard.leaderboard.invalidate()
+        self.message_user(request, 'Рейтинг будет перечитан из БД при следующем обращении', messages.SUCCESS)
+
+
+@admin.register(PurgeJob)
+class PurgeJobAdmin(RussianColumnNameAdmin):
+    list_display = ('id', 'kind', 'target_id', 'status', 'progress_display', 'current_step', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('target_id',)
+    readonly_fields = (
+        'kind', 'target_id', 'status', 'total_rows', 'deleted_rows', 'current_step', 'error',
+        'created_at', 'started_at', 'heartbeat_at', 'finished_at'
+    )
+    ordering = ('-created_at',)
+
+    def get_column_names(self):
+        """Русские названия столбцов для отображения"""
+        return {
+            'id': 'ID',
+            'kind': 'Что удаляется',
+            'target_id': 'ID объекта',
+            'status': 'Статус',
+            'current_step': 'Текущий шаг',
+            'created_at': 'Создана',
+            'finished_at': 'Завершена'
+        }
+
+    @admin.display(description='Выполнено')
+    def progress_display(self, obj):
+        return f'{obj.progress}% ({obj.deleted_rows} из {obj.total_rows})'
+
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BotAdminConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bot_admin'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - подключение обработчиков сигналов
@@ -0,0 +1,165 @@
+"""
+Перенос сообщений давно неактивных чатов в сжатый архив и обратно.
+
+Архивация идет в три шага короткими транзакциями по chunk_size сообщений,
+чтобы не держать долгие блокировки на chat_messages:
+
+1. сообщения копируются в архив, читатели по-прежнему видят рабочую таблицу;
+2. под блокировкой строки чата проверяется, что за время копирования в чате
+   ничего не изменилось, и выставляется archived_at - с этого момента
+   читатели (chat_cache.message_model) идут в полный архив;
+3. скопированные сообщения удаляются из рабочей таблицы.
+
+Новое сообщение (ChatMessage.save) блокирует строку чата и, если чат уже в
+архиве, сначала возвращает его историю (restore_chat), поэтому сообщение не
+остается в рабочей таблице рядом с архивным чатом. Если чат изменился до
+шага 2, архивация отменяется. Сводка чата (message_count, total_tokens,
+последнее сообщение) при переносе не меняется.
+"""
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedChatMessage, Chat, ChatMessage
+
+
+def compress_text(text):
+    return zlib.compress(text.encode('utf-8'), settings.CHAT_ARCHIVE_COMPRESS_LEVEL)
+
+
+def idle_chats(idle_days=None):
+    """Чаты без новых сообщений дольше idle_days, еще не перенесенные в архив"""
+    idle_days = settings.CHAT_ARCHIVE_IDLE_DAYS if idle_days is None else idle_days
+    cutoff = timezone.now() - timedelta(days=idle_days)
+    return Chat.objects.filter(
+        archived_at__isnull=True,
+        last_message_at__lt=cutoff,
+        message_count__gt=0,
+    ).order_by('last_message_at', 'id')
+
+
+def _summary(chat):
+    return chat.message_count, chat.last_message_at
+
+
+def _locked_chat(chat_id):
+    """Строка чата под блокировкой до конца текущей транзакции"""
+    return Chat.objects.select_for_update().filter(pk=chat_id).first()
+
+
+def _delete_chunks(queryset, chunk_size, still_valid=None):
+    """
+    Удаляет строки queryset пачками. still_valid() проверяется под блокировкой
+    чата перед каждой пачкой; False - удаление остановлено.
+    """
+    while True:
+        with transaction.atomic():
+            if still_valid is not None and not still_valid():
+                return False
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                return True
+            queryset.model.objects.filter(pk__in=ids).delete()
+
+
+def archive_chat(chat, chunk_size=None):
+    """Переносит все сообщения чата в архив, возвращает количество перенесенных (0 - в чате новые сообщения)"""
+    chunk_size = chunk_size or settings.CHAT_ARCHIVE_CHUNK_SIZE
+    summary = _summary(chat)
+
+    # 1. Копирование: рабочая таблица не меняется
+    copied = 0
+    last_id = 0
+    while True:
+        batch = list(ChatMessage.objects.filter(chat_id=chat.pk, id__gt=last_id).order_by('id')[:chunk_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            # Строки, оставшиеся от прерванного запуска, не мешают
+            ArchivedChatMessage.objects.bulk_create([
+                ArchivedChatMessage(
+                    id=msg.id,
+                    chat_id=msg.chat_id,
+                    role=msg.role,
+                    content_compressed=compress_text(msg.content),
+                    model_used=msg.model_used,
+                    tokens_used=msg.tokens_used,
+                    timestamp=msg.timestamp,
+                )
+                for msg in batch
+            ], ignore_conflicts=True)
+        copied += len(batch)
+        last_id = batch[-1].id
+
+    # 2. Переключение читателей на архив, если чат не изменился
+    archived_at = timezone.now()
+    with transaction.atomic():
+        locked = _locked_chat(chat.pk)
+        unchanged = (
+            locked is not None and locked.archived_at is None and locked.deleted_at is None
+            and _summary(locked) == summary
+        )
+        if unchanged:
+            Chat.objects.filter(pk=chat.pk).update(archived_at=archived_at)
+    if not unchanged:
+        # Новое или удаленное сообщение: чат остается в рабочей таблице, копия не нужна
+        _delete_chunks(
+            ArchivedChatMessage.objects.filter(chat_id=chat.pk), chunk_size,
+            lambda: (_locked_chat(chat.pk) or chat).archived_at is None,
+        )
+        return 0
+    chat.archived_at = archived_at
+
+    # 3. Удаление из рабочей таблицы; останавливается, если чат уже вернули из архива.
+    # Удаление через QuerySet не вызывает ChatMessage.delete и не пересчитывает сводку
+    finished = _delete_chunks(
+        ChatMessage.objects.filter(chat_id=chat.pk), chunk_size,
+        lambda: (_locked_chat(chat.pk) or chat).archived_at == archived_at,
+    )
+    return copied if finished else 0
+
+
+def restore_chat(chat, chunk_size=None):
+    """
+    Возвращает сообщения чата из архива (перед новым сообщением в чате).
+    Выполняется в одной транзакции под блокировкой строки чата.
+    """
+    chunk_size = chunk_size or settings.CHAT_ARCHIVE_CHUNK_SIZE
+    restored = 0
+    with transaction.atomic():
+        locked = _locked_chat(chat.pk)
+        if locked is None or locked.archived_at is None:
+            # Чат уже вернул параллельный запрос
+            chat.archived_at = None
+            return 0
+        last_id = 0
+        while True:
+            batch = list(
+                ArchivedChatMessage.objects.filter(chat_id=chat.pk, id__gt=last_id).order_by('id')[:chunk_size]
+            )
+            if not batch:
+                break
+            # bulk_create не вызывает ChatMessage.save, поэтому сводка чата не удваивается;
+            # сообщения, которые архивация еще не удалила из рабочей таблицы, пропускаются
+            ChatMessage.objects.bulk_create([
+                ChatMessage(
+                    id=msg.id,
+                    chat_id=msg.chat_id,
+                    role=msg.role,
+                    content=msg.content,
+                    model_used=msg.model_used,
+                    tokens_used=msg.tokens_used,
+                    timestamp=msg.timestamp,
+                )
+                for msg in batch
+            ], ignore_conflicts=True)
+            ArchivedChatMessage.objects.filter(pk__in=[msg.id for msg in batch]).delete()
+            restored += len(batch)
+            last_id = batch[-1].id
+
+        Chat.objects.filter(pk=chat.pk).update(archived_at=None)
+    chat.archived_at = None
+    return restored
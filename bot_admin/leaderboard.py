@@ -0,0 +1,123 @@
+"""
+Таблица лидеров по рефералам за день, неделю и все время.
+
+Счетчики периодов хранятся в ReferralLeaderboardEntry и увеличиваются при
+записи каждого реферала, а рейтинг текущего периода держится в памяти процесса
+(ranking.RankedBoard): первые N и место пользователя находятся без запросов
+к БД. Рейтинг периода загружается из БД при первом обращении, при смене
+периода и раз в LEADERBOARD_REFRESH секунд (чтобы увидеть рефералов,
+записанных ботом в другом процессе); рефералы, записанные в этом процессе,
+учитываются сразу после коммита.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+import ranking
+
+from .models import ReferralLeaderboardEntry
+
+
+def _today(at=None):
+    return timezone.localdate(at) if at is not None else timezone.localdate()
+
+
+def increment(user_id, at=None):
+    """Увеличивает счетчики пользователя за все периоды, в которые попадает момент at"""
+    for period, start in ranking.period_starts(_today(at)):
+        entries = ReferralLeaderboardEntry.objects.filter(user_id=user_id, period=period, period_start=start)
+        if entries.update(referrals=F('referrals') + 1):
+            continue
+        try:
+            with transaction.atomic():
+                ReferralLeaderboardEntry.objects.create(
+                    user_id=user_id, period=period, period_start=start, referrals=1
+                )
+        except IntegrityError:
+            # Строку успел создать параллельный запрос
+            entries.update(referrals=F('referrals') + 1)
+
+
+class ReferralLeaderboard:
+    """Рейтинги текущих периодов в памяти процесса"""
+
+    def __init__(self, refresh_interval=60.0):
+        self.refresh_interval = refresh_interval
+        self._boards = {}  # период -> (дата начала, RankedBoard, время загрузки)
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _load(self, period, start):
+        counts = ReferralLeaderboardEntry.objects.filter(
+            period=period, period_start=start
+        ).values_list('user_id', 'referrals')
+        self.loads += 1
+        return ranking.RankedBoard(counts)
+
+    def _board(self, period):
+        """(дата начала, RankedBoard) текущего периода; загружает его при необходимости"""
+        start = ranking.period_start(period, _today())
+        entry = self._boards.get(period)
+        if entry is not None and entry[0] == start:
+            if time.monotonic() - entry[2] < self.refresh_interval:
+                return start, entry[1]
+            # Устаревший рейтинг обновляет один поток, остальные пока читают прежний
+            if not self._refresh_lock.acquire(blocking=False):
+                return start, entry[1]
+        else:
+            self._refresh_lock.acquire()
+        try:
+            entry = self._boards.get(period)
+            if entry is None or entry[0] != start or time.monotonic() - entry[2] >= self.refresh_interval:
+                board = self._load(period, start)
+                with self._lock:
+                    self._boards[period] = entry = (start, board, time.monotonic())
+            return start, entry[1]
+        finally:
+            self._refresh_lock.release()
+
+    def top(self, period, limit):
+        """(дата начала периода, [(место, user_id, рефералов)])"""
+        start, board = self._board(period)
+        with self._lock:
+            return start, board.top(limit)
+
+    def position(self, period, user_id):
+        """(место или None, рефералов) пользователя в текущем периоде"""
+        _, board = self._board(period)
+        with self._lock:
+            return board.rank(user_id), board.count(user_id)
+
+    def record(self, user_id, at=None):
+        """Учесть реферала в загруженных рейтингах (после коммита счетчиков в БД)"""
+        with self._lock:
+            for period, start in ranking.period_starts(_today(at)):
+                entry = self._boards.get(period)
+                if entry is not None and entry[0] == start:
+                    entry[1].add(user_id)
+
+    def invalidate(self):
+        """Следующее обращение перечитает рейтинги из БД"""
+        with self._lock:
+            self._boards.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'periods': {period: len(entry[1]) for period, entry in self._boards.items()},
+                'loads': self.loads,
+            }
+
+
+leaderboard = ReferralLeaderboard(refresh_interval=getattr(settings, 'LEADERBOARD_REFRESH', 60))
+
+
+def referral_recorded(user_id, at=None):
+    """Новый реферал у пользователя user_id: счетчики в БД и рейтинг в памяти"""
+    increment(user_id, at)
+    transaction.on_commit(lambda: leaderboard.record(user_id, at))
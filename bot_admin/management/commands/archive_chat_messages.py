@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bot_admin import archive
+
+
+class Command(BaseCommand):
+    help = 'Переносит сообщения давно неактивных чатов в сжатый архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=settings.CHAT_ARCHIVE_IDLE_DAYS,
+                            help='Сколько дней без сообщений чат считается неактивным')
+        parser.add_argument('--chunk-size', type=int, default=settings.CHAT_ARCHIVE_CHUNK_SIZE,
+                            help='Сообщений в одной транзакции')
+        parser.add_argument('--limit', type=int, default=None, help='Максимум чатов за запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько чатов попадет в архив')
+
+    def handle(self, *args, **options):
+        chats = archive.idle_chats(options['idle_days'])
+        if options['limit']:
+            chats = chats[:options['limit']]
+
+        if options['dry_run']:
+            self.stdout.write(f"Чатов для архивации: {chats.count()}")
+            return
+
+        total_chats = total_messages = 0
+        for chat in chats.iterator():
+            moved = archive.archive_chat(chat, options['chunk_size'])
+            if moved:  # 0 - в чате появились сообщения, архивация отменена
+                total_messages += moved
+                total_chats += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"В архив перенесено {total_messages} сообщений из {total_chats} чатов"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from bot_admin import purge, referral_tree
+from bot_admin.models import ReferralClosure
+
+
+class Command(BaseCommand):
+    help = 'Строит таблицу замыкания дерева рефералов по истории рефералов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Строк в одной транзакции')
+        parser.add_argument('--max-depth', type=int, default=None,
+                            help='Наибольшая глубина (по умолчанию REFERRAL_CLOSURE_MAX_DEPTH)')
+        parser.add_argument('--rebuild', action='store_true', help='Сначала удалить существующие пары')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            deleted = purge.delete_in_chunks(ReferralClosure, {}, options['chunk_size'])
+            self.stdout.write(f"Удалено пар: {deleted}")
+
+        total = referral_tree.build(options['chunk_size'], options['max_depth'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано пар: {total}, всего в таблице: {ReferralClosure.objects.count()}"
+        ))
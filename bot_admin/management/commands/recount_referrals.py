@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from bot_admin import referrals
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики рефералов (коды и статистика пользователей) по истории'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        codes_fixed, users_fixed = referrals.recount(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Исправлено кодов: {codes_fixed}, статистик пользователей: {users_fixed}"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from bot_admin import purge
+from bot_admin.models import PurgeJob
+
+
+class Command(BaseCommand):
+    help = 'Выполняет ожидающие задачи удаления пользователей и чатов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None, help='Строк в одной транзакции')
+        parser.add_argument('--retry', action='store_true',
+                            help='Повторить задачи с ошибкой и прерванные (без хода дольше PURGE_LEASE)')
+        parser.add_argument('--lease', type=int, default=None,
+                            help='Через сколько секунд без хода задача считается прерванной')
+
+    def handle(self, *args, **options):
+        if options['retry']:
+            retried = purge.requeue_jobs(options['lease'])
+            self.stdout.write(f"Задач поставлено на повтор: {retried}")
+
+        processed = purge.run_pending_jobs(options['chunk_size'])
+        failed = PurgeJob.objects.filter(status='failed').count()
+        self.stdout.write(self.style.SUCCESS(f"Выполнено задач: {processed}, с ошибкой всего: {failed}"))
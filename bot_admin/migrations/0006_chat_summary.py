@@ -0,0 +1,50 @@
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def backfill_chat_summary(apps, schema_editor):
+    Chat = apps.get_model('bot_admin', 'Chat')
+    ChatMessage = apps.get_model('bot_admin', 'ChatMessage')
+
+    stats = ChatMessage.objects.values('chat_id').annotate(
+        count=Count('id'), tokens=Sum('tokens_used'), last_at=Max('timestamp')
+    )
+    for row in stats.iterator():
+        last = ChatMessage.objects.filter(chat_id=row['chat_id']).order_by('-timestamp', '-id').first()
+        Chat.objects.filter(pk=row['chat_id']).update(
+            message_count=row['count'],
+            total_tokens=row['tokens'] or 0,
+            last_message_at=row['last_at'],
+            last_message_preview=last.content[:255] if last else '',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0005_chat_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='total_tokens',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_chat_summary, migrations.RunPython.noop),
+    ]
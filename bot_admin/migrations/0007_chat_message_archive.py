@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0006_chat_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='ArchivedChatMessage',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('role', models.CharField(max_length=10)),
+                ('content_compressed', models.BinaryField()),
+                ('model_used', models.CharField(blank=True, max_length=100, null=True)),
+                ('tokens_used', models.IntegerField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('chat', models.ForeignKey(db_column='chat_id', on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='bot_admin.chat')),
+            ],
+            options={
+                'verbose_name': 'Архивное сообщение чата',
+                'verbose_name_plural': 'Архивные сообщения чата',
+                'db_table': 'chat_messages_archive',
+                'ordering': ['timestamp'],
+                'managed': True,
+                'indexes': [models.Index(fields=['chat', 'timestamp', 'id'], name='chat_msg_archive_chat_ts_idx')],
+            },
+        ),
+    ]
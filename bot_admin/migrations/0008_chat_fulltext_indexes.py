@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# FULLTEXT-индексы есть только в MySQL; на других СУБД поиск работает через icontains
+FULLTEXT_INDEXES = [
+    ('chat_messages', 'chat_messages_content_ft', 'content'),
+    ('chats', 'chats_title_ft', 'title'),
+]
+
+
+def create_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name, column in FULLTEXT_INDEXES:
+        schema_editor.execute(f'ALTER TABLE {table} ADD FULLTEXT INDEX {name} ({column})')
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for table, name, column in FULLTEXT_INDEXES:
+        schema_editor.execute(f'ALTER TABLE {table} DROP INDEX {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0007_chat_message_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_indexes, drop_fulltext_indexes),
+    ]
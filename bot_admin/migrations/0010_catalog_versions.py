@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+def create_plans_version(apps, schema_editor):
+    CatalogVersion = apps.get_model('bot_admin', 'CatalogVersion')
+    CatalogVersion.objects.get_or_create(name='plans', defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0009_purge_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Версия справочника',
+                'verbose_name_plural': 'Версии справочников',
+                'db_table': 'catalog_versions',
+                'managed': True,
+            },
+        ),
+        migrations.RunPython(create_plans_version, migrations.RunPython.noop),
+    ]
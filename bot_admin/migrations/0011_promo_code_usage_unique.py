@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_usages(apps, schema_editor):
+    """Оставляет самое раннее использование промокода каждым пользователем"""
+    PromoCodeUsage = apps.get_model('bot_admin', 'PromoCodeUsage')
+    duplicates = (
+        PromoCodeUsage.objects.values('promo_code_id', 'user_id')
+        .annotate(first_id=Min('id'), total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for row in duplicates:
+        PromoCodeUsage.objects.filter(
+            promo_code_id=row['promo_code_id'], user_id=row['user_id']
+        ).exclude(id=row['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0010_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_usages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='promocodeusage',
+            constraint=models.UniqueConstraint(fields=('promo_code', 'user'), name='promo_code_usages_code_user_uniq'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+
+PAID_STATUSES = ('completed', 'succeeded', 'success', 'paid')
+CHUNK_SIZE = 500
+
+
+def backfill_counters(apps, schema_editor):
+    """Начальные значения счетчиков рефералов по истории и платежам, пачками по пригласившим"""
+    ReferralHistory = apps.get_model('bot_admin', 'ReferralHistory')
+    UserStatistics = apps.get_model('bot_admin', 'UserStatistics')
+
+    # Доход засчитывается только первому пригласившему каждого пользователя
+    first_id = ReferralHistory.objects.filter(referred_id=OuterRef('referred_id')).order_by('id').values('id')[:1]
+    first_referrals = ReferralHistory.objects.filter(id=Subquery(first_id))
+
+    referrer_ids = list(
+        ReferralHistory.objects.order_by('referrer_id').values_list('referrer_id', flat=True).distinct()
+    )
+    for start in range(0, len(referrer_ids), CHUNK_SIZE):
+        chunk = referrer_ids[start:start + CHUNK_SIZE]
+        history = ReferralHistory.objects.filter(referrer_id__in=chunk).values('referrer_id')
+        counts = dict(history.annotate(total=Count('id')).values_list('referrer_id', 'total'))
+        revenue = dict(
+            first_referrals.filter(referrer_id__in=chunk).order_by().values('referrer_id').annotate(
+                total=Sum('referred__payment__amount', filter=Q(referred__payment__status__in=PAID_STATUSES))
+            ).values_list('referrer_id', 'total')
+        )
+        existing = set(UserStatistics.objects.filter(user_id__in=chunk).values_list('user_id', flat=True))
+        UserStatistics.objects.bulk_create(
+            [UserStatistics(user_id=user_id) for user_id in chunk if user_id not in existing]
+        )
+        for user_id in chunk:
+            UserStatistics.objects.filter(user_id=user_id).update(
+                total_referrals=counts.get(user_id, 0),
+                total_referral_revenue=revenue.get(user_id) or 0,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0011_promo_code_usage_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstatistics',
+            name='total_referral_revenue',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='referralhistory',
+            index=models.Index(fields=['referrer', 'created_at', 'id'], name='referral_referrer_created_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+from collections import Counter
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+ALL_TIME_START = date(2000, 1, 1)
+CHUNK_SIZE = 500
+
+
+def backfill_leaderboard(apps, schema_editor):
+    """Счетчики рейтинга за все дни, недели и все время по истории рефералов, пачками по пригласившим"""
+    ReferralHistory = apps.get_model('bot_admin', 'ReferralHistory')
+    ReferralLeaderboardEntry = apps.get_model('bot_admin', 'ReferralLeaderboardEntry')
+
+    referrer_ids = list(
+        ReferralHistory.objects.order_by('referrer_id').values_list('referrer_id', flat=True).distinct()
+    )
+    for start in range(0, len(referrer_ids), CHUNK_SIZE):
+        chunk = referrer_ids[start:start + CHUNK_SIZE]
+        counts = Counter()
+        per_day = (
+            ReferralHistory.objects.filter(referrer_id__in=chunk).order_by()
+            .annotate(day=TruncDate('created_at')).values('referrer_id', 'day').annotate(total=Count('id'))
+        )
+        for row in per_day:
+            user_id, day, total = row['referrer_id'], row['day'], row['total']
+            counts[(user_id, 'day', day)] += total
+            counts[(user_id, 'week', day - timedelta(days=day.weekday()))] += total
+            counts[(user_id, 'all', ALL_TIME_START)] += total
+        ReferralLeaderboardEntry.objects.bulk_create([
+            ReferralLeaderboardEntry(user_id=user_id, period=period, period_start=period_start, referrals=total)
+            for (user_id, period, period_start), total in counts.items()
+        ], batch_size=CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0012_referral_revenue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralLeaderboardEntry',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('period', models.CharField(choices=[('day', 'День'), ('week', 'Неделя'), ('all', 'Все время')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('referrals', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='bot_admin.botuser')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рефералов',
+                'verbose_name_plural': 'Рейтинг рефералов',
+                'db_table': 'referral_leaderboard',
+                'managed': True,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='referralleaderboardentry',
+            constraint=models.UniqueConstraint(fields=('user', 'period', 'period_start'), name='referral_leaderboard_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='referralleaderboardentry',
+            index=models.Index(fields=['period', 'period_start'], name='referral_lb_period_idx'),
+        ),
+        migrations.RunPython(backfill_leaderboard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Заполнение для существующей истории: manage.py build_referral_closure
+
+    dependencies = [
+        ('bot_admin', '0013_referral_leaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralClosure',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(db_column='ancestor_id', on_delete=django.db.models.deletion.CASCADE, related_name='referral_descendants', to='bot_admin.botuser')),
+                ('descendant', models.ForeignKey(db_column='descendant_id', on_delete=django.db.models.deletion.CASCADE, related_name='referral_ancestors', to='bot_admin.botuser')),
+            ],
+            options={
+                'verbose_name': 'Связь в дереве рефералов',
+                'verbose_name_plural': 'Дерево рефералов',
+                'db_table': 'referral_closure',
+                'managed': True,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='referralclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='referral_closure_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='referralclosure',
+            index=models.Index(fields=['ancestor', 'depth', 'descendant'], name='referral_closure_depth_idx'),
+        ),
+    ]
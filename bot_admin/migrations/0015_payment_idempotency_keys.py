@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot_admin', '0014_referral_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('payment_system', models.CharField(max_length=50)),
+                ('payment_id', models.CharField(max_length=255)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(db_column='user_id', on_delete=django.db.models.deletion.CASCADE, to='bot_admin.botuser')),
+                ('user_plan', models.ForeignKey(blank=True, db_column='user_plan_id', null=True, on_delete=django.db.models.deletion.SET_NULL, to='bot_admin.userplan')),
+            ],
+            options={
+                'verbose_name': 'Ключ идемпотентности платежа',
+                'verbose_name_plural': 'Ключи идемпотентности платежей',
+                'db_table': 'payment_idempotency_keys',
+                'managed': True,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='paymentidempotencykey',
+            constraint=models.UniqueConstraint(fields=('payment_system', 'payment_id'), name='payment_idempotency_uniq'),
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+import zlib
+
+from django.db import models, transaction
+from django.db.models import F, Sum
 from django.utils import timezone
 
 # Create your models here.
@@ -106,19 +109,15 @@ class ReferralHistory(models.Model):
         verbose_name = 'История реферралов'
         verbose_name_plural = 'История реферралов'
         ordering = ['-created_at']
+        indexes = [
+            # Курсорная пагинация рефералов пользователя (см. ReferralsView)
+            models.Index(fields=['referrer', 'created_at', 'id'], name='referral_referrer_created_idx'),
+        ]
 
     def __str__(self):
         referred_str = f" → {self.referred}" if self.referred else ""
         return f"{self.referrer}{referred_str} ({self.created_at})"
 
-    def save(self, *args, **kwargs):
-        # Увеличиваем счетчик использований реферального кода
-        if self.referral_code:
-            self.referral_code.total_uses += 1
-            self.referral_code.last_used_at = self.created_at
-            self.referral_code.save()
-        super().save(*args, **kwargs)
-
 class Plan(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255)
@@ -190,6 +189,34 @@ class Payment(models.Model):
     def __str__(self):
         return f"{self.user} - {self.amount} {self.currency} ({self.status})"
 
+class PaymentIdempotencyKey(models.Model):
+    """
+    Ключ идемпотентности покупки: внешний платеж (payment_system, payment_id)
+    зачисляется один раз, повтор получает сохраненный результат
+    (см. PaymentService.process_plan_purchase).
+    """
+    id = models.BigAutoField(primary_key=True)
+    payment_system = models.CharField(max_length=50)
+    payment_id = models.CharField(max_length=255)
+    user = models.ForeignKey(BotUser, on_delete=models.CASCADE, db_column='user_id')
+    user_plan = models.ForeignKey(UserPlan, on_delete=models.SET_NULL, null=True, blank=True, db_column='user_plan_id')
+    result = models.JSONField(null=True, blank=True)  # Ответ первой успешной обработки
+    attempts = models.IntegerField(default=1)  # Сколько раз платеж присылали
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = 'payment_idempotency_keys'
+        verbose_name = 'Ключ идемпотентности платежа'
+        verbose_name_plural = 'Ключи идемпотентности платежей'
+        constraints = [
+            models.UniqueConstraint(fields=['payment_system', 'payment_id'], name='payment_idempotency_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_system}:{self.payment_id} ({self.attempts})"
+
 class RequestUsage(models.Model):
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(BotUser, on_delete=models.CASCADE, db_column='user_id')
@@ -220,6 +247,7 @@ class UserStatistics(models.Model):
     last_active = models.DateTimeField(null=True, blank=True)  # Последняя активность
     total_payments = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Сумма всех платежей
     total_referrals = models.IntegerField(default=0)  # Количество приглашенных пользователей
+    total_referral_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # Сумма платежей приглашенных
     favorite_model = models.CharField(max_length=100, null=True, blank=True)  # Предпочитаемая модель ИИ
     account_level = models.CharField(max_length=50, default='standard')  # Уровень аккаунта
 
@@ -272,6 +300,10 @@ class PromoCodeUsage(models.Model):
         verbose_name = 'Использование промокода'
         verbose_name_plural = 'Использования промокодов'
         ordering = ['-used_at']
+        constraints = [
+            # Один пользователь - одно использование промокода (на этом ключе держится погашение)
+            models.UniqueConstraint(fields=['promo_code', 'user'], name='promo_code_usages_code_user_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.user} использовал {self.promo_code} ({self.used_at})"
@@ -297,17 +329,48 @@ class Chat(models.Model):
     ai_model = models.CharField(max_length=50, choices=AI_MODEL_CHOICES, default='gpt-4o-mini')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Сводка по сообщениям, обновляется вместе с каждым новым сообщением (см. ChatMessage.save)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    message_count = models.IntegerField(default=0)
+    total_tokens = models.IntegerField(default=0)
+    # Когда сообщения чата перенесены в архив (см. bot_admin/archive.py)
+    archived_at = models.DateTimeField(null=True, blank=True)
+    # Чат удален пользователем и ждет фоновой очистки (см. bot_admin/purge.py)
+    deleted_at = models.DateTimeField(null=True, blank=True)
     
+    PREVIEW_LENGTH = 255
+
     class Meta:
         managed = True # Или True, если хотите, чтобы Django создал таблицу
         db_table = 'chats'
         verbose_name = 'Чат'
         verbose_name_plural = 'Чаты'
         ordering = ['-updated_at']
+        indexes = [
+            # Курсорная пагинация списка чатов пользователя
+            models.Index(fields=['user', 'updated_at', 'id'], name='chats_user_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.user.username}) - {self.get_ai_model_display()}"
 
+    def refresh_summary(self):
+        """Пересчитывает сводку по сообщениям чата (после удаления сообщений)"""
+        with transaction.atomic():
+            messages = ChatMessage.objects.filter(chat_id=self.pk)
+            last = messages.order_by('-timestamp', '-id').first()
+            self.message_count = messages.count()
+            self.total_tokens = messages.aggregate(total=Sum('tokens_used'))['total'] or 0
+            self.last_message_at = last.timestamp if last else None
+            self.last_message_preview = last.content[:self.PREVIEW_LENGTH] if last else ''
+            Chat.objects.filter(pk=self.pk).update(
+                message_count=self.message_count,
+                total_tokens=self.total_tokens,
+                last_message_at=self.last_message_at,
+                last_message_preview=self.last_message_preview,
+            )
+
 class ChatMessage(models.Model):
     id = models.AutoField(primary_key=True)
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, db_column='chat_id')
@@ -315,7 +378,8 @@ class ChatMessage(models.Model):
     content = models.TextField()
     model_used = models.CharField(max_length=100, null=True, blank=True)
     tokens_used = models.IntegerField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # default вместо auto_now_add: при возврате из архива сохраняется исходное время
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         managed = True # Или True
@@ -323,6 +387,73 @@ class ChatMessage(models.Model):
         verbose_name = 'Сообщение чата'
         verbose_name_plural = 'Сообщения чата'
         ordering = ['timestamp']
+        indexes = [
+            # Курсорная пагинация истории чата
+            models.Index(fields=['chat', 'timestamp', 'id'], name='chat_messages_chat_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}..."
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # Новое сообщение и сводка чата сохраняются в одной транзакции
+        with transaction.atomic():
+            # Блокировка строки чата: архивация не переключит чат в архив, пока
+            # сообщение не записано, а уже архивный чат сначала возвращается
+            archived_at = Chat.objects.select_for_update().filter(pk=self.chat_id).values_list(
+                'archived_at', flat=True
+            ).first()
+            if archived_at is not None:
+                from .archive import restore_chat
+                restore_chat(self.chat)
+            super().save(*args, **kwargs)
+            preview = self.content[:Chat.PREVIEW_LENGTH]
+            tokens = self.tokens_used or 0
+            Chat.objects.filter(pk=self.chat_id).update(
+                message_count=F('message_count') + 1,
+                total_tokens=F('total_tokens') + tokens,
+                last_message_at=self.timestamp,
+                last_message_preview=preview,
+                updated_at=self.timestamp,
+            )
+        if ChatMessage.chat.is_cached(self):
+            chat = self.chat
+            chat.message_count += 1
+            chat.total_tokens += tokens
+            chat.last_message_at = chat.updated_at = self.timestamp
+            chat.last_message_preview = preview
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.chat.refresh_summary()
+        return result
+
+class ArchivedChatMessage(models.Model):
+    """Сообщение давно неактивного чата, текст хранится сжатым zlib"""
+    id = models.IntegerField(primary_key=True)  # id исходного сообщения
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, db_column='chat_id', related_name='archived_messages')
+    role = models.CharField(max_length=10)
+    content_compressed = models.BinaryField()
+    model_used = models.CharField(max_length=100, null=True, blank=True)
+    tokens_used = models.IntegerField(null=True, blank=True)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = 'chat_messages_archive'
+        verbose_name = 'Архивное сообщение чата'
+        verbose_name_plural = 'Архивные сообщения чата'
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['chat', 'timestamp', 'id'], name='chat_msg_archive_chat_ts_idx'),
+        ]
+
+    @property
+    def content(self):
+        """Текст сообщения, распаковывается при обращении"""
+        return zlib.decompress(bytes(self.content_compressed)).decode('utf-8')
 
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
@@ -342,3 +473,147 @@ class Request(models.Model):
 
     def __str__(self):
         return f"{self.user}: {self.query[:50]}..."
+
+
+class PurgeJob(models.Model):
+    """Фоновое удаление пользователя или чата со всеми связанными данными"""
+    KIND_CHOICES = [
+        ('user', 'Пользователь'),
+        ('chat', 'Чат'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('running', 'Выполняется'),
+        ('done', 'Завершено'),
+        ('failed', 'Ошибка'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    target_id = models.IntegerField()  # BotUser.user_id или Chat.id
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    total_rows = models.IntegerField(default=0)
+    deleted_rows = models.IntegerField(default=0)
+    current_step = models.CharField(max_length=100, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Обновляется выполняющим процессом после каждой пачки (см. purge.PURGE_LEASE)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = 'purge_jobs'
+        verbose_name = 'Задача удаления'
+        verbose_name_plural = 'Задачи удаления'
+        ordering = ['-created_at']
+
+    @property
+    def progress(self):
+        """Процент удаленных строк"""
+        if self.status == 'done':
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, int(self.deleted_rows * 100 / self.total_rows))
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.target_id} ({self.get_status_display()})"
+
+
+class CatalogVersion(models.Model):
+    """
+    Версия справочника (например, тарифов). Увеличивается при каждом изменении,
+    по ней процессы API сбрасывают кэшированные ответы (см. catalog_cache.py).
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'catalog_versions'
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    @classmethod
+    def current(cls, name):
+        """Текущая версия справочника (0, если он еще не менялся)"""
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """Атомарно увеличивает версию справочника"""
+        updated = cls.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(name=name, defaults={'version': 2})
+
+    def __str__(self):
+        return f"{self.name}: v{self.version}"
+
+
+class ReferralLeaderboardEntry(models.Model):
+    """
+    Число рефералов пользователя за период (день, неделя, все время).
+    Увеличивается при записи каждого реферала (bot_admin/referrals.py,
+    database_bot.record_referral); по этим строкам строится рейтинг в памяти
+    (bot_admin/leaderboard.py).
+    """
+    PERIOD_CHOICES = (
+        ('day', 'День'),
+        ('week', 'Неделя'),
+        ('all', 'Все время'),
+    )
+
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(BotUser, on_delete=models.CASCADE, db_column='user_id', related_name='leaderboard_entries')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    referrals = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = 'referral_leaderboard'
+        verbose_name = 'Рейтинг рефералов'
+        verbose_name_plural = 'Рейтинг рефералов'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period', 'period_start'], name='referral_leaderboard_uniq'),
+        ]
+        indexes = [
+            # Загрузка рейтинга периода (см. bot_admin/leaderboard.py)
+            models.Index(fields=['period', 'period_start'], name='referral_lb_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.get_period_display()} с {self.period_start}: {self.referrals}"
+
+
+class ReferralClosure(models.Model):
+    """
+    Замыкание дерева рефералов: строка на каждую пару (предок, потомок) с
+    глубиной (1 - прямой реферал). Пополняется при записи реферала
+    (bot_admin/referral_tree.py, database_bot.record_referral), поэтому
+    вопросы о нижних уровнях решаются выборкой по индексу без рекурсии.
+    """
+    id = models.BigAutoField(primary_key=True)
+    ancestor = models.ForeignKey(BotUser, on_delete=models.CASCADE, db_column='ancestor_id', related_name='referral_descendants')
+    descendant = models.ForeignKey(BotUser, on_delete=models.CASCADE, db_column='descendant_id', related_name='referral_ancestors')
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        managed = True
+        db_table = 'referral_closure'
+        verbose_name = 'Связь в дереве рефералов'
+        verbose_name_plural = 'Дерево рефералов'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='referral_closure_uniq'),
+        ]
+        indexes = [
+            # Счетчики и доход нижних уровней по глубине (см. ReferralDownlineView)
+            models.Index(fields=['ancestor', 'depth', 'descendant'], name='referral_closure_depth_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor} → {self.descendant} (уровень {self.depth})"
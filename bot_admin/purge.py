@@ -0,0 +1,204 @@
+"""
+Фоновое удаление пользователей и чатов со всеми связанными данными.
+
+Зависимые строки удаляются пачками по PURGE_CHUNK_SIZE: сначала выбираются
+первичные ключи очередной пачки, затем строки удаляются по диапазону ключей
+в короткой отдельной транзакции. Так удаление пользователя со 100 тыс.
+сообщений не держит блокировки на таблицах и не загружает строки в память.
+
+Ход выполнения сохраняется в PurgeJob (видно в админке). Задачи выполняются
+в пуле фоновых потоков процесса, а оставшиеся после перезапуска -
+командой manage.py run_purge_jobs. Выполняющий процесс отмечает heartbeat_at
+после каждой пачки; задачу без отметки дольше PURGE_LEASE секунд
+run_purge_jobs --retry возвращает в очередь, а прежний исполнитель, если он
+еще жив, останавливается при следующей отметке.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import (
+    ArchivedChatMessage, BotUser, Chat, ChatMessage, Payment, PaymentIdempotencyKey, PromoCodeUsage, PurgeJob,
+    ReferralClosure, ReferralCode, ReferralHistory, ReferralLeaderboardEntry, Request, RequestUsage, UserPlan, UserStatistics
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def chat_steps(chat_id):
+    """Шаги удаления одного чата: (название шага, модель, условие)"""
+    return [
+        ('Сообщения чата', ChatMessage, {'chat_id': chat_id}),
+        ('Архив сообщений', ArchivedChatMessage, {'chat_id': chat_id}),
+        ('Чат', Chat, {'pk': chat_id}),
+    ]
+
+
+def user_steps(user_id):
+    """Шаги удаления пользователя: зависимые данные раньше родительских строк"""
+    steps = []
+    for chat_id in Chat.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True):
+        steps.extend(chat_steps(chat_id))
+    steps.extend([
+        ('Использования промокодов', PromoCodeUsage, {'user_id': user_id}),
+        ('Рефералы пользователя', ReferralHistory, {'referrer_id': user_id}),
+        ('Нижние уровни рефералов', ReferralClosure, {'ancestor_id': user_id}),
+        ('Верхние уровни рефералов', ReferralClosure, {'descendant_id': user_id}),
+        ('Приглашение пользователя', ReferralHistory, {'referred_id': user_id}),
+        ('Переходы по реферальным кодам', ReferralHistory, {'referral_code__user_id': user_id}),
+        ('Ключи идемпотентности платежей', PaymentIdempotencyKey, {'user_id': user_id}),
+        ('Платежи', Payment, {'user_id': user_id}),
+        ('Тарифы', UserPlan, {'user_id': user_id}),
+        ('Использование запросов', RequestUsage, {'user_id': user_id}),
+        ('Запросы', Request, {'user_id': user_id}),
+        ('Статистика', UserStatistics, {'user_id': user_id}),
+        ('Рейтинг рефералов', ReferralLeaderboardEntry, {'user_id': user_id}),
+        ('Реферальные коды', ReferralCode, {'user_id': user_id}),
+        ('Пользователь', BotUser, {'pk': user_id}),
+    ])
+    return steps
+
+
+def estimate_rows(kind, target_id):
+    """Сколько строк предстоит удалить (для процента выполнения)"""
+    if kind == 'chat':
+        steps = chat_steps(target_id)
+        return sum(model.objects.filter(**filters).count() for _, model, filters in steps)
+    # Сообщения считаются одним запросом на пользователя, а не на каждый чат
+    total = ChatMessage.objects.filter(chat__user_id=target_id).count()
+    total += ArchivedChatMessage.objects.filter(chat__user_id=target_id).count()
+    total += Chat.objects.filter(user_id=target_id).count()
+    for _, model, filters in user_steps(target_id):
+        if model not in (ChatMessage, ArchivedChatMessage, Chat):
+            total += model.objects.filter(**filters).count()
+    return total
+
+
+def delete_in_chunks(model, filters, chunk_size, on_progress=None):
+    """Удаляет строки model по условию пачками по диапазону первичных ключей"""
+    deleted_total = 0
+    while True:
+        pks = list(
+            model.objects.filter(**filters).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not pks:
+            return deleted_total
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(**filters).filter(pk__gte=pks[0], pk__lte=pks[-1]).delete()
+        deleted_total += deleted
+        if on_progress:
+            on_progress(deleted)
+
+
+class LeaseLost(Exception):
+    """Задачу вернули в очередь (run_purge_jobs --retry), ее выполняет другой процесс"""
+
+
+def _heartbeat(job, **fields):
+    """Отметка о ходе задачи; останавливает исполнителя, если задачу уже забрали"""
+    updated = PurgeJob.objects.filter(pk=job.pk, status='running', started_at=job.started_at).update(
+        heartbeat_at=timezone.now(), **fields
+    )
+    if not updated:
+        raise LeaseLost(job.pk)
+
+
+def run_job(job_id, chunk_size=None):
+    """Выполняет задачу удаления; повторный запуск продолжает с оставшихся строк"""
+    chunk_size = chunk_size or settings.PURGE_CHUNK_SIZE
+    now = timezone.now()
+    claimed = PurgeJob.objects.filter(pk=job_id, status='pending').update(
+        status='running', started_at=now, heartbeat_at=now
+    )
+    if not claimed:
+        return
+
+    # started_at из БД - метка этого запуска для _heartbeat
+    job = PurgeJob.objects.get(pk=job_id)
+    try:
+        job.total_rows = estimate_rows(job.kind, job.target_id)
+        _heartbeat(job, total_rows=job.total_rows)
+
+        steps = chat_steps(job.target_id) if job.kind == 'chat' else user_steps(job.target_id)
+        for label, model, filters in steps:
+            _heartbeat(job, current_step=label)
+            delete_in_chunks(
+                model, filters, chunk_size,
+                on_progress=lambda n: _heartbeat(job, deleted_rows=F('deleted_rows') + n),
+            )
+
+        _heartbeat(job, status='done', current_step='', finished_at=timezone.now())
+    except LeaseLost:
+        return
+    except Exception:
+        PurgeJob.objects.filter(pk=job.pk, started_at=job.started_at).update(
+            status='failed', error=traceback.format_exc(), finished_at=timezone.now()
+        )
+
+
+def requeue_jobs(lease=None):
+    """
+    Возвращает в очередь задачи с ошибкой и прерванные: в статусе running без
+    отметки о ходе дольше lease секунд. Возвращает их количество.
+    """
+    lease = settings.PURGE_LEASE if lease is None else lease
+    expired = timezone.now() - timedelta(seconds=lease)
+    stale = Q(status='running') & (
+        Q(heartbeat_at__lt=expired) | Q(heartbeat_at__isnull=True, started_at__lt=expired)
+    )
+    return PurgeJob.objects.filter(Q(status='failed') | stale).update(status='pending', error='')
+
+
+def _run_in_background(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        # Поток пула не обслуживает HTTP-запросы, закрываем его соединение сами
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.PURGE_WORKERS, thread_name_prefix='purge')
+    return _executor
+
+
+def _submit(job):
+    if settings.PURGE_IN_BACKGROUND:
+        # Запускаем после коммита, иначе поток может не увидеть задачу
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_background, job.pk))
+    return job
+
+
+def schedule_chat_purge(chat):
+    """Скрывает чат сразу, а удаляет его данные в фоне; возвращает PurgeJob"""
+    chat.deleted_at = timezone.now()
+    Chat.objects.filter(pk=chat.pk).update(deleted_at=chat.deleted_at)
+    return _submit(PurgeJob.objects.create(kind='chat', target_id=chat.pk))
+
+
+def schedule_user_purge(user):
+    """Отключает пользователя и скрывает его чаты сразу, данные удаляются в фоне"""
+    now = timezone.now()
+    user.is_active = False
+    user.save(update_fields=['is_active'])  # Через save, чтобы сработали сигналы (сброс кэшей API)
+    Chat.objects.filter(user_id=user.pk, deleted_at__isnull=True).update(deleted_at=now)
+    return _submit(PurgeJob.objects.create(kind='user', target_id=user.pk))
+
+
+def run_pending_jobs(chunk_size=None):
+    """Выполняет все ожидающие задачи в текущем потоке, возвращает их количество"""
+    job_ids = list(PurgeJob.objects.filter(status='pending').order_by('id').values_list('id', flat=True))
+    for job_id in job_ids:
+        run_job(job_id, chunk_size)
+    return len(job_ids)
@@ -0,0 +1,119 @@
+"""
+Многоуровневое дерево рефералов в таблице замыкания (ReferralClosure).
+
+Для каждой пары (предок, потомок) хранится глубина, поэтому размер и доход
+нижних уровней пользователя считаются выборкой по индексу (ancestor, depth)
+без рекурсивного обхода referral_history. При записи реферала добавляются
+пары "каждый предок пригласившего (и он сам) - каждый потомок приглашенного
+(и он сам)" не глубже REFERRAL_CLOSURE_MAX_DEPTH. Учитывается только первый
+пригласивший пользователя. Для существующей истории таблица строится командой
+manage.py build_referral_closure.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from referral_stats import PAID_STATUSES
+
+from .models import Payment, ReferralClosure, ReferralHistory
+
+
+def link(referrer_id, referred_id, max_depth=None):
+    """Добавляет в дерево ребро пригласивший → приглашенный, возвращает число новых пар"""
+    max_depth = max_depth or settings.REFERRAL_CLOSURE_MAX_DEPTH
+    if referred_id is None or referrer_id == referred_id:
+        return 0
+
+    # Предки пригласившего и приглашенного - одним запросом
+    ancestors = [(referrer_id, 0)]
+    for ancestor_id, descendant_id, depth in ReferralClosure.objects.filter(
+        descendant_id__in=[referrer_id, referred_id]
+    ).values_list('ancestor_id', 'descendant_id', 'depth'):
+        if descendant_id == referred_id and depth == 1:
+            return 0  # У приглашенного уже есть пригласивший
+        if descendant_id == referrer_id:
+            if ancestor_id == referred_id:
+                return 0  # Ребро замкнуло бы цикл
+            ancestors.append((ancestor_id, depth))
+
+    descendants = [(referred_id, 0)] + list(
+        ReferralClosure.objects.filter(ancestor_id=referred_id, depth__lt=max_depth)
+        .values_list('descendant_id', 'depth')
+    )
+    rows = [
+        ReferralClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=up + down + 1)
+        for ancestor_id, up in ancestors
+        for descendant_id, down in descendants
+        if up + down + 1 <= max_depth
+    ]
+    ReferralClosure.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+def _parents(chunk_size):
+    """{приглашенный: первый пригласивший} по всей истории, без ребер, замыкающих цикл (как в link)"""
+    parents = {}
+    history = (
+        ReferralHistory.objects.filter(referred__isnull=False).order_by('id')
+        .values_list('referred_id', 'referrer_id')
+    )
+    for referred_id, referrer_id in history.iterator(chunk_size=chunk_size):
+        if referred_id in parents:
+            continue
+        ancestor_id = referrer_id
+        while ancestor_id is not None and ancestor_id != referred_id:
+            ancestor_id = parents.get(ancestor_id)
+        if ancestor_id is None:
+            parents[referred_id] = referrer_id
+    return parents
+
+
+def build(chunk_size=1000, max_depth=None):
+    """
+    Добавляет недостающие пары замыкания по истории рефералов пачками по
+    chunk_size строк; существующие пары не меняются. Возвращает число пар.
+    """
+    max_depth = max_depth or settings.REFERRAL_CLOSURE_MAX_DEPTH
+    parents = _parents(chunk_size)
+    rows = []
+    total = 0
+
+    def flush():
+        with transaction.atomic():
+            ReferralClosure.objects.bulk_create(rows, ignore_conflicts=True)
+        rows.clear()
+
+    for descendant_id in parents:
+        ancestor_id = parents[descendant_id]
+        depth = 1
+        while ancestor_id is not None and depth <= max_depth:
+            rows.append(ReferralClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth))
+            ancestor_id = parents.get(ancestor_id)
+            depth += 1
+        if len(rows) >= chunk_size:
+            total += len(rows)
+            flush()
+    if rows:
+        total += len(rows)
+        flush()
+    return total
+
+
+def downline(user_id, max_depth):
+    """[{'depth', 'users', 'revenue'}] для уровней 1..max_depth под пользователем"""
+    users = dict(
+        ReferralClosure.objects.filter(ancestor_id=user_id, depth__lte=max_depth)
+        .order_by().values('depth').annotate(total=Count('id')).values_list('depth', 'total')
+    )
+    revenue = dict(
+        Payment.objects.filter(
+            user__referral_ancestors__ancestor_id=user_id,
+            user__referral_ancestors__depth__lte=max_depth,
+            status__in=PAID_STATUSES,
+        ).order_by().values('user__referral_ancestors__depth').annotate(total=Sum('amount'))
+        .values_list('user__referral_ancestors__depth', 'total')
+    )
+    return [
+        {'depth': depth, 'users': users.get(depth, 0), 'revenue': revenue.get(depth) or 0}
+        for depth in range(1, max_depth + 1)
+    ]
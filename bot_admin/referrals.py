@@ -0,0 +1,130 @@
+"""
+Счетчики реферальной программы в UserStatistics и ReferralCode (см. также referral_stats.py).
+
+Обновляются атомарно через F() при записи реферала и успешном платеже
+приглашенного, а не пересчитываются при каждом чтении. recount() сверяет
+счетчики с историей пачками (manage.py recount_referrals).
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum
+
+from referral_stats import PAID_STATUSES
+
+from . import leaderboard
+from .models import BotUser, ReferralCode, ReferralHistory, UserStatistics
+
+
+def _increment_stats(user_id, **deltas):
+    """Прибавляет deltas к полям статистики пользователя, создавая строку при необходимости"""
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if UserStatistics.objects.filter(user_id=user_id).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            UserStatistics.objects.create(user_id=user_id, **deltas)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        UserStatistics.objects.filter(user_id=user_id).update(**updates)
+
+
+def referral_recorded(referrer_id, referral_code_id=None, used_at=None):
+    """Новый реферал у пользователя referrer_id, пришедший по коду referral_code_id"""
+    _increment_stats(referrer_id, total_referrals=1)
+    leaderboard.referral_recorded(referrer_id, used_at)
+    if referral_code_id is not None:
+        ReferralCode.objects.filter(pk=referral_code_id).update(
+            total_uses=F('total_uses') + 1, last_used_at=used_at
+        )
+
+
+def referral_payment(referred_id, amount):
+    """Успешный платеж приглашенного пользователя: доход его пригласившего"""
+    referrer_id = (
+        ReferralHistory.objects.filter(referred_id=referred_id)
+        .order_by('id').values_list('referrer_id', flat=True).first()
+    )
+    if referrer_id is not None and amount:
+        _increment_stats(referrer_id, total_referral_revenue=amount)
+
+
+def is_paid(payment):
+    return (payment.status or '').lower() in PAID_STATUSES
+
+
+def _pk_chunks(queryset, chunk_size):
+    """Первичные ключи queryset пачками по chunk_size (по возрастанию ключа)"""
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def recount_codes(pks):
+    """Пересчитывает total_uses и last_used_at кодов pks, возвращает число исправленных"""
+    actual = {
+        row['referral_code_id']: (row['total'], row['last'])
+        for row in ReferralHistory.objects.filter(referral_code_id__in=pks)
+        .order_by().values('referral_code_id').annotate(total=Count('id'), last=Max('created_at'))
+    }
+    fixed = 0
+    for code in ReferralCode.objects.filter(pk__in=pks).only('id', 'total_uses', 'last_used_at'):
+        total, last = actual.get(code.pk, (0, code.last_used_at))
+        if (code.total_uses, code.last_used_at) != (total, last):
+            ReferralCode.objects.filter(pk=code.pk).update(total_uses=total, last_used_at=last)
+            fixed += 1
+    return fixed
+
+
+def _first_referrals():
+    """История, сокращенная до первой записи каждого приглашенного: доход идет только его пригласившему"""
+    first_id = ReferralHistory.objects.filter(referred_id=OuterRef('referred_id')).order_by('id').values('id')[:1]
+    return ReferralHistory.objects.filter(id=Subquery(first_id))
+
+
+def recount_users(pks):
+    """Пересчитывает total_referrals и total_referral_revenue пользователей pks"""
+    history = ReferralHistory.objects.filter(referrer_id__in=pks).order_by().values('referrer_id')
+    counts = dict(history.annotate(total=Count('id')).values_list('referrer_id', 'total'))
+    # Как referral_payment: платеж засчитывается только первому пригласившему
+    revenue = dict(
+        _first_referrals().filter(referrer_id__in=pks).order_by().values('referrer_id').annotate(
+            total=Sum('referred__payment__amount', filter=Q(referred__payment__status__in=PAID_STATUSES))
+        ).values_list('referrer_id', 'total')
+    )
+    stats = {
+        row['user_id']: row
+        for row in UserStatistics.objects.filter(user_id__in=pks)
+        .values('user_id', 'total_referrals', 'total_referral_revenue')
+    }
+    fixed = 0
+    for user_id in pks:
+        total, amount = counts.get(user_id, 0), revenue.get(user_id) or 0
+        row = stats.get(user_id)
+        if row is None:
+            if total or amount:
+                _increment_stats(user_id, total_referrals=total, total_referral_revenue=amount)
+                fixed += 1
+        elif (row['total_referrals'], row['total_referral_revenue']) != (total, amount):
+            UserStatistics.objects.filter(user_id=user_id).update(
+                total_referrals=total, total_referral_revenue=amount
+            )
+            fixed += 1
+    return fixed
+
+
+def recount(chunk_size=500):
+    """Сверяет все реферальные счетчики с историей пачками, возвращает (кодов, пользователей) исправлено"""
+    codes_fixed = users_fixed = 0
+    for pks in _pk_chunks(ReferralCode.objects.all(), chunk_size):
+        with transaction.atomic():
+            codes_fixed += recount_codes(pks)
+    for pks in _pk_chunks(BotUser.objects.all(), chunk_size):
+        with transaction.atomic():
+            users_fixed += recount_users(pks)
+    return codes_fixed, users_fixed
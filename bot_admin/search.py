@@ -0,0 +1,82 @@
+"""
+Полнотекстовый поиск по сообщениям чатов и названиям чатов.
+
+На MySQL используются FULLTEXT-индексы chat_messages(content) и chats(title)
+(миграция 0008) в режиме BOOLEAN MODE: каждое слово запроса обязательно,
+допускается совпадение по началу слова. На других СУБД (локальная разработка)
+поиск сводится к icontains. Архивные сообщения (см. archive.py) не ищутся.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Слова короче innodb_ft_min_token_size (по умолчанию 3) FULLTEXT не индексирует
+MIN_WORD_LENGTH = 3
+MAX_WORDS = 10
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def use_fulltext():
+    return connection.vendor == 'mysql'
+
+
+def search_words(term):
+    """Слова запроса без операторов BOOLEAN MODE"""
+    words = [word for word in _word_re.findall(term or '') if len(word) >= MIN_WORD_LENGTH]
+    return words[:MAX_WORDS]
+
+
+def boolean_query(term):
+    """'привет мир' -> '+привет* +мир*'"""
+    return ' '.join(f'+{word}*' for word in search_words(term))
+
+
+def message_match_q(term):
+    """Условие для ChatMessage: текст сообщения содержит все слова запроса"""
+    if use_fulltext():
+        return Q(pk__in=RawSQL(
+            'SELECT id FROM chat_messages WHERE MATCH(content) AGAINST (%s IN BOOLEAN MODE)',
+            [boolean_query(term)],
+        ))
+    return Q(content__icontains=term)
+
+
+def chat_title_match_q(term, prefix=''):
+    """Условие для Chat (или связанной модели с prefix='chat__'): название содержит все слова запроса"""
+    if use_fulltext():
+        return Q(**{f'{prefix}pk__in': RawSQL(
+            'SELECT id FROM chats WHERE MATCH(title) AGAINST (%s IN BOOLEAN MODE)',
+            [boolean_query(term)],
+        )})
+    return Q(**{f'{prefix}title__icontains': term})
+
+
+def rank_messages(queryset, term):
+    """Найденные сообщения по убыванию релевантности (на MySQL), затем от новых к старым"""
+    if use_fulltext():
+        relevance = RawSQL(
+            'MATCH(chat_messages.content) AGAINST (%s IN BOOLEAN MODE)',
+            [boolean_query(term)],
+            output_field=FloatField(),
+        )
+    else:
+        relevance = Value(1.0, output_field=FloatField())
+    return queryset.filter(message_match_q(term)).annotate(relevance=relevance).order_by('-relevance', '-id')
+
+
+def rank_chats(queryset, term):
+    """Чаты с подходящим названием по убыванию релевантности, затем по последней активности"""
+    if use_fulltext():
+        relevance = RawSQL(
+            'MATCH(chats.title) AGAINST (%s IN BOOLEAN MODE)',
+            [boolean_query(term)],
+            output_field=FloatField(),
+        )
+    else:
+        relevance = Value(1.0, output_field=FloatField())
+    return queryset.filter(chat_title_match_q(term)).annotate(relevance=relevance).order_by(
+        '-relevance', '-updated_at', '-id'
+    )
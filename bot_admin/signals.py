@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from . import referral_tree, referrals
+from .models import Payment, ReferralHistory
+
+
+@receiver(post_save, sender=ReferralHistory)
+def count_referral(sender, instance, created, **kwargs):
+    """Новая запись истории: счетчики пригласившего и его кода, дерево рефералов"""
+    if created:
+        referrals.referral_recorded(instance.referrer_id, instance.referral_code_id, instance.created_at)
+        referral_tree.link(instance.referrer_id, instance.referred_id)
+
+
+@receiver(pre_save, sender=Payment)
+def remember_payment_status(sender, instance, **kwargs):
+    """Запоминает, был ли платеж успешным до сохранения"""
+    instance._was_paid = False
+    if instance.pk is None:
+        return
+    previous = Payment.objects.filter(pk=instance.pk)
+    if transaction.get_connection().in_atomic_block:
+        # Строка заблокирована до коммита: параллельное сохранение увидит уже новый статус
+        previous = previous.select_for_update()
+    status = previous.values_list('status', flat=True).first()
+    instance._was_paid = status is not None and (status or '').lower() in referrals.PAID_STATUSES
+
+
+@receiver(post_save, sender=Payment)
+def count_referral_revenue(sender, instance, created, **kwargs):
+    """Платеж приглашенного пользователя стал успешным: доход пригласившего увеличивается"""
+    if referrals.is_paid(instance) and not getattr(instance, '_was_paid', False):
+        referrals.referral_payment(instance.user_id, instance.amount)
@@ -0,0 +1,106 @@
+"""
+Кэш ответов справочных эндпоинтов (тарифы) внутри процесса.
+
+Тарифы меняются несколько раз в месяц, а читаются при каждом открытии
+мини-приложения. Ответ строится один раз на версию справочника: версия
+хранится в таблице catalog_versions и увеличивается при сохранении или
+удалении Plan (сигналы Django, api/signals.py). Процесс перечитывает версию
+не чаще раза в check_interval секунд, поэтому изменения из админки видны
+во всех процессах с задержкой не больше этого интервала.
+
+Используется и API на Django, и Flask-сервером (api_server.py).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+PLANS = 'plans'
+
+
+class CachedResponse:
+    """Данные ответа и строгий ETag версии справочника"""
+    __slots__ = ('data', 'etag', 'version')
+
+    def __init__(self, data, etag, version):
+        self.data = data
+        self.etag = etag
+        self.version = version
+
+
+class CatalogCache:
+    """LRU-кэш ответов, сбрасываемый при смене версии справочника"""
+
+    def __init__(self, name, load_version, check_interval=5.0, max_entries=256):
+        self.name = name
+        self.load_version = load_version
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._version = None
+        self._checked_at = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self):
+        """Версия справочника; из БД читается не чаще раза в check_interval"""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return self._version
+        version = self.load_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+        return version
+
+    def etag(self, key, version):
+        """
+        Строгий ETag: ответ по одному ключу внутри одной версии справочника
+        всегда одинаков, поэтому для проверки If-None-Match строить его не нужно.
+        """
+        digest = hashlib.sha1(f'{self.name}:{version}:{key}'.encode('utf-8')).hexdigest()[:20]
+        return f'"{self.name}-v{version}-{digest}"'
+
+    def get(self, key, build):
+        """CachedResponse для key; build() вызывается только при промахе"""
+        version = self.version()
+        if version is None:
+            # Версию узнать не удалось - работаем без кэша
+            return CachedResponse(build(), None, None)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = CachedResponse(build(), self.etag(key, version), version)
+        with self._lock:
+            # Пока строили ответ, версия могла смениться - такой ответ не сохраняем
+            if self._version == version:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        """Сбрасывает кэш процесса и заставляет перечитать версию при следующем запросе"""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'version': self._version,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
@@ -18,6 +18,14 @@ DB_CONFIG = {
     'charset': os.getenv('DB_CHARSET', 'utf8mb4')
 }
 
+# Пул соединений api_server (см. db_pool.py)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))  # Максимум открытых соединений
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))  # Ожидание свободного соединения, сек
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))  # Проверять соединение, простоявшее дольше, сек
+
+# Кэш проверенных JWT-токенов api_server
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
 # Настройки API
 API_HOST = os.getenv('API_HOST', '0.0.0.0')
 API_PORT = int(os.getenv('API_PORT', 5000))
@@ -38,4 +46,26 @@ def get_bot_token() -> str:
     """
     Получает токен бота из переменных окружения
     """
-    return os.getenv('BOT_TOKEN', '') 
\ No newline at end of file
+    return os.getenv('BOT_TOKEN', '')
+
+
+# Кэш ответов каталога тарифов (см. catalog_cache.py)
+CATALOG_VERSION_CHECK_INTERVAL = float(os.getenv('CATALOG_VERSION_CHECK_INTERVAL', 5))
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', 60))
+
+# Индекс промокодов в памяти (см. promo_engine.py): период обновления, сек
+PROMO_INDEX_REFRESH = float(os.getenv('PROMO_INDEX_REFRESH', 30))
+
+# Глубина дерева рефералов в таблице замыкания (см. bot_admin/referral_tree.py)
+REFERRAL_CLOSURE_MAX_DEPTH = int(os.getenv('REFERRAL_CLOSURE_MAX_DEPTH', 10))
+
+# Вебхуки платежных систем (см. payment_queue.py)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Ключ HMAC-подписи тела вебхука
+WEBHOOK_QUEUE_PATH = os.getenv('WEBHOOK_QUEUE_PATH', 'webhook_queue.sqlite3')  # Файл очереди событий
+WEBHOOK_QUEUE_MAX = int(os.getenv('WEBHOOK_QUEUE_MAX', 10000))  # Больше необработанных событий - ответ 503
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))  # Одновременно проводимых покупок
+# Запускать воркеры при старте python api_server.py (иначе - run_webhook_workers.py или первый вебхук)
+WEBHOOK_WORKERS_AUTOSTART = os.getenv('WEBHOOK_WORKERS_AUTOSTART', 'True').lower() in ('true', '1', 't')
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 5))  # Попыток до перевода события в dead
+WEBHOOK_RETRY_BASE = float(os.getenv('WEBHOOK_RETRY_BASE', 2))  # Задержка перед первым повтором, сек (дальше удваивается)
+WEBHOOK_LEASE = float(os.getenv('WEBHOOK_LEASE', 60))  # Через сколько секунд событие упавшего воркера снова доступно
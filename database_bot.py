@@ -1,11 +1,14 @@
 import functools  # Импортируем functools для wraps
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, Dict, Any, Callable
 
 import pymysql
 import pymysql.cursors
 
+import config
+import referral_stats
+
 # Настройка логирования
 # Убедитесь, что базовая конфигурация вызывается только один раз в вашем приложении
 # logging.basicConfig(level=logging.INFO) # Можно убрать отсюда, если настраивается в основном файле бота
@@ -206,6 +209,7 @@ class BotDatabase:
             bonus_requests_added: int
     ) -> bool:
         """Запись информации о реферальном переходе в историю"""
+        now = datetime.now()
         with self.conn.cursor() as cursor:
             cursor.execute('''
                 INSERT INTO referral_history (
@@ -214,8 +218,21 @@ class BotDatabase:
                 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             ''', (
                 referrer_id, referred_id, referral_code_id, referral_code,
-                bonus_requests_added, 'completed', datetime.now(), datetime.now()
+                bonus_requests_added, 'completed', now, now
             ))
+            # Счетчики рефералов пригласившего и использований кода - в той же транзакции
+            cursor.execute(referral_stats.REFERRAL_RECORDED_SQL, (referrer_id,))
+            cursor.execute(referral_stats.REFERRAL_CODE_USED_SQL, (now, referral_code_id))
+            # Периоды рейтинга считаются по UTC, как в Django (TIME_ZONE = 'UTC')
+            cursor.execute(
+                referral_stats.REFERRAL_LEADERBOARD_SQL,
+                referral_stats.leaderboard_params(referrer_id, datetime.now(timezone.utc).date())
+            )
+            if referred_id != referrer_id:
+                cursor.execute(
+                    referral_stats.REFERRAL_CLOSURE_SQL,
+                    referral_stats.closure_params(referrer_id, referred_id, config.REFERRAL_CLOSURE_MAX_DEPTH)
+                )
             self.conn.commit() # Commit здесь
             logger.info(f"Реферальный переход записан: {referrer_id} -> {referred_id} (code: {referral_code})")
             return True
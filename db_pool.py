@@ -0,0 +1,130 @@
+"""
+Пул соединений pymysql для api_server (пул mysql.connector для
+payments_service.py - подкласс с другим _connect).
+
+Соединение берется из пула через get_connection() и возвращается в него
+вызовом close(), поэтому обработчики, написанные под pymysql.connect(),
+работают с пулом без изменений. При возврате незавершенная транзакция
+откатывается, чтобы следующий запрос не читал старый снимок данных.
+"""
+import queue
+import threading
+import time
+
+import pymysql
+
+import config
+
+
+class PoolTimeout(Exception):
+    """Нет свободного соединения в течение DB_POOL_TIMEOUT"""
+
+
+class PooledConnection:
+    """Соединение из пула: close() возвращает его в пул вместо закрытия"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise pymysql.err.InterfaceError('Соединение уже возвращено в пул')
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    """Ограниченный потокобезопасный пул соединений"""
+
+    def __init__(self, db_config, size=10, timeout=5.0, ping_after=30.0):
+        self.db_config = db_config
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle = queue.LifoQueue()  # (соединение, время возврата)
+        self._slots = threading.BoundedSemaphore(size)
+        self.created = 0
+        self.reused = 0
+
+    def _connect(self):
+        self.created += 1
+        return pymysql.connect(cursorclass=pymysql.cursors.DictCursor, **self.db_config)
+
+    def _revive(self, conn):
+        """Проверяет простоявшее соединение, при необходимости переподключаясь"""
+        conn.ping(reconnect=True)
+        return conn
+
+    def get(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'Нет свободных соединений с БД (пул на {self.size})')
+        try:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            else:
+                self.reused += 1
+                # Долго простоявшее соединение мог закрыть сервер (wait_timeout)
+                if time.monotonic() - released_at > self.ping_after:
+                    conn = self._revive(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            conn.rollback()
+        except Exception:
+            # Сломанное соединение не возвращаем, пул откроет новое
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'idle': self._idle.qsize(),
+            'created': self.created,
+            'reused': self.reused,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    config.DB_CONFIG,
+                    size=config.DB_POOL_SIZE,
+                    timeout=config.DB_POOL_TIMEOUT,
+                    ping_after=config.DB_POOL_PING_AFTER,
+                )
+    return _pool
+
+
+def get_connection():
+    """Соединение из общего пула; вернуть - conn.close()"""
+    return get_pool().get()
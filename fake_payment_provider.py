@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Тестовая платежная система: отправляет пачки подписанных вебхуков в
+POST /api/payments/webhook/<payment_system> и печатает коды ответов,
+p50/p95/p99 задержки приема и, если указан файл очереди, время ее разбора воркерами.
+
+    WEBHOOK_SECRET=test python api_server.py
+    python fake_payment_provider.py --secret test --users 1000-1019 --plan-id 1 --amount 100 \\
+        --count 500 --concurrency 50 --duplicates 0.2 --queue-path webhook_queue.sqlite3
+
+--amount должен совпадать с ценой плана --plan-id: иначе покупка не проводится,
+и событие сразу попадает в dead.
+
+--duplicates - доля повторных уведомлений о тех же платежах (платежные системы
+повторяют вебхуки, пока не получат 2xx); зачислены они быть не должны.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+
+import payment_queue
+from benchmark_chat import parse_users, percentile
+
+
+def build_events(args, users):
+    """Список событий для отправки: уникальные платежи и повторы части из них"""
+    events = [
+        {
+            'payment_id': f'fake-{uuid.uuid4().hex}',
+            'user_id': users[index % len(users)],
+            'plan_id': args.plan_id,
+            'status': args.status,
+            'amount': args.amount,
+        }
+        for index in range(args.count)
+    ]
+    events += random.sample(events, int(len(events) * args.duplicates))
+    random.shuffle(events)
+    return events
+
+
+def send(session, args, event):
+    """Отправляет один вебхук: (код ответа или имя ошибки, задержка в секундах)"""
+    body = json.dumps(event).encode('utf-8')
+    started = time.monotonic()
+    try:
+        response = session.post(
+            f'{args.base_url}/api/payments/webhook/{args.payment_system}',
+            data=body,
+            headers={
+                'Content-Type': 'application/json',
+                'X-Webhook-Signature': payment_queue.sign(body, args.secret),
+            },
+            timeout=args.timeout,
+        )
+        status = response.status_code
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return status, time.monotonic() - started
+
+
+def wait_for_queue(path, timeout):
+    """Ждет, пока воркеры разберут очередь; возвращает (статистика, секунд)"""
+    queue = payment_queue.WebhookQueue(path)
+    started = time.monotonic()
+    while True:
+        stats = queue.stats()
+        waited = time.monotonic() - started
+        if not stats[payment_queue.PENDING] and not stats[payment_queue.PROCESSING] or waited >= timeout:
+            return stats, waited
+        time.sleep(0.2)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Тестовая платежная система: пачки вебхуков в API')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--secret', required=True, help='WEBHOOK_SECRET сервера')
+    parser.add_argument('--payment-system', default='fake')
+    parser.add_argument('--users', default='1', help="ID пользователей: '1000-1019' или '1,2,3'")
+    parser.add_argument('--plan-id', type=int, default=1)
+    parser.add_argument('--status', default='succeeded')
+    parser.add_argument('--amount', type=float, default=100.0, help='Сумма платежа: цена плана --plan-id')
+    parser.add_argument('--count', type=int, default=100, help='Уникальных платежей')
+    parser.add_argument('--duplicates', type=float, default=0.0, help='Доля повторных уведомлений')
+    parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--queue-path', help='Файл очереди сервера: дождаться ее разбора')
+    parser.add_argument('--drain-timeout', type=float, default=300.0)
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    args.base_url = args.base_url.rstrip('/')
+    users = parse_users(args.users)
+    if not users:
+        print("Не указаны пользователи (--users)")
+        sys.exit(1)
+
+    events = build_events(args, users)
+    codes = Counter()
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                if not events:
+                    return
+                event = events.pop()
+            status, latency = send(session, args, event)
+            with lock:
+                codes[status] += 1
+                latencies.append(latency)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    print(f"Отправлено {len(latencies)} вебхуков за {elapsed:.2f} с ({len(latencies) / elapsed:.1f} в секунду)")
+    print("Ответы: " + ", ".join(f"{code}: {total}" for code, total in sorted(codes.items(), key=str)))
+    print(
+        f"Задержка приема: p50 {percentile(latencies, 50) * 1000:.1f} мс, "
+        f"p95 {percentile(latencies, 95) * 1000:.1f} мс, p99 {percentile(latencies, 99) * 1000:.1f} мс"
+    )
+    if args.queue_path:
+        stats, waited = wait_for_queue(args.queue_path, args.drain_timeout)
+        print(
+            f"Очередь разобрана за {waited:.2f} с: проведено {stats[payment_queue.DONE]}, "
+            f"в dead {stats[payment_queue.DEAD]}, осталось {stats[payment_queue.PENDING] + stats[payment_queue.PROCESSING]}"
+        )
+
+
+if __name__ == '__main__':
+    main()
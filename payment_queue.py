@@ -0,0 +1,292 @@
+"""
+Очередь вебхуков платежных систем.
+
+Обработчик вебхука в api_server.py только проверяет подпись, сохраняет событие
+в локальную SQLite-очередь (WAL, synchronous=FULL - событие переживает
+перезапуск процесса) и сразу отвечает 202. Покупку проводит пул из
+WEBHOOK_WORKERS потоков через PaymentService.process_plan_purchase, поэтому
+медленные коммиты в MySQL не задерживают ответ платежной системе.
+
+Событие, которое не удалось провести, повторяется с экспоненциальной задержкой;
+после WEBHOOK_MAX_ATTEMPTS попыток оно остается в очереди со статусом dead для
+разбора вручную. Событие, которое повтор не исправит (обработчик вернул
+"permanent": True - например, сумма не совпадает с ценой), сразу переводится в
+dead. Событие, взятое упавшим воркером, снова становится доступным по истечении
+аренды (lease). Повтор одного и того же события отсекается уникальным ключом, а
+повтор платежа - ключом идемпотентности покупки (см. payments_service.py). Когда
+в очереди больше WEBHOOK_QUEUE_MAX необработанных событий, новые отклоняются с
+503, и платежная система присылает их позже.
+"""
+import hashlib
+import hmac
+import json
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS webhook_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_key TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL,
+        locked_until REAL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS webhook_events_ready ON webhook_events (status, available_at);
+"""
+
+# Статусы событий
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+DEAD = 'dead'
+
+
+def sign(body, secret):
+    """Подпись тела вебхука: HMAC-SHA256 в hex"""
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature, secret):
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign(body, secret), signature.strip().lower())
+
+
+class WebhookQueue:
+    """Очередь событий в SQLite; у каждого потока свое соединение"""
+
+    def __init__(self, path, lease=60.0):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: транзакции открываются явно (см. _transaction)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def notify(self):
+        """Разбудить ожидающие воркеры"""
+        self._wake.set()
+
+    def enqueue(self, event_key, payload):
+        """Сохраняет событие; False - событие с таким ключом уже было"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO webhook_events (event_key, payload, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (event_key, json.dumps(payload), now, now, now),
+            )
+            created = cursor.rowcount == 1
+        if created:
+            self.notify()
+        return created
+
+    def claim(self):
+        """Берет в работу одно готовое событие: (id, payload, номер попытки) или None"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM webhook_events "
+                "WHERE (status = ? AND available_at <= ?) OR (status = ? AND locked_until <= ?) "
+                "ORDER BY available_at, id LIMIT 1",
+                (PENDING, now, PROCESSING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE webhook_events SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ? "
+                "WHERE id = ?",
+                (PROCESSING, now + self.lease, now, row['id']),
+            )
+        return row['id'], json.loads(row['payload']), row['attempts'] + 1
+
+    def complete(self, event_id):
+        self._set_status(event_id, DONE)
+
+    def retry(self, event_id, error, delay):
+        """Вернуть событие в очередь через delay секунд"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE webhook_events SET status = ?, available_at = ?, locked_until = NULL, last_error = ?, "
+                "updated_at = ? WHERE id = ?",
+                (PENDING, now + delay, str(error), now, event_id),
+            )
+
+    def dead_letter(self, event_id, error):
+        self._set_status(event_id, DEAD, error)
+
+    def _set_status(self, event_id, status, error=None):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE webhook_events SET status = ?, locked_until = NULL, last_error = COALESCE(?, last_error), "
+                "updated_at = ? WHERE id = ?",
+                (status, error, time.time(), event_id),
+            )
+
+    def requeue_dead(self):
+        """Вернуть все события из dead в очередь, возвращает их количество"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE webhook_events SET status = ?, attempts = 0, available_at = ?, updated_at = ? "
+                "WHERE status = ?",
+                (PENDING, now, now, DEAD),
+            )
+        self.notify()
+        return cursor.rowcount
+
+    def prune(self, older_than):
+        """Удаляет обработанные события старше older_than секунд (ключи для отсева повторов)"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM webhook_events WHERE status = ? AND updated_at < ?",
+                (DONE, time.time() - older_than),
+            )
+        return cursor.rowcount
+
+    def backlog(self):
+        """Сколько событий ждет обработки или обрабатывается"""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM webhook_events WHERE status IN (?, ?)", (PENDING, PROCESSING)
+        ).fetchone()[0]
+
+    def wait(self, timeout):
+        """Ждет нового события не дольше timeout секунд"""
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+    def stats(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM webhook_events GROUP BY status").fetchall()
+        counts = {PENDING: 0, PROCESSING: 0, DONE: 0, DEAD: 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK вокруг блока with"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class WorkerPool:
+    """
+    Потоки, проводящие события очереди через handler(payload) -> (успех, детали).
+    Одновременно обрабатывается не больше workers событий.
+    """
+
+    def __init__(self, queue, handler, workers=4, max_attempts=5, retry_base=2.0, retry_max=300.0,
+                 poll_interval=1.0, keep_done=7 * 86400):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.keep_done = keep_done
+        self.processed = 0
+        self.retried = 0
+        self.dead = 0
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'webhook-worker-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.queue.notify()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.queue.claim()
+            except sqlite3.Error:
+                claimed = None
+            if claimed is None:
+                self._prune()
+                self.queue.wait(self.poll_interval)
+                continue
+            self.process(*claimed)
+
+    def process(self, event_id, payload, attempt):
+        """Проводит одно событие и записывает результат в очередь"""
+        permanent = False
+        try:
+            ok, details = self.handler(payload)
+            error = None if ok else (details or {}).get('error', 'Не удалось провести платеж')
+            permanent = not ok and bool((details or {}).get('permanent'))
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+
+        dead = permanent or attempt >= self.max_attempts
+        with self._lock:
+            if error is None:
+                self.processed += 1
+            elif dead:
+                self.dead += 1
+            else:
+                self.retried += 1
+        if error is None:
+            self.queue.complete(event_id)
+        elif dead:
+            self.queue.dead_letter(event_id, error)
+        else:
+            self.queue.retry(event_id, error, min(self.retry_max, self.retry_base * 2 ** (attempt - 1)))
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._pruned_at < 3600:
+            return
+        self._pruned_at = now
+        try:
+            self.queue.prune(self.keep_done)
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'processed': self.processed,
+                'retried': self.retried,
+                'dead': self.dead,
+            }
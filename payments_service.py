@@ -3,11 +3,131 @@ from mysql.connector import Error
 import os
 from datetime import datetime, timedelta
 import json
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+import db_pool
+import promo_engine
+import referral_stats
+
 # Загрузка переменных окружения
 load_dotenv()
 
+# Частые операции выполняются подготовленными выражениями (см. PaymentService.execute).
+# Курсор mysql.connector готовит выражение заново, только если передан другой объект
+# строки, поэтому SQL хранится в константах.
+REQUESTS_LEFT_SQL = "SELECT requests_left FROM users WHERE user_id = %s"
+DECREMENT_REQUESTS_SQL = """
+    UPDATE users
+    SET requests_left = requests_left - 1
+    WHERE user_id = %s AND requests_left > 0
+"""
+INSERT_USAGE_SQL = """
+    INSERT INTO request_usage
+    (user_id, request_type, ai_model, tokens_used, was_successful, request_text, response_length, response_time)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+UPDATE_USAGE_STATS_SQL = """
+    UPDATE user_statistics
+    SET total_requests = total_requests + 1,
+        total_tokens = total_tokens + %s,
+        last_active = NOW()
+    WHERE user_id = %s
+"""
+INSERT_USAGE_STATS_SQL = """
+    INSERT INTO user_statistics
+    (user_id, total_requests, total_tokens, last_active)
+    VALUES (%s, 1, %s, NOW())
+"""
+
+# Ключ идемпотентности покупки (payment_system, payment_id): вставка или обнаружение
+# повтора одним запросом. 1 измененная строка - ключ новый, 2 - повтор (attempts + 1).
+CLAIM_PAYMENT_SQL = """
+    INSERT INTO payment_idempotency_keys (payment_system, payment_id, user_id, attempts, created_at)
+    VALUES (%s, %s, %s, 1, NOW())
+    ON DUPLICATE KEY UPDATE attempts = attempts + 1
+"""
+STORED_PAYMENT_SQL = """
+    SELECT user_id, result FROM payment_idempotency_keys
+    WHERE payment_system = %s AND payment_id = %s
+"""
+COMPLETE_PAYMENT_SQL = """
+    UPDATE payment_idempotency_keys
+    SET result = %s, user_plan_id = %s, completed_at = NOW()
+    WHERE payment_system = %s AND payment_id = %s
+"""
+
+# Соединение не получено: MySQL недоступен или в пуле нет свободных соединений
+CONNECT_ERRORS = (Error, db_pool.PoolTimeout)
+
+_pool = None
+_pool_lock = threading.Lock()
+_promo_index = None
+_promo_index_lock = threading.Lock()
+
+
+class ConnectorPool(db_pool.ConnectionPool):
+    """
+    Пул соединений mysql.connector. У каждого соединения свой кэш
+    подготовленных выражений (statements: SQL -> курсор), который живет,
+    пока соединение лежит в пуле.
+    """
+
+    def _connect(self):
+        self.created += 1
+        conn = mysql.connector.connect(**self.db_config)
+        conn.statements = {}
+        return conn
+
+    def _revive(self, conn):
+        # После переподключения подготовленные выражения недействительны,
+        # поэтому разорванное соединение заменяем новым
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except Error:
+            try:
+                conn.close()
+            except Error:
+                pass
+            return self._connect()
+
+
+def get_pool():
+    """Общий для всех экземпляров PaymentService пул соединений"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectorPool(
+                    PaymentService().config,
+                    size=int(os.getenv('DB_POOL_SIZE', 10)),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+                    ping_after=float(os.getenv('DB_POOL_PING_AFTER', 30)),
+                )
+    return _pool
+
+
+def get_promo_index():
+    """Общий для всех экземпляров PaymentService индекс промокодов (см. promo_engine.py)"""
+    global _promo_index
+    if _promo_index is None:
+        with _promo_index_lock:
+            if _promo_index is None:
+                # Индекс обновляется посреди покупки, когда соединение из пула уже занято,
+                # поэтому загрузчик открывает свое соединение в обход пула: иначе при
+                # исчерпанном пуле покупки ждали бы друг друга до PoolTimeout
+                _promo_index = promo_engine.PromoIndex(
+                    promo_engine.sql_loader(
+                        lambda: mysql.connector.connect(**PaymentService().config),
+                        lambda conn: conn.cursor(dictionary=True),
+                    ),
+                    refresh_interval=float(os.getenv('PROMO_INDEX_REFRESH', 30)),
+                )
+    return _promo_index
+
+
 class PaymentService:
     def __init__(self):
         """Инициализация сервиса платежей"""
@@ -22,42 +142,96 @@ class PaymentService:
         self.connection = None
             
     def connect(self):
-        """Установка соединения с базой данных"""
+        """Соединение из общего пула; close() возвращает его в пул"""
         try:
-            connection = mysql.connector.connect(**self.config)
-            if connection.is_connected():
-                return connection
-        except Error as e:
+            return get_pool().get()
+        except CONNECT_ERRORS as e:
             print(f"Ошибка при подключении к MySQL: {e}")
         return None
+
+    def borrow(self):
+        """
+        Соединение для нескольких операций подряд (при недоступной БД - исключение из CONNECT_ERRORS):
+
+            with payment_service.borrow() as conn:
+                payment_service.get_user_requests_left(user_id, conn=conn)
+                payment_service.decrement_user_requests(user_id, conn=conn)
+        """
+        return get_pool().get()
+
+    @contextmanager
+    def _connection(self, conn=None):
+        """Переданное вызывающим соединение или свое из пула (None - БД недоступна)"""
+        if conn is not None:
+            yield conn
+            return
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def execute(self, conn, sql, params):
+        """
+        Выполняет sql подготовленным выражением и возвращает курсор. Выражение
+        готовится один раз на соединение из пула и дальше только выполняется.
+        """
+        statements = getattr(conn, 'statements', None)
+        if statements is None:
+            cursor = conn.cursor(prepared=True)
+        else:
+            cursor = statements.get(sql)
+            if cursor is None:
+                cursor = statements[sql] = conn.cursor(prepared=True)
+        cursor.execute(sql, params)
+        return cursor
     
-    def process_plan_purchase(self, user_id: int, plan_id: int, payment_details=None, promo_code=None, source='bot'):
+    def process_plan_purchase(self, user_id: int, plan_id: int, payment_details=None, promo_code=None, source='bot',
+                              conn=None, verify_amount=False):
         """
         Обрабатывает покупку тарифного плана и обновляет количество запросов пользователя
         
         Args:
             user_id: ID пользователя
             plan_id: ID тарифного плана
-            payment_details: Детали платежа (словарь с payment_id, amount, payment_system, status)
+            payment_details: Детали платежа (словарь с payment_id, amount, payment_system, status).
+                Повтор платежа с теми же payment_system и payment_id не зачисляется
+                второй раз: возвращается сохраненный результат первой покупки.
             promo_code: Код промокода (если использовался)
             source: Источник покупки (bot, web, admin)
+            conn: Соединение из borrow() (по умолчанию берется из пула)
+            verify_amount: Сверить amount из payment_details с ценой плана после скидки;
+                при расхождении покупка откатывается, в деталях - "permanent": True
             
         Returns:
             bool: Успешность операции
             dict: Детали операции
         """
-        conn = self.connect()
-        if conn is None:
-            return False, {"error": "Ошибка подключения к базе данных"}
+        own_conn = conn is None
+        if own_conn:
+            conn = self.connect()
+            if conn is None:
+                return False, {"error": "Ошибка подключения к базе данных"}
         
+        cursor = None
         try:
             cursor = conn.cursor(dictionary=True)
+
+            # Ключ идемпотентности вставляется в той же транзакции, что и покупка:
+            # параллельный повтор ждет ее коммита, а при откате ключ исчезает
+            idempotency_key = self._idempotency_key(payment_details)
+            if idempotency_key:
+                cursor.execute(CLAIM_PAYMENT_SQL, idempotency_key + (user_id,))
+                if cursor.rowcount != 1:
+                    return self._stored_purchase(conn, cursor, idempotency_key, user_id)
             
             # Получаем информацию о тарифном плане
             cursor.execute("SELECT * FROM plans WHERE id = %s", (plan_id,))
             plan = cursor.fetchone()
             
             if not plan:
+                conn.rollback()
                 return False, {"error": "Тарифный план не найден"}
             
             # Применяем промокод, если он указан
@@ -66,7 +240,7 @@ class PaymentService:
             promo_id = None
             
             if promo_code:
-                promo_details = self._apply_promo_code(cursor, promo_code, user_id, plan_id)
+                promo_details = self._apply_promo_code(cursor, promo_code, user_id, plan)
                 if promo_details:
                     discount_amount = promo_details.get('discount_amount', 0)
                     bonus_requests = promo_details.get('bonus_requests', 0)
@@ -76,6 +250,14 @@ class PaymentService:
             price_paid = float(plan['price']) - discount_amount
             if price_paid < 0:
                 price_paid = 0
+
+            # Платежная система должна была списать ровно цену со скидкой
+            if verify_amount and not self._amount_matches((payment_details or {}).get('amount'), price_paid):
+                conn.rollback()
+                return False, {
+                    "error": f"Сумма платежа {(payment_details or {}).get('amount')} не совпадает с ценой {price_paid:.2f}",
+                    "permanent": True,
+                }
                 
             # Рассчитываем количество запросов для добавления
             requests_to_add = plan['requests'] + bonus_requests
@@ -102,6 +284,10 @@ class PaymentService:
                     json.dumps(payment_details)
                 ))
                 payment_id = cursor.lastrowid
+                
+                # Доход пригласившего пользователя (счетчик в user_statistics)
+                if str(status).lower() in referral_stats.PAID_STATUSES:
+                    cursor.execute(referral_stats.REFERRAL_REVENUE_SQL, (amount, user_id))
             
             # Рассчитываем дату истечения, если у плана есть длительность
             expired_at = None
@@ -138,17 +324,6 @@ class PaymentService:
             if payment_id:
                 cursor.execute("UPDATE payments SET user_plan_id = %s WHERE id = %s", (user_plan_id, payment_id))
             
-            # Регистрируем использование промокода
-            if promo_id:
-                cursor.execute("""
-                    INSERT INTO promo_code_usages 
-                    (promo_code_id, user_id, applied_to_plan_id, discount_amount, requests_added) 
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (promo_id, user_id, plan_id, discount_amount, bonus_requests))
-                
-                # Увеличиваем счетчик использований промокода
-                cursor.execute("UPDATE promo_codes SET usages_count = usages_count + 1 WHERE id = %s", (promo_id,))
-            
             # Обновляем количество запросов пользователя
             cursor.execute("""
                 UPDATE users 
@@ -158,10 +333,8 @@ class PaymentService:
             
             # Обновляем статистику пользователя
             self._update_user_statistics(cursor, user_id, payment_amount=price_paid)
-            
-            conn.commit()
-            
-            return True, {
+
+            result = {
                 "plan": plan['name'],
                 "price_paid": price_paid,
                 "requests_added": requests_to_add,
@@ -169,70 +342,112 @@ class PaymentService:
                 "plan_id": plan_id,
                 "user_plan_id": user_plan_id
             }
+            if idempotency_key:
+                cursor.execute(COMPLETE_PAYMENT_SQL, (json.dumps(result), user_plan_id) + idempotency_key)
+            
+            conn.commit()
+            if promo_id:
+                get_promo_index().record_redemption(promo_id, user_id)
+            
+            return True, result
             
         except Error as e:
             print(f"Ошибка при обработке покупки: {e}")
+            try:
+                conn.rollback()
+            except Error:
+                pass
             return False, {"error": str(e)}
         finally:
-            if conn.is_connected():
+            if cursor is not None:
                 cursor.close()
+            if own_conn:
                 conn.close()
     
-    def _apply_promo_code(self, cursor, promo_code, user_id, plan_id):
-        """Применяет промокод и возвращает скидку и бонусные запросы"""
+    @staticmethod
+    def _idempotency_key(payment_details):
+        """(payment_system, payment_id) платежа или None, если внешнего id нет"""
+        if not payment_details or not payment_details.get('payment_id'):
+            return None
+        return (payment_details.get('payment_system', 'unknown'), str(payment_details['payment_id']))
+
+    def _stored_purchase(self, conn, cursor, idempotency_key, user_id):
+        """Результат уже проведенной покупки с тем же ключом идемпотентности"""
+        cursor.execute(STORED_PAYMENT_SQL, idempotency_key)
+        stored = cursor.fetchone()
+        conn.commit()  # Сохраняем счетчик попыток
+        if not stored or stored['result'] is None:
+            return False, {"error": "Платеж уже обрабатывается"}
+        if str(stored['user_id']) != str(user_id):
+            return False, {"error": "Платеж уже зачислен другому пользователю"}
+        result = json.loads(stored['result'])
+        result['duplicate'] = True
+        return True, result
+
+    @staticmethod
+    def _amount_matches(amount, price):
+        """Совпадает ли сумма платежа с ценой с точностью до копейки"""
         try:
-            # Получаем информацию о промокоде
+            return round(float(amount), 2) == round(float(price), 2)
+        except (TypeError, ValueError):
+            return False
+
+    def _apply_promo_code(self, cursor, promo_code, user_id, plan):
+        """
+        Проверяет промокод по индексу в памяти и погашает его в текущей транзакции.
+        Возвращает скидку и бонусные запросы или None, если промокод не применим.
+        """
+        result = get_promo_index().check(promo_code, plan['id'], user_id)
+        if result.error == promo_engine.NOT_FOUND:
+            # Промокод могли создать или включить после загрузки индекса: решает БД
+            result = self._lookup_promo_code(cursor, promo_code, plan['id'])
+        if not result.ok:
+            return None
+        promo = result.promo
+        discount_amount = promo_engine.compute_discount(promo, plan['price'])
+
+        try:
+            # Уникальный ключ (promo_code_id, user_id): повторное использование не вставится
             cursor.execute("""
-                SELECT * FROM promo_codes 
-                WHERE code = %s 
-                AND is_active = TRUE 
-                AND (valid_to IS NULL OR valid_to > NOW())
-                AND (max_usages = 0 OR usages_count < max_usages)
-            """, (promo_code,))
-            
-            promo = cursor.fetchone()
-            if not promo:
+                INSERT IGNORE INTO promo_code_usages 
+                (promo_code_id, user_id, applied_to_plan_id, discount_amount, requests_added, used_at) 
+                VALUES (%s, %s, %s, %s, %s, NOW())
+            """, (promo.id, user_id, plan['id'], discount_amount, promo.bonus_requests))
+            if cursor.rowcount != 1:
                 return None
-                
-            # Проверяем, что промокод применим к данному плану
-            if promo['allowed_plans']:
-                allowed_plans = promo['allowed_plans'].split(',')
-                if str(plan_id) not in allowed_plans:
-                    return None
-            
-            # Проверяем, использовал ли пользователь этот промокод ранее
-            cursor.execute("""
-                SELECT COUNT(*) as count FROM promo_code_usages 
-                WHERE promo_code_id = %s AND user_id = %s
-            """, (promo['id'], user_id))
-            
-            usage_count = cursor.fetchone()['count']
-            if usage_count > 0:
+
+            # Условный UPDATE: счетчик растет, только пока лимит не исчерпан
+            cursor.execute(promo_engine.REDEEM_SQL, (promo.id,))
+            if cursor.rowcount != 1:
+                cursor.execute(
+                    "DELETE FROM promo_code_usages WHERE promo_code_id = %s AND user_id = %s",
+                    (promo.id, user_id)
+                )
                 return None
-            
-            # Получаем информацию о плане
-            cursor.execute("SELECT price FROM plans WHERE id = %s", (plan_id,))
-            plan = cursor.fetchone()
-            
-            # Рассчитываем скидку
-            discount_amount = 0
-            if promo['discount_type'] == 'percent':
-                discount_amount = float(plan['price']) * (float(promo['discount_value']) / 100)
-            elif promo['discount_type'] == 'fixed':
-                discount_amount = float(promo['discount_value'])
-                if discount_amount > float(plan['price']):
-                    discount_amount = float(plan['price'])
-            
-            return {
-                'promo_id': promo['id'],
-                'discount_amount': discount_amount,
-                'bonus_requests': promo['bonus_requests']
-            }
-            
         except Error as e:
             print(f"Ошибка при применении промокода: {e}")
             return None
+
+        return {
+            'promo_id': promo.id,
+            'discount_amount': discount_amount,
+            'bonus_requests': promo.bonus_requests
+        }
     
+    def _lookup_promo_code(self, cursor, promo_code, plan_id):
+        """Проверка промокода, которого нет в индексе, по строке из БД"""
+        try:
+            cursor.execute(promo_engine.PROMO_BY_CODE_SQL, (str(promo_code).strip(),))
+            row = cursor.fetchone()
+        except Error as e:
+            print(f"Ошибка при поиске промокода: {e}")
+            row = None
+        if row is None:
+            return promo_engine.PromoCheck(error=promo_engine.NOT_FOUND)
+        # Индекс устарел: следующая проверка перечитает его
+        get_promo_index().invalidate()
+        return promo_engine.check_entry(promo_engine.PromoEntry(row), plan_id)
+
     def _update_user_statistics(self, cursor, user_id, payment_amount=0):
         """Обновляет статистику пользователя"""
         try:
@@ -259,100 +474,63 @@ class PaymentService:
         except Error as e:
             print(f"Ошибка при обновлении статистики: {e}")
             
-    def get_user_requests_left(self, user_id):
+    def get_user_requests_left(self, user_id, conn=None):
         """Получает количество оставшихся запросов у пользователя"""
-        conn = self.connect()
-        if conn is None:
-            return 0
-        
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT requests_left FROM users WHERE user_id = %s", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else 0
-        except Error as e:
-            print(f"Ошибка при получении количества запросов: {e}")
-            return 0
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+        with self._connection(conn) as conn:
+            if conn is None:
+                return 0
+            try:
+                cursor = self.execute(conn, REQUESTS_LEFT_SQL, (user_id,))
+                result = cursor.fetchall()
+                return result[0][0] if result else 0
+            except Error as e:
+                print(f"Ошибка при получении количества запросов: {e}")
+                return 0
                 
-    def decrement_user_requests(self, user_id):
+    def decrement_user_requests(self, user_id, conn=None):
         """Уменьшает количество оставшихся запросов пользователя на 1"""
-        conn = self.connect()
-        if conn is None:
-            return False
-        
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE users 
-                SET requests_left = requests_left - 1
-                WHERE user_id = %s AND requests_left > 0
-            """, (user_id,))
-            conn.commit()
-            
-            # Получаем обновленное количество запросов
-            cursor.execute("SELECT requests_left FROM users WHERE user_id = %s", (user_id,))
-            result = cursor.fetchone()
-            
-            return result[0] if result else 0
-        except Error as e:
-            print(f"Ошибка при уменьшении количества запросов: {e}")
-            return -1
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+        with self._connection(conn) as conn:
+            if conn is None:
+                return False
+            try:
+                self.execute(conn, DECREMENT_REQUESTS_SQL, (user_id,))
+                conn.commit()
+
+                # Получаем обновленное количество запросов
+                cursor = self.execute(conn, REQUESTS_LEFT_SQL, (user_id,))
+                result = cursor.fetchall()
+                return result[0][0] if result else 0
+            except Error as e:
+                print(f"Ошибка при уменьшении количества запросов: {e}")
+                return -1
     
     def add_usage_record(self, user_id, request_type, ai_model, tokens_used=0, was_successful=True, 
-                         request_text=None, response_length=0, response_time=None):
+                         request_text=None, response_length=0, response_time=None, conn=None):
         """Добавляет запись об использовании API"""
-        conn = self.connect()
-        if conn is None:
-            return False
-        
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO request_usage 
-                (user_id, request_type, ai_model, tokens_used, was_successful, request_text, response_length, response_time) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                user_id, 
-                request_type, 
-                ai_model, 
-                tokens_used, 
-                was_successful, 
-                request_text[:100] if request_text else None,  # Сохраняем только первые 100 символов
-                response_length,
-                response_time
-            ))
-            
-            # Обновляем статистику пользователя
-            cursor.execute("""
-                UPDATE user_statistics 
-                SET total_requests = total_requests + 1,
-                    total_tokens = total_tokens + %s,
-                    last_active = NOW()
-                WHERE user_id = %s
-            """, (tokens_used, user_id))
-            
-            # Если запись статистики еще не существует, создаем ее
-            if cursor.rowcount == 0:
-                cursor.execute("""
-                    INSERT INTO user_statistics 
-                    (user_id, total_requests, total_tokens, last_active) 
-                    VALUES (%s, 1, %s, NOW())
-                """, (user_id, tokens_used))
-            
-            conn.commit()
-            return True
-        except Error as e:
-            print(f"Ошибка при добавлении записи использования: {e}")
-            return False
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close() 
\ No newline at end of file
+        with self._connection(conn) as conn:
+            if conn is None:
+                return False
+            try:
+                self.execute(conn, INSERT_USAGE_SQL, (
+                    user_id,
+                    request_type,
+                    ai_model,
+                    tokens_used,
+                    was_successful,
+                    request_text[:100] if request_text else None,  # Сохраняем только первые 100 символов
+                    response_length,
+                    response_time
+                ))
+
+                # Обновляем статистику пользователя
+                cursor = self.execute(conn, UPDATE_USAGE_STATS_SQL, (tokens_used, user_id))
+
+                # Если запись статистики еще не существует, создаем ее
+                if cursor.rowcount == 0:
+                    self.execute(conn, INSERT_USAGE_STATS_SQL, (user_id, tokens_used))
+
+                conn.commit()
+                return True
+            except Error as e:
+                print(f"Ошибка при добавлении записи использования: {e}")
+                return False
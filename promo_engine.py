@@ -0,0 +1,288 @@
+"""
+Движок промокодов: индекс активных промокодов в памяти процесса.
+
+Индекс загружается целиком (активные промокоды с разобранными allowed_plans,
+цены тарифов и уже использованные пары промокод-пользователь) и обновляется
+раз в refresh_interval секунд, поэтому проверка промокода не обращается к БД.
+Промокоды, истекшие не раньше EXPIRED_KEEP_DAYS дней назад, тоже попадают в
+индекс: на них проверка отвечает EXPIRED, а не NOT_FOUND.
+Покупка с промокодом, которого нет в индексе (создан или включен после
+загрузки), ищет его в БД (PROMO_BY_CODE_SQL), а не отклоняет.
+
+Лимит использований соблюдается одним условным UPDATE (REDEEM_SQL или
+PromoCode.objects.filter(...).update(...)): счетчик увеличивается, только
+если лимит еще не исчерпан, и по числу измененных строк видно, удалось ли
+погасить промокод. Повторное использование одним пользователем отсекает
+уникальный ключ (promo_code_id, user_id) в promo_code_usages.
+
+Используется API на Django (api/promo.py), api_server.py и payments_service.py.
+"""
+import threading
+import time
+from datetime import datetime
+
+# Сколько дней истекший промокод остается в индексе
+EXPIRED_KEEP_DAYS = 30
+
+# Загрузка индекса (параметры в стиле pymysql / mysql.connector)
+ACTIVE_PROMOS_SQL = f"""
+    SELECT id, code, discount_type, discount_value, bonus_requests, valid_from, valid_to,
+           max_usages, usages_count, allowed_plans
+    FROM promo_codes
+    WHERE is_active = TRUE AND (valid_to IS NULL OR valid_to > NOW() - INTERVAL {EXPIRED_KEEP_DAYS} DAY)
+"""
+PLAN_PRICES_SQL = "SELECT id, price FROM plans"
+ACTIVE_USAGES_SQL = """
+    SELECT u.promo_code_id, u.user_id
+    FROM promo_code_usages u
+    JOIN promo_codes p ON p.id = u.promo_code_id
+    WHERE p.is_active = TRUE AND (p.valid_to IS NULL OR p.valid_to > NOW())
+"""
+
+# Промокод по коду, когда его еще нет в индексе (создан или включен после загрузки)
+PROMO_BY_CODE_SQL = """
+    SELECT id, code, discount_type, discount_value, bonus_requests, valid_from, valid_to,
+           max_usages, usages_count, allowed_plans
+    FROM promo_codes
+    WHERE code = %s AND is_active = TRUE AND (valid_to IS NULL OR valid_to > NOW())
+"""
+
+# Погашение промокода одним запросом: 1 измененная строка - успешно
+REDEEM_SQL = """
+    UPDATE promo_codes
+    SET usages_count = usages_count + 1
+    WHERE id = %s
+      AND is_active = TRUE
+      AND valid_from <= NOW()
+      AND (valid_to IS NULL OR valid_to > NOW())
+      AND (max_usages = 0 OR usages_count < max_usages)
+"""
+
+# Сообщения об ошибках проверки
+NOT_FOUND = 'Промокод не найден или недействителен'
+NOT_STARTED = 'Промокод еще не действует'
+EXPIRED = 'Срок действия промокода истек'
+EXHAUSTED = 'Промокод уже использован максимальное количество раз'
+WRONG_PLAN = 'Промокод не применим к выбранному плану'
+ALREADY_USED = 'Вы уже использовали этот промокод'
+
+
+def parse_allowed_plans(value):
+    """'1, 2,3' -> frozenset({1, 2, 3}); пустое значение - None (любой тариф)"""
+    if not value:
+        return None
+    plans = set()
+    for part in str(value).split(','):
+        part = part.strip()
+        if part.isdigit():
+            plans.add(int(part))
+    return frozenset(plans)
+
+
+def compute_discount(promo, price):
+    """Скидка в рублях для тарифа с ценой price"""
+    price = float(price)
+    if promo.discount_type == 'percent':
+        return price * (promo.discount_value / 100)
+    if promo.discount_type == 'fixed':
+        return min(promo.discount_value, price)
+    return 0
+
+
+class PromoEntry:
+    """Промокод в индексе с уже разобранными полями"""
+    __slots__ = (
+        'id', 'code', 'discount_type', 'discount_value', 'bonus_requests',
+        'valid_from', 'valid_to', 'max_usages', 'usages_count', 'allowed_plans',
+    )
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.code = row['code']
+        self.discount_type = row['discount_type']
+        self.discount_value = float(row['discount_value'] or 0)
+        self.bonus_requests = row['bonus_requests'] or 0
+        self.valid_from = row['valid_from']
+        self.valid_to = row['valid_to']
+        self.max_usages = row['max_usages'] or 0
+        self.usages_count = row['usages_count'] or 0
+        self.allowed_plans = parse_allowed_plans(row['allowed_plans'])
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'code': self.code,
+            'discount_type': self.discount_type,
+            'discount_value': self.discount_value,
+            'bonus_requests': self.bonus_requests,
+        }
+
+
+class PromoCheck:
+    """Результат проверки: promo - PromoEntry или None, error - причина отказа"""
+    __slots__ = ('promo', 'error', 'price', 'discount_amount')
+
+    def __init__(self, promo=None, error=None, price=None, discount_amount=0):
+        self.promo = promo
+        self.error = error
+        self.price = price
+        self.discount_amount = discount_amount
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def price_after_discount(self):
+        if self.price is None:
+            return None
+        return max(0, self.price - self.discount_amount)
+
+
+def check_entry(promo, plan_id=None, now=None):
+    """Проверка сроков, лимита и тарифа одного промокода (без учета прошлых использований)"""
+    now = now or datetime.now()
+    if promo.valid_from and promo.valid_from > now:
+        return PromoCheck(promo, NOT_STARTED)
+    if promo.valid_to and promo.valid_to <= now:
+        return PromoCheck(promo, EXPIRED)
+    if promo.max_usages and promo.usages_count >= promo.max_usages:
+        return PromoCheck(promo, EXHAUSTED)
+    if plan_id:
+        try:
+            plan_id = int(plan_id)
+        except (TypeError, ValueError):
+            return PromoCheck(promo, WRONG_PLAN)
+        if promo.allowed_plans is not None and plan_id not in promo.allowed_plans:
+            return PromoCheck(promo, WRONG_PLAN)
+    return PromoCheck(promo)
+
+
+class PromoIndex:
+    """
+    Индекс промокодов, обновляемый раз в refresh_interval секунд.
+    load() возвращает (строки промокодов, {plan_id: цена}, пары (promo_id, user_id)).
+    """
+
+    def __init__(self, load, refresh_interval=30.0):
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self._codes = {}
+        self._by_id = {}
+        self._prices = {}
+        self._used = set()
+        self._loaded_at = None
+        self._refresh_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    @staticmethod
+    def _key(code):
+        # Сравнение кодов в MySQL по умолчанию регистронезависимое
+        return str(code).strip().casefold()
+
+    def refresh(self):
+        rows, prices, used = self.load()
+        codes = {}
+        for row in rows:
+            entry = PromoEntry(row)
+            codes[self._key(entry.code)] = entry
+        prices = {int(plan_id): float(price) for plan_id, price in dict(prices).items()}
+        # user_id в api_server - строка (UUID), поэтому пары храним со строковым ключом
+        used = {(int(promo_id), str(user_id)) for promo_id, user_id in used}
+        by_id = {entry.id: entry for entry in codes.values()}
+        with self._lock:
+            self._codes, self._by_id, self._prices, self._used = codes, by_id, prices, used
+            self._loaded_at = time.monotonic()
+        self.refreshes += 1
+
+    def _ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None:
+            with self._refresh_lock:
+                if self._loaded_at is None:
+                    self.refresh()
+            return
+        if time.monotonic() - loaded_at < self.refresh_interval:
+            return
+        # Обновляет один поток, остальные пока читают прежний снимок
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+                    self.refresh()
+            finally:
+                self._refresh_lock.release()
+
+    def invalidate(self):
+        """Следующая проверка перечитает индекс"""
+        with self._lock:
+            self._loaded_at = None
+
+    def get(self, code):
+        self._ensure_fresh()
+        return self._codes.get(self._key(code))
+
+    def plan_price(self, plan_id):
+        self._ensure_fresh()
+        try:
+            return self._prices.get(int(plan_id))
+        except (TypeError, ValueError):
+            return None
+
+    def check(self, code, plan_id=None, user_id=None, now=None):
+        """Проверка промокода без обращения к БД"""
+        promo = self.get(code)
+        if promo is None:
+            return PromoCheck(error=NOT_FOUND)
+        result = check_entry(promo, plan_id, now)
+        if not result.ok:
+            return result
+        if user_id is not None and (promo.id, str(user_id)) in self._used:
+            return PromoCheck(promo, ALREADY_USED)
+
+        if plan_id:
+            price = self.plan_price(plan_id)
+            if price is not None:
+                result.price = price
+                result.discount_amount = compute_discount(promo, price)
+        return result
+
+    def record_redemption(self, promo_id, user_id=None):
+        """Учесть погашение в снимке процесса до следующего обновления"""
+        with self._lock:
+            promo = self._by_id.get(promo_id)
+            if promo is not None:
+                promo.usages_count += 1
+            if user_id is not None:
+                self._used.add((promo_id, str(user_id)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'codes': len(self._codes),
+                'used_pairs': len(self._used),
+                'refreshes': self.refreshes,
+                'age': round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            }
+
+
+def sql_loader(connect, dict_cursor):
+    """
+    load() для PromoIndex поверх DB-API: connect() - новое соединение,
+    dict_cursor(conn) - курсор, возвращающий строки-словари.
+    """
+    def load():
+        conn = connect()
+        try:
+            cursor = dict_cursor(conn)
+            cursor.execute(ACTIVE_PROMOS_SQL)
+            rows = cursor.fetchall()
+            cursor.execute(PLAN_PRICES_SQL)
+            prices = {row['id']: row['price'] for row in cursor.fetchall()}
+            cursor.execute(ACTIVE_USAGES_SQL)
+            used = [(row['promo_code_id'], row['user_id']) for row in cursor.fetchall()]
+            cursor.close()
+        finally:
+            conn.close()
+        return rows, prices, used
+    return load
@@ -0,0 +1,84 @@
+"""
+Рейтинг по счетчикам в памяти процесса.
+
+RankedBoard хранит {ключ: счет} и отсортированный список пар (-счет, ключ),
+поэтому место в рейтинге находится бинарным поиском (bisect), первые N - срезом
+списка, а изменение счета - удалением и вставкой в отсортированный список без
+пересортировки. Используется таблицей лидеров рефералов (bot_admin/leaderboard.py).
+
+Периоды рейтинга: день, неделя (с понедельника) и все время. Счетчики периодов
+хранятся в referral_leaderboard с датой начала периода.
+"""
+import bisect
+from datetime import date, timedelta
+
+DAY = 'day'
+WEEK = 'week'
+ALL_TIME = 'all'
+PERIODS = (DAY, WEEK, ALL_TIME)
+
+# Дата начала "периода" за все время
+ALL_TIME_START = date(2000, 1, 1)
+
+
+def period_start(period, day):
+    """Дата начала периода, в который попадает день day"""
+    if period == DAY:
+        return day
+    if period == WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == ALL_TIME:
+        return ALL_TIME_START
+    raise ValueError(f'Неизвестный период рейтинга: {period}')
+
+
+def period_starts(day):
+    """[(период, дата начала)] для всех периодов, в которые попадает день day"""
+    return [(period, period_start(period, day)) for period in PERIODS]
+
+
+class RankedBoard:
+    """Счетчики по ключам, упорядоченные по убыванию счета (при равенстве - по ключу)"""
+
+    def __init__(self, counts=()):
+        self._counts = {key: count for key, count in dict(counts).items() if count > 0}
+        self._order = sorted((-count, key) for key, count in self._counts.items())
+
+    def __len__(self):
+        return len(self._counts)
+
+    def count(self, key):
+        return self._counts.get(key, 0)
+
+    def add(self, key, delta=1):
+        """Изменяет счет ключа на delta, возвращает новый счет"""
+        old = self._counts.get(key, 0)
+        new = old + delta
+        if old > 0:
+            del self._order[bisect.bisect_left(self._order, (-old, key))]
+        if new > 0:
+            bisect.insort(self._order, (-new, key))
+            self._counts[key] = new
+        else:
+            self._counts.pop(key, None)
+        return new
+
+    def rank(self, key):
+        """Место ключа (1 - первое; равный счет - одинаковое место) или None"""
+        count = self._counts.get(key)
+        if count is None:
+            return None
+        # (-count,) меньше любой пары (-count, key): это число ключей с большим счетом
+        return bisect.bisect_left(self._order, (-count,)) + 1
+
+    def top(self, limit):
+        """[(место, ключ, счет)] для первых limit ключей"""
+        result = []
+        rank = 0
+        previous = None
+        for position, (negative, key) in enumerate(self._order[:limit]):
+            if negative != previous:
+                rank = position + 1
+                previous = negative
+            result.append((rank, key, -negative))
+        return result
@@ -0,0 +1,98 @@
+"""
+SQL для счетчиков реферальной программы в user_statistics, referral_codes
+и referral_leaderboard.
+
+total_referrals и total_referral_revenue пригласившего обновляются одним
+запросом в момент записи реферала и зачисления платежа, поэтому списки и
+сводки рефералов читают готовые значения вместо COUNT/SUM по истории.
+Django-код обновляет те же счетчики через bot_admin/referrals.py.
+
+Строки статистики может еще не быть, поэтому используется
+INSERT ... ON DUPLICATE KEY UPDATE по уникальному user_statistics.user_id.
+"""
+import ranking
+
+# Платеж с таким статусом засчитывается в доход от рефералов
+PAID_STATUSES = ('completed', 'succeeded', 'success', 'paid')
+
+# Параметр: user_id пригласившего
+REFERRAL_RECORDED_SQL = """
+    INSERT INTO user_statistics
+        (user_id, total_requests, total_tokens, total_payments, total_referrals, total_referral_revenue, account_level)
+    VALUES (%s, 0, 0, 0, 1, 0, 'standard')
+    ON DUPLICATE KEY UPDATE total_referrals = total_referrals + 1
+"""
+
+# Параметры: время перехода, id реферального кода
+REFERRAL_CODE_USED_SQL = """
+    UPDATE referral_codes
+    SET total_uses = total_uses + 1,
+        last_used_at = %s
+    WHERE id = %s
+"""
+
+# Параметры: сумма платежа, user_id заплатившего приглашенного пользователя
+REFERRAL_REVENUE_SQL = """
+    INSERT INTO user_statistics
+        (user_id, total_requests, total_tokens, total_payments, total_referrals, total_referral_revenue, account_level)
+    SELECT rh.referrer_id, 0, 0, 0, 0, %s, 'standard'
+    FROM referral_history rh
+    WHERE rh.referred_id = %s
+    ORDER BY rh.id
+    LIMIT 1
+    ON DUPLICATE KEY UPDATE total_referral_revenue = total_referral_revenue + VALUES(total_referral_revenue)
+"""
+
+# Счетчики таблицы лидеров за день, неделю и все время (см. ranking.py).
+# Параметры: user_id пригласившего, период, дата начала - для каждого из ranking.PERIODS
+REFERRAL_LEADERBOARD_SQL = """
+    INSERT INTO referral_leaderboard (user_id, period, period_start, referrals, updated_at)
+    VALUES (%s, %s, %s, 1, NOW()), (%s, %s, %s, 1, NOW()), (%s, %s, %s, 1, NOW())
+    ON DUPLICATE KEY UPDATE referrals = referrals + 1, updated_at = NOW()
+"""
+
+
+def leaderboard_params(user_id, day):
+    """Параметры REFERRAL_LEADERBOARD_SQL для реферала, записанного в день day"""
+    params = []
+    for period, start in ranking.period_starts(day):
+        params.extend((user_id, period, start))
+    return params
+
+
+# Дерево рефералов (см. bot_admin/referral_tree.py): пары "предок пригласившего
+# (и он сам) - потомок приглашенного (и он сам)" не глубже заданной глубины.
+# Ничего не добавляется, если у приглашенного уже есть пригласивший или он сам
+# предок пригласившего (ребро замкнуло бы цикл). Параметры - closure_params().
+REFERRAL_CLOSURE_SQL = """
+    INSERT IGNORE INTO referral_closure (ancestor_id, descendant_id, depth)
+    SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+    FROM (
+        SELECT ancestor_id, depth FROM referral_closure WHERE descendant_id = %s
+        UNION ALL SELECT %s, 0
+    ) a
+    CROSS JOIN (
+        SELECT descendant_id, depth FROM referral_closure WHERE ancestor_id = %s
+        UNION ALL SELECT %s, 0
+    ) d
+    WHERE a.depth + d.depth + 1 <= %s
+      AND NOT EXISTS (SELECT 1 FROM referral_closure p WHERE p.descendant_id = %s AND p.depth = 1)
+      AND NOT EXISTS (SELECT 1 FROM referral_closure c WHERE c.ancestor_id = %s AND c.descendant_id = %s)
+"""
+
+
+def closure_params(referrer_id, referred_id, max_depth):
+    """Параметры REFERRAL_CLOSURE_SQL"""
+    return (referrer_id, referrer_id, referred_id, referred_id, max_depth, referred_id, referred_id, referrer_id)
+
+
+# То же для схемы api_server.py, где пригласивший хранится в users.referrer_id.
+# Параметры: сумма платежа, id заплатившего пользователя
+REFERRAL_REVENUE_BY_REFERRER_SQL = """
+    INSERT INTO user_statistics
+        (user_id, total_requests, total_tokens, total_payments, total_referrals, total_referral_revenue, account_level)
+    SELECT u.referrer_id, 0, 0, 0, 0, %s, 'standard'
+    FROM users u
+    WHERE u.id = %s AND u.referrer_id IS NOT NULL
+    ON DUPLICATE KEY UPDATE total_referral_revenue = total_referral_revenue + VALUES(total_referral_revenue)
+"""
@@ -5,29 +5,56 @@
 from flask import Blueprint, request, jsonify, g
 from database import Database
 from middleware.auth import token_required
-import os
+from catalog_cache import PLANS, CatalogCache
+import config
 import datetime
 
 # Создаем блюпринт для планов подписки
 plans_bp = Blueprint('plans', __name__)
 
+def _load_plans_version():
+    try:
+        row = Database.fetch_one("SELECT version FROM catalog_versions WHERE name = %s", (PLANS,))
+    except Exception:
+        # Без таблицы версий работаем без кэша
+        return None
+    return row['version'] if row else 0
+
+
+plans_cache = CatalogCache(
+    PLANS, load_version=_load_plans_version, check_interval=config.CATALOG_VERSION_CHECK_INTERVAL
+)
+
+
+def _cached_response(entry, data):
+    """Ответ с Cache-Control и строгим ETag версии, из которой построена запись кэша"""
+    response = jsonify(data)
+    response.headers['Cache-Control'] = f'public, max-age={config.CATALOG_CACHE_MAX_AGE}'
+    if entry.etag:
+        response.set_etag(entry.etag.strip('"'))
+    return response.make_conditional(request)
+
+
 @plans_bp.route('/', methods=['GET'])
 def get_all_plans():
     """
     Получение всех доступных планов подписки
     """
-    query = """
-    SELECT id, name, description, request_limit, price, validity_days, 
-           is_active, created_at, updated_at
-    FROM plans
-    WHERE is_active = 1
-    ORDER BY price ASC
-    """
-    plans = Database.fetch_all(query)
+    def build():
+        query = """
+        SELECT id, name, description, request_limit, price, validity_days, 
+               is_active, created_at, updated_at
+        FROM plans
+        WHERE is_active = 1
+        ORDER BY price ASC
+        """
+        return Database.fetch_all(query)
+
+    entry = plans_cache.get('plans', build)
     
-    return jsonify({
+    return _cached_response(entry, {
         'success': True,
-        'plans': plans
+        'plans': entry.data
     })
 
 @plans_bp.route('/<int:plan_id>', methods=['GET'])
@@ -35,13 +62,17 @@ def get_plan_details(plan_id):
     """
     Получение детальной информации о конкретном плане
     """
-    query = """
-    SELECT id, name, description, request_limit, price, validity_days, 
-           is_active, created_at, updated_at
-    FROM plans
-    WHERE id = %s AND is_active = 1
-    """
-    plan = Database.fetch_one(query, (plan_id,))
+    def build():
+        query = """
+        SELECT id, name, description, request_limit, price, validity_days, 
+               is_active, created_at, updated_at
+        FROM plans
+        WHERE id = %s AND is_active = 1
+        """
+        return Database.fetch_one(query, (plan_id,))
+
+    entry = plans_cache.get(f'plans/{plan_id}', build)
+    plan = entry.data
     
     if not plan:
         return jsonify({
@@ -49,7 +80,7 @@ def get_plan_details(plan_id):
             'message': 'План не найден или не активен'
         }), 404
     
-    return jsonify({
+    return _cached_response(entry, {
         'success': True,
         'plan': plan
     })
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Воркеры очереди вебхуков отдельным процессом (см. payment_queue.py).
+
+python api_server.py запускает воркеры сам; под WSGI-сервером блок __main__
+не выполняется, и без этого процесса события, оставшиеся в очереди после
+перезапуска, ждали бы первого нового вебхука:
+
+    gunicorn api_server:app
+    python run_webhook_workers.py
+
+Процесс должен работать с тем же WEBHOOK_QUEUE_PATH, что и сервер.
+"""
+import time
+
+import api_server
+import config
+
+
+def main():
+    workers = api_server.start_webhook_workers()
+    print(f"Воркеры очереди вебхуков запущены: {workers.workers}, очередь {config.WEBHOOK_QUEUE_PATH}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        workers.stop(timeout=30)
+        print(f"Воркеры остановлены: {workers.stats()}")
+
+
+if __name__ == '__main__':
+    main()